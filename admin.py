@@ -2,7 +2,8 @@
 
 from django.contrib import admin
 from .models import Task, UserProfile, Department, TaskChat
-from .models import ActivityLog
+from .models import ActivityLog, DepartmentMetricsSnapshot, EmailOutbox, TaskViewer
+from .models import ChatReadCursor, JobLease, NotificationLedger, NotificationPreference, PendingNotification, RecurrenceRule
 
 @admin.register(Task)
 class TaskAdmin(admin.ModelAdmin):
@@ -29,3 +30,56 @@ class ActivityLogAdmin(admin.ModelAdmin):
     list_filter = ('action', 'timestamp')  # Add filters for easier navigation
     search_fields = ('user__username', 'task__task_id', 'description')  # Enable searching by user, task ID, and description
     ordering = ('-timestamp',)  # Order by most recent activity
+
+@admin.register(DepartmentMetricsSnapshot)
+class DepartmentMetricsSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('department', 'open_tickets_received', 'open_tickets_raised', 'tickets_passed_72_hours', 'tickets_passed_revised_deadline', 'reconciled_at')
+    readonly_fields = ('reconciled_at', 'updated_at')
+
+@admin.register(TaskViewer)
+class TaskViewerAdmin(admin.ModelAdmin):
+    list_display = ('task', 'email', 'user', 'added_at')
+    search_fields = ('task__task_id', 'email')
+    raw_id_fields = ('task', 'user')
+
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('subject', 'last_error')
+    readonly_fields = ('claim_token', 'claimed_at', 'created_at', 'sent_at')
+
+@admin.register(NotificationPreference)
+class NotificationPreferenceAdmin(admin.ModelAdmin):
+    list_display = ('user', 'mode', 'updated_at')
+    list_filter = ('mode',)
+    search_fields = ('user__username', 'user__email')
+
+@admin.register(PendingNotification)
+class PendingNotificationAdmin(admin.ModelAdmin):
+    list_display = ('user', 'subject', 'created_at')
+    search_fields = ('user__username', 'subject')
+    raw_id_fields = ('user',)
+
+@admin.register(NotificationLedger)
+class NotificationLedgerAdmin(admin.ModelAdmin):
+    list_display = ('task', 'kind', 'period', 'sent_at')
+    list_filter = ('kind', 'period')
+    search_fields = ('task__task_id',)
+    raw_id_fields = ('task',)
+
+@admin.register(JobLease)
+class JobLeaseAdmin(admin.ModelAdmin):
+    list_display = ('name', 'holder', 'expires_at', 'last_run_at')
+
+@admin.register(RecurrenceRule)
+class RecurrenceRuleAdmin(admin.ModelAdmin):
+    list_display = ('task', 'recurrence_type', 'interval', 'count', 'start_date', 'materialized_through', 'active')
+    list_filter = ('recurrence_type', 'active')
+    raw_id_fields = ('task',)
+
+@admin.register(ChatReadCursor)
+class ChatReadCursorAdmin(admin.ModelAdmin):
+    list_display = ('user', 'task', 'last_read_id', 'updated_at')
+    search_fields = ('user__username', 'task__task_id')
+    raw_id_fields = ('user', 'task')
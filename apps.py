@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class TaskAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'task_app'
+
+    def ready(self):
+        # Connects the task_changed receivers, the profile and unread-count
+        # cache invalidation and the live event publishers
+        from . import chat, counters, events, profiles  # noqa: F401
@@ -0,0 +1,141 @@
+# task_app/chat.py
+
+import base64
+from collections import namedtuple
+from datetime import datetime
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, FilteredRelation, Max, Q
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import ChatReadCursor, Task, TaskChat
+
+CHAT_PAGE_SIZE = 30
+MAX_CHAT_PAGE_SIZE = 100
+# New messages and reads clear a user's total; this bounds what they miss,
+# such as a task reassigned to them
+UNREAD_TOTAL_TIMEOUT = 60
+
+# ``messages`` oldest first; ``before`` is the cursor for the page older than it
+ChatPage = namedtuple('ChatPage', 'messages before')
+
+
+def encode_cursor(message):
+    raw = f'{message.timestamp.isoformat()}|{message.pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        timestamp, pk = raw.split('|')
+        return datetime.fromisoformat(timestamp), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Invalid chat cursor.')
+
+
+def chat_page(task, before=None, page_size=CHAT_PAGE_SIZE):
+    """
+    The ``page_size`` newest messages of ``task``, or the ones just older than
+    the ``before`` cursor, read newest first on (timestamp, id).
+    """
+    messages = TaskChat.objects.filter(task=task).select_related('sender')
+    if before:
+        timestamp, pk = decode_cursor(before)
+        messages = messages.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, pk__lt=pk))
+    rows = list(messages.order_by('-timestamp', '-pk')[:page_size + 1])
+    older = len(rows) > page_size
+    rows = rows[:page_size][::-1]
+    return ChatPage(rows, encode_cursor(rows[0]) if older else None)
+
+
+def parse_page_size(params):
+    try:
+        page_size = min(int(params.get('page_size', CHAT_PAGE_SIZE)), MAX_CHAT_PAGE_SIZE)
+    except ValueError:
+        raise ValueError("'page_size' must be an integer.")
+    if page_size < 1:
+        raise ValueError("'page_size' must be positive.")
+    return page_size
+
+
+def message_payload(message, user):
+    """A message as JSON, with its chat bubble rendered for ``user``."""
+    return {
+        'id': message.pk,
+        'sender': message.sender.get_full_name() or message.sender.username,
+        'timestamp': message.timestamp.isoformat(),
+        'message': message.message,
+        'html': render_to_string('tasks/chat_message.html', {'message': message, 'user': user}),
+    }
+
+
+def latest_message_id(task):
+    """The id of ``task``'s newest message, or 0 if it has none."""
+    return TaskChat.objects.filter(task=task).aggregate(latest=Max('pk'))['latest'] or 0
+
+
+def mark_read(user, task, last_read_id):
+    """
+    Move ``user``'s read cursor on ``task`` forward to ``last_read_id``. The
+    cursor never moves back, so a late request from an older tab or a
+    reordered retry cannot mark read messages unread again.
+    """
+    cursor = ChatReadCursor.objects.filter(user=user, task=task, last_read_id__lte=last_read_id)
+    if not cursor.update(last_read_id=last_read_id, updated_at=timezone.now()):
+        try:
+            with transaction.atomic():
+                ChatReadCursor.objects.create(user=user, task=task, last_read_id=last_read_id)
+        except IntegrityError:
+            # The cursor exists, already this far along or moved by another request
+            cursor.update(last_read_id=last_read_id, updated_at=timezone.now())
+    cache.delete(_unread_total_key(user.pk))
+
+
+def unread_counts(user, tasks=None):
+    """
+    {task pk: unread messages} over ``tasks`` (by default the ones ``user``
+    assigned or is assigned), leaving out tasks with none and ``user``'s own
+    messages. One query: the tasks joined to the user's cursor and to the
+    messages past it.
+    """
+    if tasks is None:
+        tasks = Task.objects.filter(Q(assigned_to=user) | Q(assigned_by=user))
+    rows = (
+        tasks.order_by()
+        .alias(cursor=FilteredRelation('chat_read_cursors', condition=Q(chat_read_cursors__user=user)))
+        .alias(unread_messages=FilteredRelation('chat_messages', condition=(
+            Q(chat_messages__pk__gt=Coalesce(F('cursor__last_read_id'), 0)) & ~Q(chat_messages__sender=user)
+        )))
+        .values('pk')
+        .annotate(unread=Count('unread_messages'))
+        .filter(unread__gt=0)
+        .values_list('pk', 'unread')
+    )
+    return dict(rows)
+
+
+def _unread_total_key(user_id):
+    return f'chat_unread_total:{user_id}'
+
+
+def unread_total(user):
+    """All of ``user``'s unread messages, cached for UNREAD_TOTAL_TIMEOUT."""
+    key = _unread_total_key(user.pk)
+    total = cache.get(key)
+    if total is None:
+        total = sum(unread_counts(user).values())
+        cache.set(key, total, UNREAD_TOTAL_TIMEOUT)
+    return total
+
+
+@receiver(post_save, sender=TaskChat)
+def invalidate_unread_totals(sender, instance, created, **kwargs):
+    if created:
+        task = instance.task
+        cache.delete_many([_unread_total_key(user_id) for user_id in (task.assigned_to_id, task.assigned_by_id) if user_id])
@@ -1,9 +1,13 @@
 # task_app/context_processors.py
 
 from .models import UserProfile
+from .profiles import get_profile
 
 def user_category(request):
     if request.user.is_authenticated:
-        user_profile = UserProfile.objects.filter(user=request.user).first()
+        try:
+            user_profile = get_profile(request)
+        except UserProfile.DoesNotExist:
+            user_profile = None
         return {'user_category': user_profile.category if user_profile else None}
     return {}
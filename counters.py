@@ -0,0 +1,243 @@
+# task_app/counters.py
+
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .metrics import FLOW_FIELDS, OPEN_STATUSES, SNAPSHOT_FIELDS, aggregate_open_counters, history_flow, truncate_to_hour
+from .models import Department, DepartmentHourlyFlow, DepartmentMetricsSnapshot, Task
+from .signals import task_changed
+
+# Task columns that decide which counters a task contributes to
+TRACKED_FIELDS = (
+    'status', 'department_id', 'assignor_department_id', 'assigned_to_id',
+    'assigned_date', 'deadline', 'revised_completion_date',
+)
+
+
+def _as_datetime(value):
+    # Views assign plain dates to assigned_date; compare them as midnight
+    if isinstance(value, datetime):
+        return value if timezone.is_aware(value) else timezone.make_aware(value)
+    return timezone.make_aware(datetime(value.year, value.month, value.day))
+
+
+def _tracked_state(values):
+    """Pick the tracked columns out of a task, or None if any are unknown."""
+    if values is None:
+        return None
+    if not isinstance(values, dict):
+        values = {name: getattr(values, name) for name in TRACKED_FIELDS}
+    if any(name not in values for name in TRACKED_FIELDS):
+        return None
+    return {name: values[name] for name in TRACKED_FIELDS}
+
+
+def task_contribution(state):
+    """
+    Counters a single task adds to, as ``{(department_id, field): 1}``.
+    tickets_passed_72_hours depends on the clock rather than on the write, so
+    it is not kept as a delta: the metrics count it live and the reconcile
+    job refreshes the stored value.
+    """
+    counts = Counter()
+    if state['status'] not in OPEN_STATUSES:
+        return counts
+
+    department_id = state['department_id']
+    if department_id is not None:
+        counts[(department_id, 'open_tickets_received')] += 1
+        if state['status'] == 'Overdue':
+            counts[(department_id, 'tickets_passed_revised_deadline')] += 1
+
+    if state['assignor_department_id'] is not None:
+        counts[(state['assignor_department_id'], 'open_tickets_raised')] += 1
+    return counts
+
+
+def record_task_transition(old_values, task):
+    """
+    Apply the counter delta for one task write. ``old_values`` are the columns
+    as last loaded from the database (None for a new task) and ``task`` is the
+    saved instance (None for a deletion). Must run inside the write's
+    transaction so the counters commit or roll back with the task.
+    """
+    old_state = _tracked_state(old_values)
+    new_state = _tracked_state(task)
+    if old_state == new_state:
+        return
+
+    delta = Counter()
+    if new_state is not None:
+        delta.update(task_contribution(new_state))
+    if old_state is not None:
+        delta.subtract(task_contribution(old_state))
+    _apply_counter_delta(delta)
+
+
+@receiver(task_changed, sender=Task)
+def update_counters_on_task_change(sender, instance, created, changes, **kwargs):
+    """Keep the per-department counters and hourly flow in step with a task write."""
+    if created:
+        record_task_transition(None, instance)
+        record_task_flow(None, instance)
+        return
+    if not changes.keys() & set(TRACKED_FIELDS):
+        return
+    if any(name not in instance.__dict__ for name in TRACKED_FIELDS):
+        # Partially loaded task; reconcile_department_metrics corrects it
+        return
+    old_values = {name: getattr(instance, name) for name in TRACKED_FIELDS}
+    old_values.update({name: old for name, (old, new) in changes.items() if name in TRACKED_FIELDS})
+    record_task_transition(old_values, instance)
+    record_task_flow(old_values, instance)
+
+
+def _apply_counter_delta(delta):
+    """
+    Add ``{(department_id, field): n}`` onto the snapshots. A department
+    without a snapshot row gets one counted from the Task table, which
+    already includes this transaction's writes, so the delta is not added.
+    """
+    per_department = defaultdict(dict)
+    for (department_id, field), value in delta.items():
+        if value:
+            per_department[department_id][field] = F(field) + value
+    for department_id, updates in per_department.items():
+        snapshot = DepartmentMetricsSnapshot.objects.filter(department_id=department_id)
+        if snapshot.update(**updates):
+            continue
+        now = timezone.now()
+        counters = aggregate_open_counters(now, department_ids=[department_id]).get(department_id, {})
+        try:
+            with transaction.atomic():
+                DepartmentMetricsSnapshot.objects.create(
+                    department_id=department_id,
+                    reconciled_at=now,
+                    **{field: counters.get(field, 0) for field in SNAPSHOT_FIELDS}
+                )
+        except IntegrityError:
+            # Another writer created the row first, from a count that cannot
+            # see this transaction's write
+            snapshot.update(**updates)
+
+
+def reconcile_department_metrics(now=None):
+    """
+    Rewrite every department's snapshot from the Task table. The snapshot rows
+    are locked first so concurrent task writes queue behind the reconcile and
+    apply their deltas on top of the recomputed values.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        list(DepartmentMetricsSnapshot.objects.select_for_update().values_list('id', flat=True))
+        counters = aggregate_open_counters(now)
+        snapshots = [
+            DepartmentMetricsSnapshot(
+                department_id=department_id,
+                reconciled_at=now,
+                **{field: counters.get(department_id, {}).get(field, 0) for field in SNAPSHOT_FIELDS}
+            )
+            for department_id in Department.objects.values_list('id', flat=True)
+        ]
+        DepartmentMetricsSnapshot.objects.bulk_create(
+            snapshots,
+            update_conflicts=True,
+            unique_fields=['department'],
+            update_fields=[*SNAPSHOT_FIELDS, 'reconciled_at', 'updated_at'],
+        )
+    return len(snapshots)
+
+
+def _bump_flow(increments):
+    """Add ``{(department_id, hour): {field: n}}`` onto the hourly buckets."""
+    for (department_id, hour), fields in increments.items():
+        updates = {field: F(field) + value for field, value in fields.items()}
+        bucket = DepartmentHourlyFlow.objects.filter(department_id=department_id, hour=hour)
+        if bucket.update(**updates):
+            continue
+        try:
+            with transaction.atomic():
+                DepartmentHourlyFlow.objects.create(department_id=department_id, hour=hour, **fields)
+        except IntegrityError:
+            # Another writer created the bucket first
+            bucket.update(**updates)
+
+
+def record_task_flow(old_values, task, now=None):
+    """
+    Count one task write into the hourly flow buckets: creations count as
+    received (for the task's department) and raised (for the assignor's
+    department) in the hour of ``assigned_date``; moving to Completed and
+    changing the assignee count in the current hour.
+    """
+    new_state = _tracked_state(task)
+    if new_state is None:
+        return
+    old_state = _tracked_state(old_values)
+    now = now or timezone.now()
+    increments = defaultdict(Counter)
+
+    if old_values is None:
+        _count_creation(new_state, increments)
+    elif old_state is not None and new_state['department_id'] is not None:
+        hour = truncate_to_hour(now)
+        if old_state['status'] != 'Completed' and new_state['status'] == 'Completed':
+            increments[(new_state['department_id'], hour)]['tickets_completed'] += 1
+        if old_state['assigned_to_id'] != new_state['assigned_to_id']:
+            increments[(new_state['department_id'], hour)]['tickets_reassigned'] += 1
+
+    if increments:
+        _bump_flow(increments)
+
+
+def _count_creation(state, increments):
+    hour = truncate_to_hour(_as_datetime(state['assigned_date']))
+    if state['department_id'] is not None:
+        increments[(state['department_id'], hour)]['tickets_received'] += 1
+    if state['assignor_department_id'] is not None:
+        increments[(state['assignor_department_id'], hour)]['tickets_raised'] += 1
+
+
+def record_tasks_created(tasks):
+    """
+    Counter and flow updates for new tasks inserted with bulk_create, which
+    skips Task.save. Summed over all ``tasks`` first, so the cost is per
+    department and hour rather than per task.
+    """
+    delta = Counter()
+    increments = defaultdict(Counter)
+    for task in tasks:
+        state = _tracked_state(task)
+        delta.update(task_contribution(state))
+        _count_creation(state, increments)
+    _apply_counter_delta(delta)
+    if increments:
+        _bump_flow(increments)
+
+
+def backfill_department_flow(since=None):
+    """
+    Rebuild the hourly flow buckets from ``since`` onwards (everything when
+    None). Received / raised come from Task.assigned_date; completions and
+    reassignments come from ActivityLog. Returns the number of buckets written.
+    """
+    buckets = history_flow(since)
+
+    with transaction.atomic():
+        stale = DepartmentHourlyFlow.objects.all()
+        if since is not None:
+            stale = stale.filter(hour__gte=truncate_to_hour(since))
+        stale.delete()
+        DepartmentHourlyFlow.objects.bulk_create(
+            [
+                DepartmentHourlyFlow(department_id=department_id, hour=hour, **{f: counts[f] for f in FLOW_FIELDS})
+                for (department_id, hour), counts in buckets.items()
+            ],
+            batch_size=1000,
+        )
+    return len(buckets)
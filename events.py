@@ -0,0 +1,374 @@
+# task_app/events.py
+
+import asyncio
+import itertools
+import json
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict, deque, namedtuple
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.signals import setting_changed
+from django.db import DatabaseError, close_old_connections, transaction
+from django.db.models import Q
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.http import HttpResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import LiveEvent, TaskChat
+from .signals import task_changed
+
+logger = logging.getLogger(__name__)
+
+# Every worker process reads the LiveEvent table, so event ids and replays
+# agree whichever worker a poll or reconnect lands on
+DEFAULT_BACKEND = 'task_app.events.DatabaseBackend'
+
+# Under ASGI a stream ends after this long and the browser reconnects with
+# Last-Event-ID, so no connection lives forever
+STREAM_SECONDS = 5 * 60
+HEARTBEAT_SECONDS = 15
+RECONNECT_MILLISECONDS = 3000
+# Under WSGI a stream would hold a worker thread, so the browser polls instead
+SHORT_POLL_MILLISECONDS = 5000
+QUEUE_SIZE = 500
+REPLAY_LIMIT = 500
+POLL_SECONDS = 1
+# Rows committed this late after a higher id are still picked up
+POLL_LAG = timedelta(seconds=5)
+EVENT_RETENTION = timedelta(hours=1)
+
+# ``kind`` is the SSE event name: 'chat' or 'task'
+Event = namedtuple('Event', 'id channel kind data')
+
+
+def task_channel(task_id):
+    return f'task:{task_id}'
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+
+class _Subscription(queue.Queue):
+    overflowed = False
+    # Called from the delivering thread after each event is queued
+    wake = None
+
+
+class Hub:
+    """Fans events out to the streams of this process subscribed to their channel."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def subscribe(self, channels, wake=None):
+        subscription = _Subscription(maxsize=QUEUE_SIZE)
+        subscription.wake = wake
+        with self._lock:
+            for channel in channels:
+                self._subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription, channels):
+        with self._lock:
+            for channel in channels:
+                self._subscriptions[channel].discard(subscription)
+                if not self._subscriptions[channel]:
+                    del self._subscriptions[channel]
+
+    def has_subscribers(self):
+        return bool(self._subscriptions)
+
+    def deliver(self, events):
+        with self._lock:
+            targets = [(subscription, event) for event in events
+                       for subscription in self._subscriptions.get(event.channel, ())]
+        for subscription, event in targets:
+            try:
+                subscription.put_nowait(event)
+            except queue.Full:
+                # The stream ends and its client replays from its last event
+                subscription.overflowed = True
+            if subscription.wake is not None:
+                try:
+                    subscription.wake()
+                except RuntimeError:
+                    # The stream's event loop has already closed
+                    pass
+
+
+class LocalBackend:
+    """
+    Events stay within this process. Only for a single worker process, such
+    as runserver, and tests: another worker would hand out its own ids and
+    replay none of these events.
+    """
+
+    def __init__(self, hub):
+        self.hub = hub
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._recent = deque(maxlen=REPLAY_LIMIT)
+
+    def start(self):
+        pass
+
+    def publish(self, messages):
+        with self._lock:
+            events = [Event(next(self._ids), channel, kind, data) for channel, kind, data in messages]
+            self._recent.extend(events)
+        self.hub.deliver(events)
+
+    def replay(self, channels, after_id):
+        return [event for event in list(self._recent) if event.id > after_id and event.channel in channels]
+
+    def latest_id(self):
+        recent = list(self._recent)
+        return recent[-1].id if recent else 0
+
+
+class DatabaseBackend:
+    """
+    Events go through the LiveEvent table, which one thread per process polls
+    on behalf of all of its streams, so every worker sees every event.
+    """
+
+    def __init__(self, hub):
+        self.hub = hub
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._poll, name='live-events', daemon=True)
+                self._thread.start()
+
+    def publish(self, messages):
+        LiveEvent.objects.bulk_create([LiveEvent(channel=channel, kind=kind, data=data) for channel, kind, data in messages])
+
+    def replay(self, channels, after_id):
+        rows = LiveEvent.objects.filter(channel__in=channels, pk__gt=after_id).order_by('pk')[:REPLAY_LIMIT]
+        return [_event(row) for row in rows]
+
+    def latest_id(self):
+        return LiveEvent.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+
+    def _poll(self):
+        last_id = None
+        seen = {}
+        while True:
+            time.sleep(POLL_SECONDS)
+            if not self.hub.has_subscribers():
+                last_id = None
+                continue
+            try:
+                now = timezone.now()
+                if last_id is None:
+                    # Start from now; the events already there are only for replays
+                    last_id = LiveEvent.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+                    seen = dict(LiveEvent.objects.filter(created_at__gte=now - POLL_LAG).values_list('pk', 'created_at'))
+                    continue
+                rows = list(
+                    LiveEvent.objects.filter(Q(pk__gt=last_id) | Q(created_at__gte=now - POLL_LAG))
+                    .order_by('pk')[:REPLAY_LIMIT]
+                )
+            except DatabaseError:
+                logger.exception("Polling live events failed")
+                close_old_connections()
+                continue
+            events = [_event(row) for row in rows if row.pk not in seen]
+            for row in rows:
+                seen[row.pk] = row.created_at
+            seen = {pk: created_at for pk, created_at in seen.items() if created_at >= now - 2 * POLL_LAG}
+            if rows:
+                last_id = max(last_id, rows[-1].pk)
+            self.hub.deliver(events)
+
+
+def _event(row):
+    return Event(row.pk, row.channel, row.kind, row.data)
+
+
+hub = Hub()
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """The backend named by the TASK_EVENTS_BACKEND setting, built once per process."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = import_string(getattr(settings, 'TASK_EVENTS_BACKEND', DEFAULT_BACKEND))(hub)
+        return _backend
+
+
+@receiver(setting_changed)
+def _reset_backend(setting, **kwargs):
+    global _backend
+    if setting == 'TASK_EVENTS_BACKEND':
+        with _backend_lock:
+            _backend = None
+
+
+def publish(messages):
+    """Publish ``(channel, kind, data)`` messages once the current transaction commits."""
+    messages = [(channel, kind, _jsonable(data)) for channel, kind, data in messages]
+    if messages:
+        # robust: a failed publish is logged rather than failing the committed request
+        transaction.on_commit(lambda: get_backend().publish(messages), robust=True)
+
+
+class _EventEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        try:
+            return super().default(o)
+        except TypeError:
+            return str(o)
+
+
+def _jsonable(data):
+    return json.loads(json.dumps(data, cls=_EventEncoder))
+
+
+def prune_live_events(now=None):
+    """Delete events older than EVENT_RETENTION. Returns how many went."""
+    now = now or timezone.now()
+    return LiveEvent.objects.filter(created_at__lt=now - EVENT_RETENTION).delete()[0]
+
+
+@receiver(task_changed)
+def publish_task_change(sender, instance, created, changes, **kwargs):
+    # Only the names of the changed fields: the page refetches the task
+    # through its own permission checks rather than trusting the stream
+    data = {
+        'task_id': instance.task_id,
+        'version': instance.version,
+        'created': created,
+        'changes': sorted(changes),
+        'status': instance.status,
+        'deadline': instance.deadline,
+    }
+    # A reassignment also reaches the previous assignee's inbox
+    users = {instance.assigned_to_id, instance.assigned_by_id, changes.get('assigned_to_id', (None,))[0]}
+    publish([(task_channel(instance.task_id), 'task', data)]
+            + [(user_channel(user_id), 'task', data) for user_id in users if user_id])
+
+
+def publish_status_moves(rows, status):
+    """
+    Events for a bulk status UPDATE, which bypasses Task.save; ``rows`` are
+    (task_id, assignee, assignor, deadline).
+    """
+    messages = []
+    for task_id, assigned_to_id, assigned_by_id, deadline in rows:
+        data = {
+            'task_id': task_id, 'version': None, 'created': False,
+            'changes': ['status'], 'status': status, 'deadline': deadline,
+        }
+        messages.append((task_channel(task_id), 'task', data))
+        messages.extend((user_channel(user_id), 'task', data) for user_id in {assigned_to_id, assigned_by_id} if user_id)
+    publish(messages)
+
+
+@receiver(post_save, sender=TaskChat)
+def publish_chat_message(sender, instance, created, **kwargs):
+    if not created:
+        return
+    task = instance.task
+    data = {
+        'task_id': task.task_id,
+        'id': instance.pk,
+        'sender_id': instance.sender_id,
+        'sender': instance.sender.get_full_name() or instance.sender.username,
+        'message': instance.message,
+        'timestamp': instance.timestamp,
+        # Rendered as seen by the other participants
+        'html': render_to_string('tasks/chat_message.html', {'message': instance}),
+    }
+    users = {task.assigned_to_id, task.assigned_by_id} - {instance.sender_id}
+    publish([(task_channel(task.task_id), 'chat', data)]
+            + [(user_channel(user_id), 'chat', data) for user_id in users if user_id])
+
+
+def _format(event):
+    return f'id: {event.id}\nevent: {event.kind}\ndata: {json.dumps(event.data)}\n\n'
+
+
+async def _stream(channels, last_id, seconds):
+    backend = get_backend()
+    backend.start()
+    loop = asyncio.get_running_loop()
+    woken = asyncio.Event()
+    # Subscribe before replaying so nothing published in between is missed
+    subscription = hub.subscribe(channels, wake=lambda: loop.call_soon_threadsafe(woken.set))
+    try:
+        yield f'retry: {RECONNECT_MILLISECONDS}\n\n'
+        replayed = set()
+        if last_id is not None:
+            for event in await sync_to_async(backend.replay)(channels, last_id):
+                replayed.add(event.id)
+                yield _format(event)
+        deadline = time.monotonic() + seconds
+        while not subscription.overflowed and (remaining := deadline - time.monotonic()) > 0:
+            try:
+                event = subscription.get_nowait()
+            except queue.Empty:
+                woken.clear()
+                if not subscription.empty():
+                    continue
+                try:
+                    await asyncio.wait_for(woken.wait(), timeout=min(HEARTBEAT_SECONDS, remaining))
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                continue
+            if event.id not in replayed:
+                yield _format(event)
+    finally:
+        hub.unsubscribe(subscription, channels)
+
+
+def _poll(channels, last_id):
+    # The browser keeps the last id it saw and sends it on the next poll; a
+    # first poll gets the current id, so it only receives what comes after
+    backend = get_backend()
+    if last_id is not None:
+        body = ''.join(_format(event) for event in backend.replay(channels, last_id))
+    else:
+        body = f'id: {backend.latest_id()}\n\n'
+    return f'retry: {SHORT_POLL_MILLISECONDS}\n\n{body}'
+
+
+def event_stream(request, channels, seconds=STREAM_SECONDS):
+    """
+    A text/event-stream response carrying the events of ``channels``, after
+    replaying the ones since the client's Last-Event-ID.
+
+    Under ASGI the response streams for ``seconds`` without tying up a
+    thread. Under WSGI it would hold a worker thread all that time, so it
+    returns what is there at once and EventSource polls again after
+    SHORT_POLL_MILLISECONDS.
+    """
+    try:
+        last_id = int(request.headers['Last-Event-ID'])
+    except (KeyError, ValueError):
+        last_id = None
+    if isinstance(request, ASGIRequest):
+        response = StreamingHttpResponse(_stream(channels, last_id, seconds), content_type='text/event-stream')
+        response['X-Accel-Buffering'] = 'no'
+    else:
+        response = HttpResponse(_poll(channels, last_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    return response
@@ -1,6 +1,19 @@
 from django import forms
 from django.contrib.auth.models import User
-from .models import Task, UserProfile, TaskChat
+from .models import Task, TaskChat, NotificationPreference
+from .profiles import get_profile
+
+STALE_TASK_MESSAGE = (
+    "Someone else changed this task while you were editing it, so your changes were not saved. "
+    "The form now shows the current task; please make your changes again."
+)
+
+
+def add_version_field(form):
+    """Hidden field carrying the task version the form was rendered with."""
+    form.fields['version'] = forms.IntegerField(
+        widget=forms.HiddenInput, required=False, initial=form.instance.version,
+    )
 
 class TaskForm(forms.ModelForm):
     """
@@ -27,9 +40,10 @@ class TaskForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         user = kwargs.pop('user', None)
         super(TaskForm, self).__init__(*args, **kwargs)
+        add_version_field(self)
 
         if user:
-            user_profile = UserProfile.objects.get(user=user)
+            user_profile = get_profile(user)
 
             if user_profile.category == 'Departmental Manager':
                 self.fields['assigned_to'].queryset = User.objects.all()
@@ -40,9 +54,9 @@ class TaskForm(forms.ModelForm):
 
         if not self.fields['assigned_to'].queryset.exists():
             self.fields['assigned_to'].queryset = User.objects.none()
-        # Preselect viewers_ui from instance.viewers
-        if self.instance and getattr(self.instance, "viewers", None):
-            self.fields["viewers_ui"].initial = User.objects.filter(email__in=self.instance.viewers)
+        # Preselect viewers_ui from the task's viewer rows
+        if self.instance and self.instance.pk:
+            self.fields["viewers_ui"].initial = self.instance.viewer_users
         # Conditionally show recurrence fields based on 'is_recurring'
         if not self.instance.is_recurring:
             # Hide recurrence fields if task is not recurring
@@ -54,6 +68,12 @@ class TaskForm(forms.ModelForm):
             self.fields['recurrence_type'].widget.attrs['style'] = 'display: block;'
             self.fields['recurrence_count'].widget.attrs['style'] = 'display: block;'
             self.fields['recurrence_duration'].widget.attrs['style'] = 'display: block;'
+    def clean(self):
+        cleaned_data = super().clean()
+        # Saving over a newer version raises StaleTaskError
+        self.instance.expect_version(cleaned_data.get('version'))
+        return cleaned_data
+
     def save(self, commit=True):
         instance = super().save(commit=False)
         # Write UI selection into JSONField of emails
@@ -78,6 +98,13 @@ class TaskStatusUpdateForm(forms.ModelForm):
         super(TaskStatusUpdateForm, self).__init__(*args, **kwargs)
         self.fields['comments_by_assignee'].required = False
         self.fields['revised_completion_date'].required = False
+        add_version_field(self)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        # Saving over a newer version raises StaleTaskError
+        self.instance.expect_version(cleaned_data.get('version'))
+        return cleaned_data
 
 
 class TaskChatForm(forms.ModelForm):
@@ -123,4 +150,16 @@ class TaskChatForm(forms.ModelForm):
         message = self.cleaned_data.get('message')
         if not message or len(message.strip()) == 0:
             raise forms.ValidationError("Message cannot be empty.")
-        return message
\ No newline at end of file
+        return message
+
+
+class NotificationPreferenceForm(forms.ModelForm):
+    """
+    Form for choosing between immediate emails and hourly or daily digests
+    """
+    class Meta:
+        model = NotificationPreference
+        fields = ['mode']
+        widgets = {
+            'mode': forms.Select(attrs={'class': 'form-control'}),
+        }
@@ -0,0 +1,187 @@
+# task_app/listing.py
+
+import base64
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from urllib.parse import urlencode
+
+from django.db.models import Q
+from django.db.models.functions import Coalesce
+from django.utils.dateparse import parse_date
+
+from .chat import unread_counts, unread_total
+from .models import Task
+
+TASK_PAGE_SIZE = 50
+MAX_TASK_PAGE_SIZE = 200
+
+# Statuses shown when the request does not choose any
+DEFAULT_STATUSES = ('Not Started', 'In Progress')
+
+# Query parameter -> Task lookup for the multi-valued filters
+MULTI_FILTERS = {
+    'priority': 'priority__in',
+    'status': 'status__in',
+    'department': 'department_id__in',
+    'assignor_department': 'assignor_department_id__in',
+    'assignee_department': 'assigned_to__userprofile__department_id__in',
+    'assigned_by': 'assigned_by_id__in',
+    'assigned_to': 'assigned_to_id__in',
+}
+ID_FILTERS = ('department', 'assignor_department', 'assignee_department', 'assigned_by', 'assigned_to')
+DUE_CHOICES = ('next24', 'passed')
+CURSOR_PARAMS = ('after', 'before')
+
+TaskPage = namedtuple('TaskPage', 'rows page_size next_query prev_query')
+
+# Columns the task list pages render. The wide text and attachment columns
+# (request_details, notes, comments_by_assignee, viewers, ...) stay unloaded.
+LIST_FIELDS = (
+    'task_id', 'subject', 'priority', 'status', 'assigned_date', 'deadline', 'revised_completion_date',
+    'department__name', 'assignor_department__name',
+    'assigned_by__username', 'assigned_by__first_name', 'assigned_by__last_name',
+    'assigned_to__username', 'assigned_to__first_name', 'assigned_to__last_name',
+    'assigned_to__userprofile__department__name',
+)
+LIST_RELATED = (
+    'department',
+    'assignor_department',
+    'assigned_by',
+    'assigned_to__userprofile__department',
+)
+
+
+def task_list_queryset():
+    """
+    Base queryset for pages that list tasks: every relation a row shows is
+    joined in, so a page costs the same number of queries whatever its size.
+    """
+    return Task.objects.select_related(*LIST_RELATED).only(*LIST_FIELDS)
+
+
+def parse_task_filters(params):
+    """
+    Read the list filters out of ``params`` (a QueryDict). Multi-valued filters
+    come back as lists of strings; an absent ``status`` falls back to
+    DEFAULT_STATUSES while an explicitly empty one means "any status".
+    Raises ValueError on malformed values.
+    """
+    filters = {}
+    for name in MULTI_FILTERS:
+        values = [value for value in params.getlist(name) if value]
+        if name in ID_FILTERS and any(not value.isdigit() for value in values):
+            raise ValueError(f"'{name}' must be a list of ids.")
+        filters[name] = values
+    if 'status' not in params:
+        filters['status'] = list(DEFAULT_STATUSES)
+
+    deadline = params.get('deadline') or None
+    if deadline is not None and parse_date(deadline) is None:
+        raise ValueError("'deadline' must be a YYYY-MM-DD date.")
+    filters['deadline'] = deadline
+
+    due = [value for value in params.getlist('due') if value]
+    if any(value not in DUE_CHOICES for value in due):
+        raise ValueError(f"'due' must be one of {', '.join(DUE_CHOICES)}.")
+    filters['due'] = due
+    return filters
+
+
+def filter_tasks(tasks, filters, today=None):
+    """Apply parsed filters to a Task queryset."""
+    today = today or date.today()
+    for name, lookup in MULTI_FILTERS.items():
+        if filters[name]:
+            tasks = tasks.filter(**{lookup: filters[name]})
+
+    if filters['deadline'] or filters['due']:
+        # The revised completion date replaces the deadline once set
+        tasks = tasks.annotate(effective_deadline=Coalesce('revised_completion_date', 'deadline'))
+    if filters['deadline']:
+        tasks = tasks.filter(effective_deadline=parse_date(filters['deadline']))
+    if filters['due']:
+        due = Q()
+        if 'next24' in filters['due']:
+            due |= Q(effective_deadline__range=(today, today + timedelta(days=1)))
+        if 'passed' in filters['due']:
+            due |= Q(effective_deadline__lt=today)
+        tasks = tasks.filter(due)
+    return tasks
+
+
+def encode_cursor(task):
+    raw = f'{task.assigned_date.isoformat()}|{task.pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        assigned_date, pk = raw.split('|')
+        return datetime.fromisoformat(assigned_date), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Invalid page cursor.')
+
+
+def _page_query(params, **cursor):
+    query = [(key, value) for key, values in params.lists() if key not in CURSOR_PARAMS for value in values]
+    query.extend(cursor.items())
+    return urlencode(query)
+
+
+def keyset_page(tasks, params):
+    """
+    Return one page of ``tasks`` newest first, keyed on (assigned_date, id).
+    ``?after=`` continues past a cursor and ``?before=`` steps back; the
+    page carries ready-made query strings for its neighbours.
+    """
+    try:
+        page_size = min(int(params.get('page_size', TASK_PAGE_SIZE)), MAX_TASK_PAGE_SIZE)
+    except ValueError:
+        raise ValueError("'page_size' must be an integer.")
+    if page_size < 1:
+        raise ValueError("'page_size' must be positive.")
+
+    if params.get('before'):
+        assigned_date, pk = decode_cursor(params['before'])
+        rows = list(tasks.filter(
+            Q(assigned_date__gt=assigned_date) | Q(assigned_date=assigned_date, pk__gt=pk)
+        ).order_by('assigned_date', 'pk')[:page_size + 1])
+        has_prev = len(rows) > page_size
+        rows = rows[:page_size][::-1]
+        has_next = True
+    else:
+        if params.get('after'):
+            assigned_date, pk = decode_cursor(params['after'])
+            tasks = tasks.filter(Q(assigned_date__lt=assigned_date) | Q(assigned_date=assigned_date, pk__lt=pk))
+        rows = list(tasks.order_by('-assigned_date', '-pk')[:page_size + 1])
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        has_prev = bool(params.get('after'))
+
+    return TaskPage(
+        rows=rows,
+        page_size=page_size,
+        next_query=_page_query(params, after=encode_cursor(rows[-1])) if rows and has_next else None,
+        prev_query=_page_query(params, before=encode_cursor(rows[0])) if rows and has_prev else None,
+    )
+
+
+def task_list_context(request, tasks, today=None):
+    """
+    Filter and page ``tasks`` for one of the task list pages, with the
+    user's unread chat messages per listed task and in total (cached, as
+    it counts over all of the user's tasks).
+    """
+    filters = parse_task_filters(request.GET)
+    page = keyset_page(filter_tasks(tasks, filters, today), request.GET)
+    if page.rows:
+        unread = unread_counts(request.user, Task.objects.filter(pk__in=[task.pk for task in page.rows]))
+        for task in page.rows:
+            task.unread_messages = unread.get(task.pk, 0)
+    return {
+        'tasks': page.rows,
+        'page': page,
+        'filters': filters,
+        'unread_messages': unread_total(request.user),
+    }
@@ -0,0 +1,25 @@
+from datetime import datetime, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from task_app.counters import backfill_department_flow
+
+
+class Command(BaseCommand):
+    help = "Rebuild the hourly per-department flow buckets from tasks and the activity log."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help="Only rebuild buckets from this date (YYYY-MM-DD) onwards.")
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since_date = parse_date(options['since'])
+            if since_date is None:
+                raise CommandError("--since must use the YYYY-MM-DD format.")
+            since = timezone.make_aware(datetime.combine(since_date, time.min))
+
+        count = backfill_department_flow(since=since)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {count} hourly flow buckets."))
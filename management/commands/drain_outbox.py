@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from task_app.outbox import MAX_ATTEMPTS, deliver_outbox
+
+
+class Command(BaseCommand):
+    help = "Deliver queued emails from the outbox over reused SMTP connections."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help="Emails claimed per round.")
+        parser.add_argument('--workers', type=int, default=4, help="Parallel SMTP connections.")
+        parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS, help="Attempts before an email is marked failed.")
+        parser.add_argument('--loop', action='store_true', help="Keep polling instead of exiting once the outbox is drained.")
+        parser.add_argument('--interval', type=float, default=5.0, help="Seconds between polls with --loop.")
+
+    def handle(self, *args, **options):
+        sent = retried = failed = 0
+        started = time.monotonic()
+        while True:
+            report = deliver_outbox(options['batch_size'], options['workers'], options['max_attempts'])
+            sent += report.sent
+            retried += report.retried
+            failed += report.failed
+            if any(report):
+                if options['loop']:
+                    self.stdout.write(f"Sent {report.sent}, {report.retried} to retry, {report.failed} failed.")
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Sent {sent} emails ({retried} to retry, {failed} failed) in {elapsed:.1f}s."
+        ))
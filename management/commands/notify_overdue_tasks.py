@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from task_app.tasks import (
+    JOB_BATCH_SIZE, RENDER_WORKERS, SMTP_CONNECTIONS, notify_overdue_tasks_logic,
+)
+
+
+class Command(BaseCommand):
+    help = "Email assignors about open tasks past their deadline."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=JOB_BATCH_SIZE, help="Tasks fetched and sent per round.")
+        parser.add_argument('--render-workers', type=int, default=RENDER_WORKERS, help="Threads rendering emails.")
+        parser.add_argument('--connections', type=int, default=SMTP_CONNECTIONS, help="Parallel SMTP connections.")
+
+    def handle(self, *args, **options):
+        report = notify_overdue_tasks_logic(
+            batch_size=options['batch_size'],
+            render_workers=options['render_workers'],
+            connections=options['connections'],
+        )
+        rate = report.emails / report.seconds if report.seconds else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Sent {report.emails} overdue notifications for {report.tasks} tasks ({report.failed} failed) "
+            f"in {report.seconds:.1f}s, {rate:.0f} emails/s."
+        ))
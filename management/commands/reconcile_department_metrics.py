@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from task_app.counters import reconcile_department_metrics
+
+
+class Command(BaseCommand):
+    help = "Recompute the per-department open-ticket counters from the Task table."
+
+    def handle(self, *args, **options):
+        count = reconcile_department_metrics()
+        self.stdout.write(self.style.SUCCESS(f"Reconciled metrics for {count} departments."))
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from task_app.scheduler import node_name, run_due_jobs
+
+
+class Command(BaseCommand):
+    help = "Run the periodic reminder, overdue and digest jobs. Safe to start on several nodes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tick', type=float, default=60.0, help="Seconds between lease checks.")
+        parser.add_argument('--once', action='store_true', help="Run the due jobs once and exit.")
+
+    def handle(self, *args, **options):
+        holder = node_name()
+        self.stdout.write(f"Scheduler {holder} started.")
+        while True:
+            # Long-running process: don't hold on to a dropped database connection
+            close_old_connections()
+            for name, result in run_due_jobs(holder).items():
+                self.stdout.write(self.style.SUCCESS(f"{name}: {result}"))
+            if options['once']:
+                break
+            time.sleep(options['tick'])
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from task_app.notifications import DIGEST_PERIODS, send_digests
+
+
+class Command(BaseCommand):
+    help = "Queue one digest email per user with the notifications held back for the period."
+
+    def add_arguments(self, parser):
+        parser.add_argument('period', choices=sorted(DIGEST_PERIODS), help="Run 'hourly' every hour and 'daily' once a day.")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        users, merged = send_digests(options['period'])
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Queued {users} {options['period']} digests covering {merged} notifications in {elapsed:.1f}s."
+        ))
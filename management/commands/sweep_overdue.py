@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from task_app.tasks import JOB_BATCH_SIZE, sweep_overdue_statuses
+
+
+class Command(BaseCommand):
+    help = "Move tasks past their (revised) deadline to Overdue, and back once the deadline moves."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=JOB_BATCH_SIZE, help="Tasks per UPDATE.")
+
+    def handle(self, *args, **options):
+        report = sweep_overdue_statuses(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{report.overdue} tasks now overdue, {report.reopened} back in progress, in {report.seconds:.1f}s."
+        ))
@@ -0,0 +1,356 @@
+# task_app/metrics.py
+
+import re
+from collections import Counter, defaultdict, namedtuple
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.db.models import Count, Min, Q, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import OPEN_STATUSES, ActivityLog, Task, Department, DepartmentMetricsSnapshot, DepartmentHourlyFlow
+
+ASSIGNOR_DEPARTMENT = 'assignor_department'
+
+SNAPSHOT_FIELDS = (
+    'open_tickets_received', 'open_tickets_raised',
+    'tickets_passed_72_hours', 'tickets_passed_revised_deadline',
+)
+
+FLOW_FIELDS = ('tickets_received', 'tickets_raised', 'tickets_completed', 'tickets_reassigned')
+
+# ActivityLog actions that record a status change or a reassignment
+STATUS_ACTIONS = ('status_updated', 'status_changed', 'task_updated_api')
+REASSIGN_ACTIONS = ('reassigned', 'assigned')
+
+# A reporting window: ``since`` is inclusive, ``until`` exclusive (None = open ended)
+MetricsWindow = namedtuple('MetricsWindow', ['key', 'label', 'since', 'until'])
+
+WINDOW_PRESETS = {
+    '24h': 'Last 24 Hours',
+    '7d': 'Last 7 Days',
+    '30d': 'Last 30 Days',
+}
+
+_WINDOW_RE = re.compile(r'^(\d{1,4})([hd])$')
+
+
+def truncate_to_hour(value):
+    """UTC clock hour a datetime falls into, i.e. its flow bucket."""
+    return value.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def parse_window(params, now=None):
+    """
+    Build the reporting window from query parameters: ``?window=`` takes
+    ``24h``, ``7d``, ``30d`` or any ``<N>h`` / ``<N>d``; ``?since=&until=``
+    take YYYY-MM-DD dates for a custom range. Defaults to the last 24 hours.
+    Raises ValueError for anything it cannot read.
+    """
+    now = now or timezone.now()
+    since_raw, until_raw = params.get('since'), params.get('until')
+    if since_raw:
+        since_date = parse_date(since_raw)
+        until_date = parse_date(until_raw) if until_raw else None
+        if since_date is None or (until_raw and until_date is None):
+            raise ValueError("Dates must use the YYYY-MM-DD format.")
+        since = timezone.make_aware(datetime.combine(since_date, time.min))
+        until = timezone.make_aware(datetime.combine(until_date + timedelta(days=1), time.min)) if until_date else None
+        if until is not None and until <= since:
+            raise ValueError("'until' must not be before 'since'.")
+        label = f"{since_date} to {until_date or 'now'}"
+        return MetricsWindow('custom', label, since, until)
+
+    key = (params.get('window') or '24h').lower()
+    match = _WINDOW_RE.match(key)
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"Unsupported window '{key}'. Use e.g. 24h, 7d or 30d.")
+    amount, unit = int(match.group(1)), match.group(2)
+    span = timedelta(hours=amount) if unit == 'h' else timedelta(days=amount)
+    label = WINDOW_PRESETS.get(key, f"Last {amount} {'Hours' if unit == 'h' else 'Days'}")
+    return MetricsWindow(key, label, now - span, None)
+
+
+def _open_q():
+    return Q(status__in=OPEN_STATUSES)
+
+
+def _passed_deadline_q():
+    # The overdue sweep keeps status in step with the (revised) deadline
+    return Q(status='Overdue')
+
+
+def _window_q(window, field='assigned_date'):
+    q = Q(**{f'{field}__gte': window.since})
+    if window.until is not None:
+        q &= Q(**{f'{field}__lt': window.until})
+    return q
+
+
+def aggregate_open_counters(now=None, department_ids=None):
+    """
+    Recompute the counters held in DepartmentMetricsSnapshot straight from the
+    Task table, for every department or just ``department_ids``.
+    Returns ``{department_id: {field: count}}``.
+    """
+    now = now or timezone.now()
+    seventy_two_hours_ago = now - timedelta(hours=72)
+    open_q = _open_q()
+
+    received_qs = Task.objects.filter(department__isnull=False)
+    raised_qs = Task.objects.filter(**{f'{ASSIGNOR_DEPARTMENT}__isnull': False})
+    if department_ids is not None:
+        received_qs = received_qs.filter(department__in=department_ids)
+        raised_qs = raised_qs.filter(**{f'{ASSIGNOR_DEPARTMENT}__in': department_ids})
+
+    counters = {}
+    received = received_qs.values('department').annotate(
+        open_tickets_received=Count('id', filter=open_q),
+        tickets_passed_72_hours=Count('id', filter=open_q & Q(assigned_date__lte=seventy_two_hours_ago)),
+        tickets_passed_revised_deadline=Count('id', filter=_passed_deadline_q()),
+    ).order_by()
+    for row in received:
+        counters.setdefault(row.pop('department'), {}).update(row)
+
+    raised = raised_qs.values(ASSIGNOR_DEPARTMENT).annotate(
+        open_tickets_raised=Count('id', filter=open_q),
+    ).order_by()
+    for row in raised:
+        counters.setdefault(row.pop(ASSIGNOR_DEPARTMENT), {}).update(row)
+    return counters
+
+
+def history_flow(since=None, until=None, department_ids=None):
+    """
+    Count the flow between ``since`` and ``until`` (either open ended when
+    None) from the Task and ActivityLog tables, as the hourly buckets would
+    hold it: received / raised from Task.assigned_date, completions and
+    reassignments from ActivityLog. Returns ``{(department_id, hour): Counter}``.
+    """
+    utc = dt_timezone.utc
+    buckets = defaultdict(Counter)
+
+    received = Task.objects.filter(department__isnull=False)
+    raised = Task.objects.filter(**{f'{ASSIGNOR_DEPARTMENT}__isnull': False})
+    logs = ActivityLog.objects.filter(task__department__isnull=False)
+    if since is not None:
+        received = received.filter(assigned_date__gte=since)
+        raised = raised.filter(assigned_date__gte=since)
+        logs = logs.filter(timestamp__gte=since)
+    if until is not None:
+        received = received.filter(assigned_date__lt=until)
+        raised = raised.filter(assigned_date__lt=until)
+        logs = logs.filter(timestamp__lt=until)
+    if department_ids is not None:
+        received = received.filter(department__in=department_ids)
+        raised = raised.filter(**{f'{ASSIGNOR_DEPARTMENT}__in': department_ids})
+        logs = logs.filter(task__department__in=department_ids)
+
+    for row in received.annotate(bucket=TruncHour('assigned_date', tzinfo=utc)).values(
+        'department', 'bucket'
+    ).annotate(n=Count('id')).order_by():
+        buckets[(row['department'], row['bucket'])]['tickets_received'] += row['n']
+
+    for row in raised.annotate(bucket=TruncHour('assigned_date', tzinfo=utc)).values(
+        ASSIGNOR_DEPARTMENT, 'bucket'
+    ).annotate(n=Count('id')).order_by():
+        buckets[(row[ASSIGNOR_DEPARTMENT], row['bucket'])]['tickets_raised'] += row['n']
+
+    events = logs.filter(
+        Q(action__in=STATUS_ACTIONS, description__contains="to 'Completed'") | Q(action__in=REASSIGN_ACTIONS)
+    ).annotate(bucket=TruncHour('timestamp', tzinfo=utc)).values('task__department', 'bucket').annotate(
+        completed=Count('id', filter=Q(action__in=STATUS_ACTIONS)),
+        reassigned=Count('id', filter=Q(action__in=REASSIGN_ACTIONS)),
+    ).order_by()
+    for row in events:
+        counts = buckets[(row['task__department'], row['bucket'])]
+        counts['tickets_completed'] += row['completed']
+        counts['tickets_reassigned'] += row['reassigned']
+    return buckets
+
+
+def aggregate_flow(window, department_ids=None):
+    """
+    Sum the hourly flow buckets covering ``window``. Buckets are whole UTC
+    hours, so the window start is rounded down to the hour. The part of the
+    window before the earliest bucket (all of it until the first write after
+    deploy, or a backfill_department_flow run) is counted from Task and
+    ActivityLog instead. Returns ``{department_id: {flow_field: count}}``.
+    """
+    since = truncate_to_hour(window.since)
+    earliest = DepartmentHourlyFlow.objects.aggregate(earliest=Min('hour'))['earliest']
+
+    buckets = DepartmentHourlyFlow.objects.filter(hour__gte=since)
+    if window.until is not None:
+        buckets = buckets.filter(hour__lt=window.until)
+    if department_ids is not None:
+        buckets = buckets.filter(department__in=department_ids)
+    flow = {
+        row.pop('department'): row
+        for row in buckets.values('department').annotate(
+            **{field: Sum(field) for field in FLOW_FIELDS}
+        ).order_by()
+    }
+
+    if earliest is None or earliest > since:
+        until = earliest
+        if window.until is not None and (until is None or window.until < until):
+            until = window.until
+        for (department_id, hour), counts in history_flow(since, until, department_ids).items():
+            row = flow.setdefault(department_id, dict.fromkeys(FLOW_FIELDS, 0))
+            for field in FLOW_FIELDS:
+                row[field] += counts[field]
+    return flow
+
+
+def compute_department_metrics(department=None, now=None, materialized=False, window=None):
+    """
+    Compute the per-department metrics rows shared by the metrics dashboard,
+    the department drill-down and the CSV export.
+
+    Every column is produced by a fixed number of grouped queries, no matter
+    how many departments or tasks exist. Pass ``department`` to restrict the
+    rows to a single department and ``window`` (see parse_window) to choose
+    the period the "received / raised in window" columns cover.
+
+    With ``materialized`` the open-ticket counters come from
+    DepartmentMetricsSnapshot and the window flow from DepartmentHourlyFlow,
+    so only the open tickets received inside the window or over 72 hours
+    ago and the open tickets' department pairs are aggregated from Task.
+    Departments without a snapshot row fall back to aggregating the Task
+    table.
+    """
+    now = now or timezone.now()
+    window = window or parse_window({}, now)
+    seventy_two_hours_ago = now - timedelta(hours=72)
+
+    open_q = _open_q()
+    window_q = _window_q(window)
+
+    # Department names are needed for the bifurcation columns, so load them all
+    department_names = dict(Department.objects.values_list('id', 'name'))
+    if department is not None:
+        department_ids = [department.pk]
+    else:
+        department_ids = list(department_names)
+
+    snapshots = None
+    if materialized:
+        snapshots = {
+            row.pop('department'): row
+            for row in DepartmentMetricsSnapshot.objects.filter(department__in=department_ids).values(
+                'department', *SNAPSHOT_FIELDS
+            )
+        }
+        if len(snapshots) < len(department_ids):
+            snapshots = None
+
+    flow = aggregate_flow(window, department_ids if department is not None else None)
+
+    received_qs = Task.objects.filter(department__isnull=False)
+    raised_qs = Task.objects.filter(**{f'{ASSIGNOR_DEPARTMENT}__isnull': False})
+    pairs_qs = Task.objects.filter(open_q)
+    if department is not None:
+        received_qs = received_qs.filter(department=department)
+        raised_qs = raised_qs.filter(**{ASSIGNOR_DEPARTMENT: department})
+        pairs_qs = pairs_qs.filter(Q(department=department) | Q(**{ASSIGNOR_DEPARTMENT: department}))
+
+    if snapshots is None:
+        # RECEIVED TICKETS: grouped by the department the ticket was raised to
+        received = {
+            row.pop('department'): row
+            for row in received_qs.values('department').annotate(
+                open_tickets_received=Count('id', filter=open_q),
+                tickets_received_last_24hr=Count('id', filter=window_q),
+                older_open_tickets=Count('id', filter=open_q & Q(assigned_date__lt=window.since)),
+                tickets_passed_72_hours=Count('id', filter=open_q & Q(assigned_date__lte=seventy_two_hours_ago)),
+                tickets_passed_revised_deadline=Count('id', filter=_passed_deadline_q()),
+            ).order_by()
+        }
+
+        # RAISED TICKETS: grouped by the department of the user who raised them
+        raised = {
+            row.pop(ASSIGNOR_DEPARTMENT): row
+            for row in raised_qs.values(ASSIGNOR_DEPARTMENT).annotate(
+                open_tickets_raised=Count('id', filter=open_q),
+                tickets_raised_last_24hr=Count('id', filter=window_q),
+            ).order_by()
+        }
+    else:
+        # Older open tickets are the snapshot's open count minus the open
+        # tickets received since the window started.
+        recent_open = dict(
+            received_qs.filter(open_q, assigned_date__gte=window.since)
+            .values_list('department').annotate(n=Count('id')).order_by()
+        )
+        # Tickets age past 72 hours without any write, so this one is counted
+        # live, from the open-ticket partial index
+        passed_72_hours = dict(
+            received_qs.filter(open_q, assigned_date__lte=seventy_two_hours_ago)
+            .values_list('department').annotate(n=Count('id')).order_by()
+        )
+        received, raised = {}, {}
+        for department_id, snapshot in snapshots.items():
+            received[department_id] = {
+                'open_tickets_received': snapshot['open_tickets_received'],
+                'tickets_received_last_24hr': flow.get(department_id, {}).get('tickets_received', 0),
+                'older_open_tickets': max(snapshot['open_tickets_received'] - recent_open.get(department_id, 0), 0),
+                'tickets_passed_72_hours': passed_72_hours.get(department_id, 0),
+                'tickets_passed_revised_deadline': snapshot['tickets_passed_revised_deadline'],
+            }
+            raised[department_id] = {
+                'open_tickets_raised': snapshot['open_tickets_raised'],
+                'tickets_raised_last_24hr': flow.get(department_id, {}).get('tickets_raised', 0),
+            }
+
+    # PENDING TICKETS BIFURCATION: open tickets per (receiver, assignor) pair
+    pending_by_dept = {}
+    assigned_to_other_depts = {}
+    for row in pairs_qs.values('department', ASSIGNOR_DEPARTMENT).annotate(n=Count('id')).order_by():
+        receiver_id, assignor_id = row['department'], row[ASSIGNOR_DEPARTMENT]
+        if receiver_id is None or assignor_id is None:
+            continue
+        pending_by_dept.setdefault(receiver_id, {})[department_names[assignor_id]] = row['n']
+        assigned_to_other_depts.setdefault(assignor_id, {})[department_names[receiver_id]] = row['n']
+
+    metrics_data = []
+    for department_id in department_ids:
+        row_received = received.get(department_id, {})
+        row_raised = raised.get(department_id, {})
+        row_flow = flow.get(department_id, {})
+        metrics_data.append({
+            'department_id': department_id,
+            'department__name': department_names[department_id],
+            'open_tickets_received': row_received.get('open_tickets_received', 0),
+            'tickets_received_last_24hr': row_received.get('tickets_received_last_24hr', 0),
+            'open_tickets_raised': row_raised.get('open_tickets_raised', 0),
+            'tickets_raised_last_24hr': row_raised.get('tickets_raised_last_24hr', 0),
+            'older_open_tickets': row_received.get('older_open_tickets', 0),
+            'pending_tickets_bifurcation': dict(sorted(pending_by_dept.get(department_id, {}).items())),
+            'tickets_assigned_to_other_depts': dict(sorted(assigned_to_other_depts.get(department_id, {}).items())),
+            'tickets_passed_72_hours': row_received.get('tickets_passed_72_hours', 0),
+            'tickets_passed_revised_deadline': row_received.get('tickets_passed_revised_deadline', 0),
+            'tickets_completed_in_window': row_flow.get('tickets_completed', 0),
+            'tickets_reassigned_in_window': row_flow.get('tickets_reassigned', 0),
+        })
+    return metrics_data
+
+
+def summarize_metrics(metrics_data):
+    """Totals row for the metrics dashboard."""
+    def total(key):
+        return sum(d.get(key, 0) for d in metrics_data)
+
+    return {
+        'total_raised_last_24hr': total('tickets_raised_last_24hr'),
+        'total_received_last_24hr': total('tickets_received_last_24hr'),
+        'total_open_raised': total('open_tickets_raised'),
+        'total_open_received': total('open_tickets_received'),
+        'total_older_open_tickets': total('older_open_tickets'),
+        'total_pending_tickets': sum(sum(d['pending_tickets_bifurcation'].values()) for d in metrics_data),
+        'total_tickets_passed_72_hours': total('tickets_passed_72_hours'),
+        'total_tickets_passed_revised_deadline': total('tickets_passed_revised_deadline'),
+        'total_completed_in_window': total('tickets_completed_in_window'),
+        'total_reassigned_in_window': total('tickets_reassigned_in_window'),
+    }
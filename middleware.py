@@ -0,0 +1,35 @@
+# task_app/middleware.py
+
+from functools import partial
+
+from django.contrib.auth.middleware import get_user
+from django.utils.functional import SimpleLazyObject
+
+from .profiles import load_profile
+
+
+def _user_with_profile(request):
+    user = get_user(request)
+    load_profile(user)
+    return user
+
+
+class UserProfileMiddleware:
+    """
+    Loads the user's profile and department once per request, on first use of
+    ``request.user``, so views (via profiles.get_profile), the context
+    processor and ``request.user.userprofile`` in templates share it.
+    Goes after AuthenticationMiddleware.
+
+    Profiles are cached in the default cache, which should be shared by all
+    workers (Redis, Memcached, the database) so that saving a profile or a
+    department reaches every one of them. With the per-process LocMemCache
+    they are only cached for a few seconds.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.user = SimpleLazyObject(partial(_user_with_profile, request))
+        return self.get_response(request)
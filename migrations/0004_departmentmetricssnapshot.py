@@ -0,0 +1,27 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('task_app', '0003_task_viewers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DepartmentMetricsSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('open_tickets_received', models.IntegerField(default=0)),
+                ('open_tickets_raised', models.IntegerField(default=0)),
+                ('tickets_passed_72_hours', models.IntegerField(default=0)),
+                ('tickets_passed_revised_deadline', models.IntegerField(default=0)),
+                ('reconciled_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('department', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='metrics_snapshot', to='task_app.department')),
+            ],
+        ),
+    ]
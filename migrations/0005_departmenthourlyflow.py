@@ -0,0 +1,30 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('task_app', '0004_departmentmetricssnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DepartmentHourlyFlow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('tickets_received', models.IntegerField(default=0)),
+                ('tickets_raised', models.IntegerField(default=0)),
+                ('tickets_completed', models.IntegerField(default=0)),
+                ('tickets_reassigned', models.IntegerField(default=0)),
+                ('department', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hourly_flow', to='task_app.department')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['hour', 'department'], name='hourly_flow_hour_idx')],
+                'constraints': [models.UniqueConstraint(fields=('department', 'hour'), name='unique_department_hour_flow')],
+            },
+        ),
+    ]
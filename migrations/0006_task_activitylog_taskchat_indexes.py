@@ -0,0 +1,51 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:13
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('task_app', '0005_departmenthourlyflow'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='activitylog',
+            index=models.Index(fields=['-timestamp'], name='activitylog_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='activitylog',
+            index=models.Index(fields=['task', '-timestamp'], name='activitylog_task_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['assigned_to', '-assigned_date', '-id'], name='task_assignee_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['assigned_by', '-assigned_date', '-id'], name='task_assignor_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['-assigned_date', '-id'], name='task_assigned_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['department', 'status'], name='task_department_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['deadline', 'status'], name='task_deadline_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(condition=models.Q(('status__in', ['In Progress', 'Not Started', 'Waiting for confirmation', 'Pending', 'Delay processing', 'Processing', 'Stalled', 'On-Hold', 'Overdue'])), fields=['department', 'assigned_date'], name='task_open_dept_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='taskchat',
+            index=models.Index(fields=['task', 'timestamp'], name='taskchat_task_time_idx'),
+        ),
+    ]
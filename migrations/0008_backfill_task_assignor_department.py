@@ -0,0 +1,21 @@
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_assignor_department(apps, schema_editor):
+    """Copy each assignor's current department onto their existing tasks."""
+    Task = apps.get_model('task_app', 'Task')
+    UserProfile = apps.get_model('task_app', 'UserProfile')
+    department = UserProfile.objects.filter(user_id=OuterRef('assigned_by_id')).values('department_id')[:1]
+    Task.objects.filter(assigned_by__isnull=False).update(assignor_department_id=Subquery(department))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('task_app', '0007_task_assignor_department'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_assignor_department, migrations.RunPython.noop),
+    ]
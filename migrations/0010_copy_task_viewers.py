@@ -0,0 +1,30 @@
+from django.db import migrations
+from django.db.models.functions import Lower
+
+
+def copy_viewers(apps, schema_editor):
+    """Create a TaskViewer row for every email in Task.viewers."""
+    Task = apps.get_model('task_app', 'Task')
+    TaskViewer = apps.get_model('task_app', 'TaskViewer')
+    User = apps.get_model('auth', 'User')
+    users = dict(User.objects.exclude(email='').annotate(email_lower=Lower('email')).values_list('email_lower', 'id'))
+
+    rows = []
+    for task_id, viewers in Task.objects.values_list('id', 'viewers').iterator(chunk_size=2000):
+        emails = {(e or '').strip().lower() for e in (viewers or []) if (e or '').strip()}
+        rows.extend(TaskViewer(task_id=task_id, email=email, user_id=users.get(email)) for email in emails)
+        if len(rows) >= 2000:
+            TaskViewer.objects.bulk_create(rows, ignore_conflicts=True)
+            rows = []
+    TaskViewer.objects.bulk_create(rows, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('task_app', '0009_taskviewer'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_viewers, migrations.RunPython.noop),
+    ]
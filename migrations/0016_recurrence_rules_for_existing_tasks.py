@@ -0,0 +1,41 @@
+from datetime import datetime, timedelta
+
+from django.db import migrations
+
+
+def create_rules(apps, schema_editor):
+    """
+    Give every existing recurring task a rule. The old save() created all of
+    their occurrences up front, so the rules start out fully materialized.
+    """
+    Task = apps.get_model('task_app', 'Task')
+    RecurrenceRule = apps.get_model('task_app', 'RecurrenceRule')
+    rules = []
+    tasks = Task.objects.filter(is_recurring=True, recurrence_type__in=['daily', 'weekly'])
+    for task in tasks.iterator():
+        start_date = task.assigned_date.date() if isinstance(task.assigned_date, datetime) else task.assigned_date
+        interval = max(task.recurrence_duration or 1, 1)
+        count = max(task.recurrence_count or 0, 0)
+        days = count * interval * (7 if task.recurrence_type == 'weekly' else 1)
+        rules.append(RecurrenceRule(
+            task_id=task.pk,
+            recurrence_type=task.recurrence_type,
+            interval=interval,
+            count=count,
+            start_date=start_date,
+            first_deadline=task.deadline,
+            materialized_through=start_date + timedelta(days=days),
+            active=False,
+        ))
+    RecurrenceRule.objects.bulk_create(rules, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('task_app', '0015_recurrencerule'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_rules, migrations.RunPython.noop),
+    ]
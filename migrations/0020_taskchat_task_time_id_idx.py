@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:39
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('task_app', '0019_user_email_lower_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='taskchat',
+            name='taskchat_task_time_idx',
+        ),
+        migrations.AddIndex(
+            model_name='taskchat',
+            index=models.Index(fields=['task', 'timestamp', 'id'], name='taskchat_task_time_id_idx'),
+        ),
+    ]
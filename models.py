@@ -1,10 +1,23 @@
-from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.db.models.fields.files import FieldFile
+from django.db.models.functions import Lower
 from django.contrib.auth.models import User
-import random
-import string
 from datetime import timedelta,datetime,date, timezone
 from django.utils import timezone
 
+# Task columns that describe its recurrence; a change updates the RecurrenceRule
+RECURRENCE_FIELDS = (
+    'is_recurring', 'recurrence_type', 'recurrence_count', 'recurrence_duration', 'assigned_date', 'deadline',
+)
+
+# Statuses that count as an "open" ticket. Includes legacy values that are
+# no longer in Task.STATUS_CHOICES but still occur in old rows.
+OPEN_STATUSES = [
+    'In Progress', 'Not Started', 'Waiting for confirmation', 'Pending',
+    'Delay processing', 'Processing', 'Stalled', 'On-Hold', 'Overdue',
+]
+
 class Department(models.Model):
     name = models.CharField(max_length=50)
     manager = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='managed_departments')
@@ -29,6 +42,14 @@ class UserProfile(models.Model):
     def __str__(self):
         return self.user.username
 
+class StaleTaskError(Exception):
+    """Task.save found the row changed by someone else since the task was loaded."""
+
+    def __init__(self, task):
+        self.task = task
+        super().__init__(f"Task {task.task_id} was changed by someone else")
+
+
 class Task(models.Model):
     STATUS_CHOICES = [
         ('Not Started', 'Not Started'),
@@ -76,6 +97,11 @@ class Task(models.Model):
     department = models.ForeignKey('Department', on_delete=models.SET_NULL, null=True, blank=True)
     assigned_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='tasks_assigned')
     assigned_to = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='tasks_received')
+    # assigned_by's department when the task was raised, so "raised by department"
+    # needs no join through UserProfile and does not move when people change department
+    assignor_department = models.ForeignKey(
+        'Department', on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='raised_tasks'
+    )
     assigned_date = models.DateTimeField(default=timezone.now)
     deadline = models.DateField()
     ticket_type = models.CharField(max_length=100, choices=FUNCTIONAL_CATEGORIES)
@@ -91,76 +117,339 @@ class Task(models.Model):
     recurrence_type = models.CharField(max_length=10, choices=RECURRENCE_TYPE_CHOICES, null=True, blank=True)
     recurrence_count = models.IntegerField(default=1)
     recurrence_duration = models.IntegerField(default=1)
-    # NEW: list of viewer emails (can include external emails too)
+    # NEW: list of viewer emails (can include external emails too).
+    # Mirror of the TaskViewer rows, kept for templates and email CCs.
     viewers = models.JSONField(default=list, blank=True)
     is_recurred_task = models.BooleanField(default=False)
+    # Set on occurrences materialized from a RecurrenceRule
+    recurrence_rule = models.ForeignKey(
+        'RecurrenceRule', on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='occurrences'
+    )
+    occurrence_date = models.DateField(null=True, blank=True, editable=False)
+    # Bumped by every save; an update only applies if the row is still at the loaded version
+    version = models.PositiveIntegerField(default=1, editable=False)
 
     # New field for attachment uploaded by assignee
     attachment_by_assignee = models.FileField(upload_to='task_assignee_attachments/', blank=True, null=True)
 
-    def save(self, *args, **kwargs):
-        # Automatically set status to 'Overdue' if the deadline has passed
-        if self.deadline < date.today() and self.status != 'Completed' and self.status != 'Cancelled':
-            if not self.revised_completion_date or self.revised_completion_date < date.today():
-                self.status = 'Overdue'
-            else:
-                self.status = 'In Progress'
+    class Meta:
+        indexes = [
+            # Task list pages: one user's tasks newest first, keyset-paged on (assigned_date, id)
+            models.Index(fields=['assigned_to', '-assigned_date', '-id'], name='task_assignee_date_idx'),
+            models.Index(fields=['assigned_by', '-assigned_date', '-id'], name='task_assignor_date_idx'),
+            models.Index(fields=['-assigned_date', '-id'], name='task_assigned_date_idx'),
+            # Department pages and metrics: status__in within one department
+            models.Index(fields=['department', 'status'], name='task_department_status_idx'),
+            # Deadline reminders: deadline ranges by status
+            models.Index(fields=['deadline', 'status'], name='task_deadline_status_idx'),
+            # Overdue sweep and notifications: status first
+            models.Index(fields=['status', 'deadline'], name='task_status_deadline_idx'),
+            # Open tickets only, by department and age; far smaller than the table
+            models.Index(
+                fields=['department', 'assigned_date'],
+                condition=models.Q(status__in=OPEN_STATUSES),
+                name='task_open_dept_date_idx',
+            ),
+        ]
+        constraints = [
+            # Materializing a rule twice must not duplicate an occurrence
+            models.UniqueConstraint(fields=['recurrence_rule', 'occurrence_date'], name='unique_rule_occurrence'),
+        ]
 
+    def save(self, *args, **kwargs):
+        # 'Overdue' is set and cleared by the sweep_overdue command, not here
         if not self.task_id:
             self.task_id = self.generate_task_id()
 
-        if self.is_recurring:
-            self.create_recurring_tasks()
+        loaded_assigned_by_id = getattr(self, '_loaded_values', {}).get('assigned_by_id', self.assigned_by_id)
+        if (self._state.adding and self.assignor_department_id is None) or loaded_assigned_by_id != self.assigned_by_id:
+            self.assignor_department_id = self.assigned_by_department_id()
+
+        adding = self._state.adding
+        old_values = getattr(self, '_loaded_values', None)
+        update_fields = kwargs.get('update_fields')
+        changes = {}
+        if not adding and old_values is not None:
+            changes = self.changed_fields()
+            if update_fields is not None:
+                saved = {self._meta.get_field(name).attname for name in update_fields}
+                changes = {attname: diff for attname, diff in changes.items() if attname in saved}
+            elif not kwargs.get('force_insert'):
+                # Write only the columns that changed since the task was loaded
+                update_fields = kwargs['update_fields'] = [self._meta.get_field(attname).name for attname in changes]
+                if not changes:
+                    return
+        expected_version = (old_values or {}).get('version') if not adding else None
+        if expected_version is not None and changes and update_fields is not None:
+            self.version = expected_version + 1
+            changes['version'] = (expected_version, self.version)
+            update_fields = kwargs['update_fields'] = [*update_fields, 'version']
+        else:
+            expected_version = None
+        viewers_changed = (
+            'viewers' in self.__dict__
+            and (update_fields is None or 'viewers' in update_fields)
+            and (adding or old_values is None or old_values.get('viewers') != self.viewers)
+        )
+        recurrence_changed = (
+            (self.is_recurring or (old_values or {}).get('is_recurring'))
+            and (update_fields is None or any(f in update_fields for f in RECURRENCE_FIELDS))
+            and (adding or old_values is None or any(old_values.get(f) != getattr(self, f) for f in RECURRENCE_FIELDS))
+        )
+        self._expected_version = expected_version
+        try:
+            with transaction.atomic():
+                super(Task, self).save(*args, **kwargs)
+                self._after_save(adding, changes, viewers_changed, recurrence_changed)
+        except StaleTaskError:
+            self.version = expected_version
+            raise
+        finally:
+            self._expected_version = None
+        self._remember_loaded_values(None if adding else update_fields)
+
+    def _after_save(self, adding, changes, viewers_changed, recurrence_changed):
+        from .signals import task_changed
+        # Counters, caches and logging subscribe to this
+        task_changed.send(sender=Task, instance=self, created=adding, changes=changes)
+        if viewers_changed:
+            self.sync_viewer_rows()
+        if recurrence_changed:
+            self.sync_recurrence_rule()
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        expected_version = getattr(self, '_expected_version', None)
+        if expected_version is None:
+            return super(Task, self)._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+        # UPDATE ... WHERE id = %s AND version = %s
+        if super(Task, self)._do_update(
+            base_qs.filter(version=expected_version), using, pk_val, values, update_fields, forced_update
+        ):
+            return True
+        if base_qs.filter(pk=pk_val).exists():
+            raise StaleTaskError(self)
+        return False
+
+    def expect_version(self, version):
+        """
+        Only save if the row is still at ``version``, e.g. the version a form
+        was rendered with, rather than the one loaded for this request.
+        """
+        try:
+            version = int(version)
+        except (TypeError, ValueError):
+            return
+        if getattr(self, '_loaded_values', None) is not None:
+            self._loaded_values['version'] = version
+
+    def delete(self, *args, **kwargs):
+        from .counters import record_task_transition
+        old_values = getattr(self, '_loaded_values', None)
+        with transaction.atomic():
+            result = super(Task, self).delete(*args, **kwargs)
+            if old_values is not None:
+                record_task_transition(old_values, None)
+        return result
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Task, cls).from_db(db, field_names, values)
+        instance._remember_loaded_values()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super(Task, self).refresh_from_db(using=using, fields=fields, **kwargs)
+        # Loading a deferred field refreshes just that field; keep other edits dirty
+        self._remember_loaded_values(fields)
+
+    def _remember_loaded_values(self, update_fields=None):
+        """
+        Snapshot the column values as they are in the database right now;
+        with ``update_fields`` (saved or reloaded) only those columns.
+        """
+        fields = self._meta.concrete_fields
+        if update_fields is not None:
+            fields = [self._meta.get_field(name) for name in update_fields]
+        snapshot = dict(getattr(self, '_loaded_values', None) or {}) if update_fields is not None else {}
+        for f in fields:
+            if f.attname in self.__dict__:
+                snapshot[f.attname] = _snapshot_value(self.__dict__[f.attname])
+        self._loaded_values = snapshot
+
+    def changed_fields(self):
+        """
+        ``{attname: (loaded value, current value)}`` for every column modified
+        since the task was loaded or last saved.
+        """
+        loaded = getattr(self, '_loaded_values', None) or {}
+        changes = {}
+        for f in self._meta.concrete_fields:
+            # version is bumped by save() itself
+            if f.primary_key or f.attname == 'version' or f.attname not in self.__dict__:
+                continue
+            value = self.__dict__[f.attname]
+            if f.attname not in loaded:
+                # Deferred when loaded and assigned since
+                changes[f.attname] = (None, value)
+            elif loaded[f.attname] != value or (isinstance(value, FieldFile) and not value._committed):
+                changes[f.attname] = (loaded[f.attname], value)
+        return changes
+
+    def assigned_by_department_id(self):
+        """Current department of assigned_by, read from their profile."""
+        if self.assigned_by_id is None:
+            return None
+        return UserProfile.objects.filter(user_id=self.assigned_by_id).values_list('department_id', flat=True).first()
 
-        super(Task, self).save(*args, **kwargs)
     @property
     def viewer_users(self):
-        """Convenience: Users whose email appears in viewers (for UI)."""
-        from django.contrib.auth.models import User
-        return User.objects.filter(email__in=self.viewers)
+        """Convenience: Users among the task's viewers (for UI)."""
+        return User.objects.filter(task_viewer_entries__task=self)
+
+    def set_viewers(self, emails):
+        """Replace the viewer list with ``emails`` and save it."""
+        self.viewers = normalize_viewer_emails(emails)
+        self.save(update_fields=['viewers'])
+
+    def sync_viewer_rows(self):
+        """
+        Bring the TaskViewer rows in line with ``viewers``: delete the emails
+        that were dropped and bulk insert the new ones.
+        """
+        wanted = set(normalize_viewer_emails(self.viewers))
+        current = set(self.viewer_entries.values_list('email', flat=True))
+        if current - wanted:
+            self.viewer_entries.filter(email__in=current - wanted).delete()
+        added = wanted - current
+        if added:
+            users = dict(
+                User.objects.annotate(email_lower=Lower('email'))
+                .filter(email_lower__in=added).values_list('email_lower', 'id')
+            )
+            TaskViewer.objects.bulk_create(
+                [TaskViewer(task=self, email=email, user_id=users.get(email)) for email in sorted(added)],
+                ignore_conflicts=True,
+            )
+
+    def task_id_prefix(self):
+        """First three letters of the department name, upper-cased."""
+        # Use the department if it is already loaded, else read just its name
+        if Task.department.is_cached(self):
+            return self.department.name[:3].upper() if self.department else ''
+        from .task_ids import department_prefix
+        return department_prefix(self.department_id)
 
     def generate_task_id(self):
-        prefix = ''
-        if self.department:
-            prefix = self.department.name[:3].upper()
-        random_code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-        return f"{prefix}-{random_code}"
+        from .task_ids import allocate_task_ids
+        return allocate_task_ids(self.task_id_prefix(), 1)[0]
 
-    def create_recurring_tasks(self):
+    def sync_recurrence_rule(self):
         """
-        Create new recurring tasks based on recurrence type, count, and duration.
+        Create, update or stop this task's RecurrenceRule to match its
+        recurrence fields. The occurrences themselves are created ahead of
+        time by the materialize_recurrences job; a new start date, interval
+        or type moves every occurrence date, so materializing starts over.
         """
-        self.assigned_date = date.today()
-        for i in range(1, self.recurrence_count + 1):
-            if self.recurrence_type == 'daily':
-                new_assigned_date = self.assigned_date + timedelta(days=i * self.recurrence_duration)
-                new_deadline = self.deadline + timedelta(days=i * self.recurrence_duration)
-            elif self.recurrence_type == 'weekly':
-                new_assigned_date = self.assigned_date + timedelta(weeks=i * self.recurrence_duration)
-                new_deadline = self.deadline + timedelta(weeks=i * self.recurrence_duration)
-            else:
-                continue
+        if not self.is_recurring or self.recurrence_type not in dict(self.RECURRENCE_TYPE_CHOICES):
+            RecurrenceRule.objects.filter(task=self).update(active=False)
+            return
+        start_date = self.assigned_date.date() if isinstance(self.assigned_date, datetime) else self.assigned_date
+        values = {
+            'recurrence_type': self.recurrence_type,
+            'interval': max(self.recurrence_duration or 1, 1),
+            'count': max(self.recurrence_count or 0, 0),
+            'start_date': start_date,
+            'first_deadline': self.deadline,
+            'active': True,
+        }
+        rule = RecurrenceRule.objects.select_for_update().filter(task=self).first()
+        if rule is None:
+            RecurrenceRule.objects.create(task=self, **values)
+            return
+        if any(getattr(rule, name) != values[name] for name in ('recurrence_type', 'interval', 'start_date')):
+            rule.materialized_through = None
+        for name, value in values.items():
+            setattr(rule, name, value)
+        rule.save()
+
+    def occurrence_from(self, rule, number):
+        """
+        A new, unsaved Task for occurrence ``number`` of ``rule``, which has
+        this task as its template. ``task_id`` is left for the caller.
+        """
+        step = rule.step(number)
+        occurrence_date = rule.start_date + step
+        return Task(
+            assigned_by_id=self.assigned_by_id,
+            assigned_to_id=self.assigned_to_id,
+            assignor_department_id=self.assignor_department_id,
+            department=self.department,
+            ticket_type=self.ticket_type,
+            priority=self.priority,
+            subject=self.subject,
+            request_details=self.request_details,
+            is_recurring=False,  # Newly created tasks are not recurring
+            is_recurred_task=True,  # Mark as recurred task
+            recurrence_type=None,
+            recurrence_count=self.recurrence_count,
+            recurrence_duration=self.recurrence_duration,
+            recurrence_rule=rule,
+            occurrence_date=occurrence_date,
+            assigned_date=timezone.make_aware(datetime(occurrence_date.year, occurrence_date.month, occurrence_date.day)),
+            deadline=rule.first_deadline + step,
+            attach_file=self.attach_file,
+            notes=self.notes,
+        )
 
-            new_task = Task(
-                assigned_by=self.assigned_by,
-                assigned_to=self.assigned_to,
-                department=self.department,
-                ticket_type=self.ticket_type,
-                priority=self.priority,
-                status=self.status,
-                subject=self.subject,
-                request_details=self.request_details,
-                is_recurring=False,  # Newly created tasks are not recurring
-                is_recurred_task=True,  # Mark as recurred task
-                recurrence_type=None,
-                recurrence_count=self.recurrence_count,
-                recurrence_duration=self.recurrence_duration,
-                assigned_date=new_assigned_date,
-                deadline=new_deadline,
-                attach_file=self.attach_file,
-                notes=self.notes
-            )
-            new_task.save()
+
+def _snapshot_value(value):
+    # Copy lists (viewers) so in-place edits still show up as changes, and keep
+    # file names rather than FieldFiles, which are renamed in place on upload
+    if isinstance(value, list):
+        return list(value)
+    if isinstance(value, FieldFile):
+        return value.name
+    return value
+
+
+def normalize_viewer_emails(emails):
+    """Lowercased, de-duplicated, sorted viewer emails."""
+    return sorted({(e or '').strip().lower() for e in (emails or []) if (e or '').strip()})
+
+
+def users_by_email(emails):
+    """
+    Map each of ``emails``, lowercased, to its account in one query on the
+    auth_user_email_lower_idx index. The oldest account wins a shared email.
+    """
+    emails = normalize_viewer_emails(emails)
+    if not emails:
+        return {}
+    users = User.objects.annotate(email_lower=Lower('email')).filter(email_lower__in=emails).order_by('-pk')
+    return {user.email_lower: user for user in users}
+
+
+class TaskViewer(models.Model):
+    """
+    One viewer of a task, by (lowercased) email. ``user`` is filled in when the
+    email belonged to an account at the time the viewer was added.
+    """
+    task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='viewer_entries')
+    email = models.EmailField()
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='task_viewer_entries')
+    added_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['task', 'email'], name='unique_task_viewer'),
+        ]
+        indexes = [
+            # "Tasks I'm watching"
+            models.Index(fields=['email', 'task'], name='taskviewer_email_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.email} views {self.task.task_id}"
 
 
 class TaskChat(models.Model):
@@ -175,10 +464,35 @@ class TaskChat(models.Model):
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # A task's conversation in order, paged on (timestamp, id)
+            models.Index(fields=['task', 'timestamp', 'id'], name='taskchat_task_time_id_idx'),
+            # Messages past a read cursor
+            models.Index(fields=['task', 'id'], name='taskchat_task_id_idx'),
+        ]
 
     def __str__(self):
         return f"Message by {self.sender.username} on {self.task.task_id} at {self.timestamp}"
 
+
+class ChatReadCursor(models.Model):
+    """
+    How far ``user`` has read ``task``'s chat: messages with a higher id are
+    unread for them. One row per user and task, only ever moved forward.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_read_cursors')
+    task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='chat_read_cursors')
+    last_read_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'task'], name='unique_chat_read_cursor'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} read {self.task.task_id} up to {self.last_read_id}"
+
     
 class ActivityLog(models.Model):
     ACTION_CHOICES = [
@@ -197,5 +511,257 @@ class ActivityLog(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     description = models.TextField(blank=True)
 
+    class Meta:
+        indexes = [
+            # Activity page and export, newest first
+            models.Index(fields=['-timestamp'], name='activitylog_time_idx'),
+            # One task's history, newest first
+            models.Index(fields=['task', '-timestamp'], name='activitylog_task_time_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user.username} {self.action} task {self.task.task_id} on {self.timestamp}"
+
+
+class DepartmentMetricsSnapshot(models.Model):
+    """
+    Materialized open-ticket counters for one department. Task writes adjust
+    these incrementally; the hourly metrics_reconcile job recomputes them from
+    the Task table to correct drift. tickets_passed_72_hours only changes with
+    the clock, so it is as of ``reconciled_at`` and the metrics count it live.
+    """
+    department = models.OneToOneField(Department, on_delete=models.CASCADE, related_name='metrics_snapshot')
+    open_tickets_received = models.IntegerField(default=0)
+    open_tickets_raised = models.IntegerField(default=0)
+    tickets_passed_72_hours = models.IntegerField(default=0)
+    tickets_passed_revised_deadline = models.IntegerField(default=0)
+    reconciled_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Metrics snapshot for {self.department.name}"
+
+
+class DepartmentHourlyFlow(models.Model):
+    """
+    Ticket flow for one department in one clock hour (UTC). Summing the
+    buckets of a window answers "how many tickets were received / raised /
+    completed / reassigned" without scanning the Task table.
+    """
+    department = models.ForeignKey(Department, on_delete=models.CASCADE, related_name='hourly_flow')
+    hour = models.DateTimeField()
+    tickets_received = models.IntegerField(default=0)
+    tickets_raised = models.IntegerField(default=0)
+    tickets_completed = models.IntegerField(default=0)
+    tickets_reassigned = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['department', 'hour'], name='unique_department_hour_flow'),
+        ]
+        indexes = [
+            models.Index(fields=['hour', 'department'], name='hourly_flow_hour_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.department.name} flow at {self.hour}"
+
+
+class EmailOutbox(models.Model):
+    """
+    An email waiting to be delivered. Views write rows in their own
+    transaction; the drain_outbox command sends them over reused SMTP
+    connections and retries failures with backoff.
+    """
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+
+    subject = models.CharField(max_length=255)
+    from_email = models.CharField(max_length=254)
+    to = models.JSONField(default=list)
+    cc = models.JSONField(default=list, blank=True)
+    html_body = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    # Set when a worker claims the row; stale claims are picked up again
+    claim_token = models.CharField(max_length=32, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # The worker's "what is due" query
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} to {', '.join(self.to)} ({self.status})"
+
+
+class NotificationPreference(models.Model):
+    """
+    How a user wants their notification emails: one per event, or merged
+    into an hourly or daily digest by the send_digests command.
+    """
+    IMMEDIATE = 'immediate'
+    HOURLY = 'hourly'
+    DAILY = 'daily'
+    MODE_CHOICES = [
+        (IMMEDIATE, 'Immediately, one email per event'),
+        (HOURLY, 'Hourly digest'),
+        (DAILY, 'Daily digest'),
+    ]
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='notification_preference')
+    mode = models.CharField(max_length=10, choices=MODE_CHOICES, default=IMMEDIATE)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username}: {self.get_mode_display()}"
+
+
+class PendingNotification(models.Model):
+    """An event held back for a user's next digest email."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='pending_notifications')
+    subject = models.CharField(max_length=255)
+    url = models.CharField(max_length=500, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='pending_notif_user_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} for {self.user.username}"
+
+
+class NotificationLedger(models.Model):
+    """
+    One row per scheduled notification already sent, so reruns and other
+    nodes skip it. ``period`` is the date the notification is for: the task's
+    deadline for reminders, the day of the run for overdue notices.
+    """
+    DEADLINE_REMINDER = 'deadline_reminder'
+    OVERDUE = 'overdue'
+    KIND_CHOICES = [
+        (DEADLINE_REMINDER, 'Deadline reminder'),
+        (OVERDUE, 'Overdue notification'),
+    ]
+
+    task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='notification_ledger')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    period = models.DateField()
+    sent_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['task', 'kind', 'period'], name='unique_task_notification_period'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} for {self.task_id} ({self.period})"
+
+
+class JobLease(models.Model):
+    """
+    Which scheduler node may run a periodic job, until when. A node takes the
+    lease with a conditional UPDATE once it has expired, so each job runs on
+    one node per interval.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    holder = models.CharField(max_length=100, blank=True)
+    expires_at = models.DateTimeField()
+    last_run_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name} held by {self.holder or 'nobody'} until {self.expires_at}"
+
+
+class RecurrenceRule(models.Model):
+    """
+    How a recurring task repeats. Occurrence ``n`` (1..count) is assigned
+    ``n * interval`` days or weeks after ``start_date``; the
+    materialize_recurrences job creates the ones falling within its horizon.
+    """
+    task = models.OneToOneField(Task, on_delete=models.CASCADE, related_name='recurrence')
+    recurrence_type = models.CharField(max_length=10, choices=Task.RECURRENCE_TYPE_CHOICES)
+    interval = models.PositiveIntegerField(default=1)
+    count = models.PositiveIntegerField(default=1)
+    start_date = models.DateField()
+    first_deadline = models.DateField()
+    # Occurrences assigned up to this date exist already
+    materialized_through = models.DateField(null=True, blank=True)
+    # Cleared when recurrence is switched off or every occurrence exists
+    active = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['active', 'materialized_through'], name='recurrence_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_recurrence_type_display()} every {self.interval} for task {self.task_id}"
+
+    def step(self, number):
+        if self.recurrence_type == 'weekly':
+            return timedelta(weeks=number * self.interval)
+        return timedelta(days=number * self.interval)
+
+    @property
+    def last_date(self):
+        return self.start_date + self.step(self.count)
+
+    def pending_numbers(self, through):
+        """Occurrence numbers assigned after ``materialized_through`` and up to ``through``."""
+        for number in range(1, self.count + 1):
+            occurrence_date = self.start_date + self.step(number)
+            if occurrence_date > through:
+                break
+            if self.materialized_through is None or occurrence_date > self.materialized_through:
+                yield number
+
+
+class TaskIdSequence(models.Model):
+    """
+    Next unreserved sequence number for one task ID prefix. Allocators take a
+    block of numbers with one locked update and hand them out from memory.
+    """
+    prefix = models.CharField(max_length=10, unique=True, blank=True)
+    next_value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.prefix or '(none)'}: {self.next_value}"
+
+
+class LiveEvent(models.Model):
+    """
+    A chat message or task change on its way to the live streams of other
+    workers (events.DatabaseBackend). Rows are pruned after a short while.
+    """
+    channel = models.CharField(max_length=64)
+    kind = models.CharField(max_length=20)
+    data = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Replaying a stream after a reconnect
+            models.Index(fields=['channel', 'id'], name='liveevent_channel_idx'),
+            models.Index(fields=['created_at'], name='liveevent_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} on {self.channel}"
@@ -0,0 +1,178 @@
+# task_app/notifications.py
+
+from collections import namedtuple
+from itertools import groupby
+
+from django.db import transaction
+from django.db.models.functions import Lower
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import NotificationPreference, PendingNotification
+from .outbox import queue_email
+
+SITE_URL = "http://127.0.0.1:8000"
+
+# Preference modes each send_digests period delivers. The hourly run also
+# flushes what is left over for users who switched back to immediate emails.
+DIGEST_PERIODS = {
+    NotificationPreference.HOURLY: [NotificationPreference.HOURLY, NotificationPreference.IMMEDIATE],
+    NotificationPreference.DAILY: [NotificationPreference.DAILY],
+}
+
+# One email of a planned event; ``to`` and ``cc`` are lowercased addresses
+PlannedEmail = namedtuple('PlannedEmail', 'subject template_name context to cc')
+
+
+def _address(recipient):
+    """Lowercased address of a User or a plain email string."""
+    email = getattr(recipient, 'email', recipient)
+    return (email or '').strip().lower()
+
+
+class NotificationEvent:
+    """
+    The emails sent for one event (a task created, a deadline revised, ...).
+
+    Callers add one message per recipient role with ``notify()``; ``send()``
+    then queues the smallest set of emails that covers them:
+
+    * every address receives the event once: the first role it appears in
+      wins, and CC addresses that are also direct recipients are dropped;
+    * the CC list goes on the first email only;
+    * non-personal messages with the same subject, template and context are
+      merged into one email with several recipients and rendered once;
+    * recipients who chose a digest get a PendingNotification instead, and
+      are left out of the email.
+    """
+
+    def __init__(self, cc_emails=None):
+        self.cc_emails = cc_emails or []
+        self._parts = []
+
+    def notify(self, recipient, subject, template_name, context, personal=False):
+        """
+        Add a message for ``recipient`` (a User or an address). With
+        ``personal`` the template also gets the recipient as ``user``, so it
+        is rendered for them alone.
+        """
+        self._parts.append((recipient, subject, template_name, context, personal))
+        return self
+
+    def plan(self):
+        seen = set()
+        emails = []
+        shared = {}  # (subject, template_name) -> indexes of mergeable emails
+        for recipient, subject, template_name, context, personal in self._parts:
+            address = _address(recipient)
+            if not address or address in seen:
+                continue
+            seen.add(address)
+
+            if personal:
+                emails.append(PlannedEmail(subject, template_name, {**context, 'user': recipient}, [address], []))
+                continue
+            for index in shared.get((subject, template_name), []):
+                if emails[index].context == context:
+                    emails[index].to.append(address)
+                    break
+            else:
+                shared.setdefault((subject, template_name), []).append(len(emails))
+                emails.append(PlannedEmail(subject, template_name, context, [address], []))
+
+        cc = sorted({_address(e) for e in self.cc_emails} - seen - {''})
+        if emails and cc:
+            emails[0].cc.extend(cc)
+        return emails
+
+    def send(self):
+        """
+        Render each planned email once and queue it, holding back digest
+        recipients. Returns how many emails were queued.
+        """
+        planned = self.plan()
+        digest = digest_recipients(address for email in planned for address in email.to + email.cc)
+        held = []
+        queued = 0
+        for email in planned:
+            held.extend(
+                PendingNotification(user_id=digest[address], subject=email.subject, url=event_url(email.context))
+                for address in email.to + email.cc if address in digest
+            )
+            to = [address for address in email.to if address not in digest]
+            cc = [address for address in email.cc if address not in digest]
+            if not to:
+                to, cc = cc, []
+            if to:
+                queue_email(email.subject, render_to_string(email.template_name, email.context), to, cc)
+                queued += 1
+        PendingNotification.objects.bulk_create(held)
+        return queued
+
+
+def event_url(context):
+    """The link a notification points at, for its digest line."""
+    return context.get('view_ticket_url') or context.get('view_message_url') or ''
+
+
+def digest_recipients(addresses):
+    """Map the lowercased ``addresses`` of users who get digests to their user ids."""
+    addresses = {address for address in addresses if address}
+    if not addresses:
+        return {}
+    return dict(
+        NotificationPreference.objects.exclude(mode=NotificationPreference.IMMEDIATE)
+        .annotate(address=Lower('user__email'))
+        .filter(address__in=addresses)
+        .values_list('address', 'user_id')
+    )
+
+
+def notification_settings_url():
+    return SITE_URL + reverse('notification_settings')
+
+
+def send_digests(period, now=None):
+    """
+    Merge the pending notifications of every user on ``period`` into one
+    queued email each. Repeats of the same event are listed once with a count.
+    Returns (users emailed, notifications merged).
+    """
+    now = now or timezone.now()
+    pending = (
+        PendingNotification.objects
+        .filter(user__notification_preference__mode__in=DIGEST_PERIODS[period], created_at__lte=now)
+        .select_related('user')
+        .only('subject', 'url', 'created_at', 'user__username', 'user__email', 'user__first_name', 'user__last_name')
+        .order_by('user_id', 'created_at')
+    )
+    settings_url = notification_settings_url()
+    users = merged = 0
+    for _, entries in groupby(pending.iterator(), key=lambda entry: entry.user_id):
+        entries = list(entries)
+        user = entries[0].user
+        events = {}
+        for entry in entries:
+            event = events.setdefault((entry.subject, entry.url), {
+                'subject': entry.subject, 'url': entry.url, 'count': 0, 'last_at': entry.created_at,
+            })
+            event['count'] += 1
+            event['last_at'] = entry.created_at
+        context = {
+            'user': user,
+            'period': period,
+            'events': list(events.values()),
+            'notification_settings_url': settings_url,
+        }
+        with transaction.atomic():
+            if user.email:
+                queue_email(
+                    f"Your {period} task digest: {len(entries)} update{'s' if len(entries) != 1 else ''}",
+                    render_to_string('emails/notification_digest.html', context),
+                    [user.email],
+                )
+                users += 1
+            PendingNotification.objects.filter(id__in=[entry.id for entry in entries]).delete()
+        merged += len(entries)
+    return users, merged
@@ -0,0 +1,176 @@
+# task_app/outbox.py
+
+import logging
+import random
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db.models import Q
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FROM_EMAIL = 'no-reply@yourdomain.com'
+
+MAX_ATTEMPTS = 5
+BACKOFF_BASE_SECONDS = 60
+BACKOFF_MAX_SECONDS = 6 * 60 * 60
+# A claimed row whose worker died is handed out again after this long
+CLAIM_TIMEOUT = timedelta(minutes=10)
+
+DeliveryReport = namedtuple('DeliveryReport', 'sent retried failed')
+
+
+def queue_email(subject, html_body, to, cc=None):
+    """
+    Queue an already rendered HTML email for delivery. Runs inside the
+    caller's transaction, so the email only goes out if the write that caused
+    it commits. Returns the EmailOutbox row, or None without a recipient.
+    """
+    to = [e for e in to if e]
+    if not to:
+        logger.warning("Not queueing %r: no recipient address", subject)
+        return None
+    return EmailOutbox.objects.create(
+        subject=subject,
+        from_email=DEFAULT_FROM_EMAIL,
+        to=to,
+        cc=sorted({e.strip().lower() for e in (cc or []) if e and e.strip()}),
+        html_body=html_body,
+    )
+
+
+def enqueue_email(subject, template_name, context, recipient_email, cc_emails=None):
+    """Render ``template_name`` and queue it for one recipient."""
+    if not recipient_email:
+        logger.warning("Not queueing %r: no recipient address", subject)
+        return None
+    return queue_email(subject, render_to_string(template_name, context), [recipient_email], cc_emails)
+
+
+def backoff_delay(attempts):
+    """Exponential backoff with jitter for the ``attempts``-th failure."""
+    delay = min(BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), BACKOFF_MAX_SECONDS)
+    return timedelta(seconds=delay + random.uniform(0, BACKOFF_BASE_SECONDS))
+
+
+def claim_batch(limit, now=None):
+    """
+    Claim up to ``limit`` due rows for this worker. The claim is a conditional
+    UPDATE tagged with a fresh token, so concurrent workers never get the same row.
+    """
+    now = now or timezone.now()
+    due = (
+        Q(status=EmailOutbox.PENDING, next_attempt_at__lte=now)
+        | Q(status=EmailOutbox.SENDING, claimed_at__lt=now - CLAIM_TIMEOUT)
+    )
+    ids = list(EmailOutbox.objects.filter(due).order_by('next_attempt_at').values_list('id', flat=True)[:limit])
+    if not ids:
+        return []
+    token = uuid.uuid4().hex
+    EmailOutbox.objects.filter(due, id__in=ids).update(status=EmailOutbox.SENDING, claim_token=token, claimed_at=now)
+    return list(EmailOutbox.objects.filter(id__in=ids, claim_token=token))
+
+
+def build_message(row, connection=None):
+    message = EmailMultiAlternatives(
+        subject=row.subject,
+        body='',
+        from_email=row.from_email,
+        to=row.to,
+        cc=row.cc,
+        connection=connection,
+    )
+    message.attach_alternative(row.html_body, 'text/html')
+    return message
+
+
+def send_over_connection(messages):
+    """
+    Send ``messages`` one by one over a single SMTP connection, reopening it
+    after a failure. Returns one error string (or None) per message.
+    """
+    errors = []
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as e:
+        return [f'Could not connect: {e}'] * len(messages)
+    try:
+        for message in messages:
+            message.connection = connection
+            try:
+                connection.send_messages([message])
+                errors.append(None)
+            except Exception as e:
+                errors.append(str(e) or e.__class__.__name__)
+                # The session may be broken; start a fresh one for the rest
+                connection.close()
+                try:
+                    connection.open()
+                except Exception:
+                    pass
+    finally:
+        connection.close()
+    return errors
+
+
+def send_in_parallel(messages, workers):
+    """
+    Spread ``messages`` over at most ``workers`` threads, each holding one
+    reused connection and sending a contiguous slice, so neighbouring messages
+    share a connection. Returns the errors in the order of ``messages``.
+    """
+    workers = max(1, min(workers, len(messages)))
+    size = -(-len(messages) // workers)
+    chunks = [list(range(i, min(i + size, len(messages)))) for i in range(0, len(messages), size)]
+    errors = [None] * len(messages)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for chunk, chunk_errors in zip(chunks, pool.map(lambda c: send_over_connection([messages[i] for i in c]), chunks)):
+            for index, error in zip(chunk, chunk_errors):
+                errors[index] = error
+    return errors
+
+
+def deliver_outbox(batch_size=100, workers=4, max_attempts=MAX_ATTEMPTS):
+    """Claim one batch of due emails, send it and record the outcome."""
+    rows = claim_batch(batch_size)
+    if not rows:
+        return DeliveryReport(0, 0, 0)
+
+    # SMTP only happens in the threads; all database writes stay on this one
+    errors = send_in_parallel([build_message(row) for row in rows], workers)
+
+    now = timezone.now()
+    sent_ids = [row.id for row, error in zip(rows, errors) if error is None]
+    EmailOutbox.objects.filter(id__in=sent_ids).update(
+        status=EmailOutbox.SENT, sent_at=now, claim_token='', claimed_at=None, last_error='',
+    )
+
+    unsent = []
+    for row, error in zip(rows, errors):
+        if error is None:
+            continue
+        row.attempts += 1
+        row.last_error = error
+        row.claim_token = ''
+        row.claimed_at = None
+        if row.attempts >= max_attempts:
+            row.status = EmailOutbox.FAILED
+            logger.error("Giving up on outbox email %s after %s attempts: %s", row.id, row.attempts, error)
+        else:
+            row.status = EmailOutbox.PENDING
+            row.next_attempt_at = now + backoff_delay(row.attempts)
+        unsent.append(row)
+    EmailOutbox.objects.bulk_update(
+        unsent, ['attempts', 'last_error', 'claim_token', 'claimed_at', 'status', 'next_attempt_at'],
+    )
+
+    failed = sum(1 for row in unsent if row.status == EmailOutbox.FAILED)
+    return DeliveryReport(len(sent_ids), len(unsent) - failed, failed)
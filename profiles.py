@@ -0,0 +1,88 @@
+# task_app/profiles.py
+
+from uuid import uuid4
+
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Department, UserProfile
+
+# Profiles are invalidated by replacing version tokens in the cache, which
+# only reaches every worker when the default cache is shared (Redis,
+# Memcached, the database). With a per-process LocMemCache another worker
+# keeps its entry, so there the timeout is what bounds a stale profile.
+PROFILE_CACHE_TIMEOUT = 60 * 60
+LOCAL_PROFILE_CACHE_TIMEOUT = 5
+DEPARTMENTS_VERSION_KEY = 'user_profile:departments:version'
+
+
+def _user_version_key(user_id):
+    return f'user_profile:{user_id}:version'
+
+
+def _versions(user_id):
+    """
+    The current version tokens for ``user_id``'s profile and for departments.
+    A save replaces the token, so older entries are simply never read again.
+    """
+    keys = (_user_version_key(user_id), DEPARTMENTS_VERSION_KEY)
+    versions = cache.get_many(keys)
+    missing = {key: uuid4().hex for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+    versions.update(missing)
+    return versions[keys[0]], versions[keys[1]]
+
+
+def _profile_timeout():
+    if isinstance(caches[DEFAULT_CACHE_ALIAS], LocMemCache):
+        return LOCAL_PROFILE_CACHE_TIMEOUT
+    return PROFILE_CACHE_TIMEOUT
+
+
+def load_profile(user):
+    """
+    ``user``'s UserProfile with its department, or None if they have none.
+    Served from the cache until the profile or a department is saved (see
+    PROFILE_CACHE_TIMEOUT for caches that are not shared between workers).
+    """
+    if not getattr(user, 'is_authenticated', False):
+        return None
+    key = 'user_profile:{}:{}:{}'.format(user.pk, *_versions(user.pk))
+    entry = cache.get(key)
+    if entry is None:
+        # Cached as a 1-tuple so users without a profile are remembered too
+        entry = (UserProfile.objects.select_related('department').filter(user_id=user.pk).first(),)
+        cache.set(key, entry, _profile_timeout())
+    profile = entry[0]
+    if profile is not None:
+        # Link both ways, so profile.user and user.userprofile need no query
+        UserProfile.user.field.set_cached_value(profile, user)
+        UserProfile.user.field.remote_field.set_cached_value(user, profile)
+    return profile
+
+
+def get_profile(request_or_user):
+    """
+    The profile of a request's user or of a user, reusing the one
+    UserProfileMiddleware loaded. Raises UserProfile.DoesNotExist like
+    ``UserProfile.objects.get(user=...)``.
+    """
+    user = getattr(request_or_user, 'user', request_or_user)
+    related = UserProfile.user.field.remote_field
+    profile = related.get_cached_value(user) if related.is_cached(user) else load_profile(user)
+    if profile is None:
+        raise UserProfile.DoesNotExist("User has no profile")
+    return profile
+
+
+@receiver([post_save, post_delete], sender=UserProfile)
+def invalidate_profile(sender, instance, **kwargs):
+    cache.set(_user_version_key(instance.user_id), uuid4().hex, None)
+
+
+@receiver([post_save, post_delete], sender=Department)
+def invalidate_departments(sender, instance, **kwargs):
+    cache.set(DEPARTMENTS_VERSION_KEY, uuid4().hex, None)
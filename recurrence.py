@@ -0,0 +1,73 @@
+# task_app/recurrence.py
+
+import time
+from collections import namedtuple
+from datetime import date, timedelta
+
+from django.db import transaction
+from django.db.models import Q
+
+from .counters import record_tasks_created
+from .models import RecurrenceRule, Task
+from .task_ids import assign_task_ids
+
+# How far ahead occurrences exist as Task rows
+HORIZON = timedelta(days=14)
+RULE_BATCH_SIZE = 500
+
+MaterializeReport = namedtuple('MaterializeReport', 'rules created seconds')
+
+
+def materialize_recurrences(today=None, horizon=HORIZON, batch_size=RULE_BATCH_SIZE):
+    """
+    Create the occurrences of every active rule assigned up to ``today +
+    horizon``, one bulk_create per batch of rules. Occurrences that already
+    exist for a (rule, date) are skipped, so reruns and overlapping runs
+    create nothing new.
+    """
+    today = today or date.today()
+    through = today + horizon
+    started = time.monotonic()
+    rules = (
+        RecurrenceRule.objects.filter(active=True, count__gt=0)
+        .filter(Q(materialized_through__isnull=True) | Q(materialized_through__lt=through))
+        .select_related('task', 'task__department')
+        .order_by('pk')
+    )
+    rule_count = created = 0
+    last_pk = 0
+    while True:
+        batch = list(rules.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            break
+        last_pk = batch[-1].pk
+        rule_count += len(batch)
+        created += _materialize_batch(batch, through)
+    return MaterializeReport(rule_count, created, time.monotonic() - started)
+
+
+def _materialize_batch(rules, through):
+    occurrences = [
+        rule.task.occurrence_from(rule, number)
+        for rule in rules
+        for number in rule.pending_numbers(through)
+    ]
+    existing = set(
+        Task.objects.filter(recurrence_rule__in=rules, occurrence_date__in={o.occurrence_date for o in occurrences})
+        .values_list('recurrence_rule_id', 'occurrence_date')
+    ) if occurrences else set()
+    new = [o for o in occurrences if (o.recurrence_rule_id, o.occurrence_date) not in existing]
+    assign_task_ids(new)
+
+    for rule in rules:
+        rule.materialized_through = min(through, rule.last_date)
+        rule.active = rule.last_date > through
+    with transaction.atomic():
+        # A run overlapping this one may have inserted some of them since the
+        # check above; unique_rule_occurrence drops those here
+        Task.objects.bulk_create(new, batch_size=1000, ignore_conflicts=True)
+        inserted = set(Task.objects.filter(task_id__in=[o.task_id for o in new]).values_list('task_id', flat=True))
+        new = [o for o in new if o.task_id in inserted]
+        record_tasks_created(new)
+        RecurrenceRule.objects.bulk_update(rules, ['materialized_through', 'active'])
+    return len(new)
@@ -0,0 +1,84 @@
+# task_app/scheduler.py
+
+import logging
+import os
+import socket
+from collections import namedtuple
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .models import JobLease, NotificationPreference
+from .counters import reconcile_department_metrics
+from .events import prune_live_events
+from .notifications import send_digests
+from .recurrence import materialize_recurrences
+from .tasks import notify_overdue_tasks_logic, send_deadline_reminders_logic, sweep_overdue_statuses
+
+logger = logging.getLogger(__name__)
+
+# A periodic job: ``run`` is called with no arguments at most once per
+# ``interval``. While it runs its node holds the lease for ``timeout``, which
+# must outlast the slowest run; a node that dies mid-run blocks it that long.
+Job = namedtuple('Job', 'name interval run timeout', defaults=[timedelta(hours=1)])
+
+JOBS = [
+    Job('recurrences', timedelta(hours=1), materialize_recurrences),
+    Job('overdue_sweep', timedelta(minutes=15), sweep_overdue_statuses),
+    Job('deadline_reminders', timedelta(hours=1), send_deadline_reminders_logic),
+    Job('overdue_notifications', timedelta(hours=1), notify_overdue_tasks_logic),
+    Job('hourly_digests', timedelta(hours=1), lambda: send_digests(NotificationPreference.HOURLY)),
+    Job('daily_digests', timedelta(days=1), lambda: send_digests(NotificationPreference.DAILY), timedelta(hours=3)),
+    Job('live_event_prune', timedelta(minutes=15), prune_live_events),
+    # Corrects counter drift from bulk updates and refreshes tickets_passed_72_hours
+    Job('metrics_reconcile', timedelta(hours=1), reconcile_department_metrics),
+]
+
+
+def node_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def acquire_lease(name, holder, duration, now=None):
+    """
+    Take the ``name`` lease for ``duration`` if it has expired. The take is a
+    conditional UPDATE, so of several nodes racing for it exactly one wins.
+    """
+    now = now or timezone.now()
+    JobLease.objects.bulk_create([JobLease(name=name, expires_at=now)], ignore_conflicts=True)
+    return JobLease.objects.filter(name=name, expires_at__lte=now).update(
+        holder=holder, expires_at=now + duration, last_run_at=now,
+    ) == 1
+
+
+def hold_lease(name, holder, until):
+    """Keep ``name`` until ``until`` if ``holder`` still has it."""
+    JobLease.objects.filter(name=name, holder=holder).update(expires_at=until)
+
+
+def release_lease(name, holder, now=None):
+    """Let another node take ``name`` right away, e.g. after a failed run."""
+    hold_lease(name, holder, now or timezone.now())
+
+
+def run_due_jobs(holder=None, jobs=JOBS):
+    """
+    Run every job whose lease this node can take. Returns {name: result}.
+    The lease covers the run for ``job.timeout``, then a finished run keeps
+    it until one interval after the run started.
+    """
+    holder = holder or node_name()
+    results = {}
+    for job in jobs:
+        started = timezone.now()
+        if not acquire_lease(job.name, holder, job.timeout, started):
+            continue
+        try:
+            results[job.name] = job.run()
+        except Exception:
+            logger.exception("Scheduled job %s failed", job.name)
+            release_lease(job.name, holder)
+            continue
+        hold_lease(job.name, holder, started + job.interval)
+        logger.info("Scheduled job %s: %s", job.name, results[job.name])
+    return results
@@ -0,0 +1,8 @@
+# task_app/signals.py
+
+from django.dispatch import Signal
+
+# Sent by Task.save inside the write's transaction, with ``instance``,
+# ``created`` and ``changes``: ``{attname: (old value, new value)}`` for the
+# columns the save wrote (empty for a new task).
+task_changed = Signal()
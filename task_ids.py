@@ -0,0 +1,99 @@
+# task_app/task_ids.py
+
+import string
+import threading
+from collections import defaultdict, deque
+
+from django.db import transaction
+
+from .models import Department, Task, TaskIdSequence
+
+ALPHABET = string.ascii_uppercase + string.digits
+CODE_LENGTH = 6
+CODE_SPACE = len(ALPHABET) ** CODE_LENGTH
+# Coprime with CODE_SPACE, so n -> n * MULTIPLIER mod CODE_SPACE is a bijection:
+# consecutive sequence numbers map to distinct, unordered-looking codes
+MULTIPLIER = 1345325471
+OFFSET = 104729
+
+BLOCK_SIZE = 100
+
+_lock = threading.Lock()
+_reserved = defaultdict(deque)  # prefix -> codes reserved by committed transactions
+
+
+def department_prefix(department_id):
+    if department_id is None:
+        return ''
+    name = Department.objects.filter(pk=department_id).values_list('name', flat=True).first() or ''
+    return name[:3].upper()
+
+
+def encode(number):
+    """The code for sequence ``number``, e.g. 0 -> 'ACF3OK'."""
+    value = (number * MULTIPLIER + OFFSET) % CODE_SPACE
+    chars = []
+    for _ in range(CODE_LENGTH):
+        value, digit = divmod(value, len(ALPHABET))
+        chars.append(ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+
+def _reserve_block(prefix, size):
+    """
+    Reserve ``size`` sequence numbers for ``prefix`` with one locked update and
+    return their task IDs, minus any already taken by older random IDs.
+    """
+    TaskIdSequence.objects.bulk_create([TaskIdSequence(prefix=prefix)], ignore_conflicts=True)
+    sequence = TaskIdSequence.objects.select_for_update().get(prefix=prefix)
+    start = sequence.next_value
+    if start + size > CODE_SPACE:
+        raise RuntimeError(f"Task ID space for prefix '{prefix}' is exhausted")
+    sequence.next_value = start + size
+    sequence.save(update_fields=['next_value'])
+    ids = [f"{prefix}-{encode(number)}" for number in range(start, start + size)]
+    taken = set(Task.objects.filter(task_id__in=ids).values_list('task_id', flat=True))
+    return [task_id for task_id in ids if task_id not in taken]
+
+
+def allocate_task_ids(prefix, count):
+    """
+    ``count`` unused task IDs of the form ``PFX-XXXXXX``. IDs come from this
+    process's reserved blocks; a new block of at least BLOCK_SIZE is taken when
+    they run out. The block is reserved in the caller's transaction, so the
+    sequence row stays locked until that commits; blocks keep this to one
+    task in BLOCK_SIZE. Leftovers of a new block are only kept once the
+    transaction commits, since a rollback also undoes the reservation.
+    """
+    with _lock:
+        pool = _reserved[prefix]
+        ids = [pool.popleft() for _ in range(min(count, len(pool)))]
+    with transaction.atomic():
+        while len(ids) < count:
+            block = _reserve_block(prefix, max(BLOCK_SIZE, count - len(ids)))
+            needed = count - len(ids)
+            ids.extend(block[:needed])
+            leftovers = block[needed:]
+            if leftovers:
+                transaction.on_commit(lambda leftovers=leftovers: _keep(prefix, leftovers))
+    return ids
+
+
+def _keep(prefix, task_ids):
+    with _lock:
+        _reserved[prefix].extend(task_ids)
+
+
+def assign_task_ids(tasks, prefix_of=None):
+    """
+    Fill in ``task_id`` on unsaved ``tasks`` before a bulk_create, with one
+    allocation per prefix. ``prefix_of(task)`` defaults to the department prefix.
+    """
+    prefix_of = prefix_of or (lambda task: task.task_id_prefix())
+    by_prefix = defaultdict(list)
+    for task in tasks:
+        if not task.task_id:
+            by_prefix[prefix_of(task)].append(task)
+    for prefix, group in by_prefix.items():
+        for task, task_id in zip(group, allocate_task_ids(prefix, len(group))):
+            task.task_id = task_id
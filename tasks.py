@@ -1,67 +1,204 @@
-from django.utils.timezone import now
-from datetime import timedelta
-from .models import Task, User
-from django.core.mail import send_mail
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from itertools import islice
+
+from django.core.mail import EmailMultiAlternatives
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+from django.db.models.functions import Coalesce
 from django.template.loader import render_to_string
 
-def send_deadline_reminders_logic():
-    # Get current time
-    current_time = now()
-
-    # Calculate the time window for 24-hour reminders
-    reminder_time = current_time + timedelta(hours=24)
-
-    # Fetch tasks with deadlines approaching within the next 24 hours
-    tasks = Task.objects.filter(deadline__range=(current_time, reminder_time), status__in=['Not Started', 'In Progress'])
-
-    for task in tasks:
-        if task.assigned_to:
-            # Send email to the assignee
-            context = {
-                'user': task.assigned_to,
-                'ticket': task,
-                'view_ticket_url': f"http://127.0.0.1:8000/tasks/detail/{task.task_id}/",
-            }
-            email_body = render_to_string('emails/deadline_reminder.html', context)
-            send_mail(
-                subject=f"Reminder: Task Deadline Approaching ({task.task_id})",
-                message='',  # Plain text (empty as we are using HTML)
-                from_email='no-reply@yourdomain.com',
-                recipient_list=[task.assigned_to.email],
-                html_message=email_body,
-            )
+from .models import ActivityLog, DepartmentMetricsSnapshot, NotificationLedger, PendingNotification, Task
+from .events import publish_status_moves
+from .notifications import digest_recipients, event_url
+from .outbox import DEFAULT_FROM_EMAIL, send_in_parallel
+
+TICKET_URL = "http://127.0.0.1:8000/tasks/detail/{task_id}/"
+REMINDER_STATUSES = ['Not Started', 'In Progress']
+OVERDUE = 'Overdue'
+CLOSED_STATUSES = ['Completed', 'Cancelled']
+
+JOB_BATCH_SIZE = 1000
+RENDER_WORKERS = 8
+SMTP_CONNECTIONS = 4
+
+# Only what the email templates read, so rendering never goes back to the database
+USER_FIELDS = ('email', 'first_name', 'last_name')
+JOB_FIELDS = ('task_id', 'subject', 'deadline') + tuple(
+    f'{relation}__{field}' for relation in ('assigned_to', 'assigned_by') for field in USER_FIELDS
+)
+
+# One email about ``task_pk`` to render and send
+MailJob = namedtuple('MailJob', 'task_pk address subject template_name context')
+JobReport = namedtuple('JobReport', 'tasks emails failed seconds')
+SweepReport = namedtuple('SweepReport', 'overdue reopened seconds')
+
+
+def _unsent_tasks(kind, period, **filters):
+    """Tasks matching ``filters`` with no ``kind`` ledger row for ``period``."""
+    already_sent = NotificationLedger.objects.filter(task=OuterRef('pk'), kind=kind, period=period)
+    return (
+        Task.objects.filter(**filters)
+        .exclude(Exists(already_sent))
+        .select_related('assigned_to', 'assigned_by')
+        .only(*JOB_FIELDS)
+        .order_by('pk')
+    )
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def _recipients(*users):
+    """The users with an address, each address once."""
+    seen = set()
+    for user in users:
+        address = (getattr(user, 'email', '') or '').strip().lower()
+        if address and address not in seen:
+            seen.add(address)
+            yield address, user
+
+
+def deadline_reminder_jobs(task):
+    """A reminder for the assignee and the assignor; one if they are the same person."""
+    for address, user in _recipients(task.assigned_to, task.assigned_by):
+        yield MailJob(task.pk, address, f"Reminder: Task Deadline Approaching ({task.task_id})", 'emails/deadline_reminder.html', {
+            'user': user,
+            'ticket': task,
+            'view_ticket_url': TICKET_URL.format(task_id=task.task_id),
+        })
 
-        if task.assigned_by:
-            # Send email to the assignor
-            context = {
-                'user': task.assigned_by,
-                'ticket': task,
-                'view_ticket_url': f"http://127.0.0.1:8000/tasks/detail/{task.task_id}/",
-            }
-            email_body = render_to_string('emails/deadline_reminder.html', context)
-            send_mail(
-                subject=f"Reminder: Task Deadline Approaching ({task.task_id})",
-                message='',  # Plain text (empty as we are using HTML)
-                from_email='no-reply@yourdomain.com',
-                recipient_list=[task.assigned_by.email],
-                html_message=email_body,
+
+def overdue_notification_jobs(task):
+    for address, user in _recipients(task.assigned_by):
+        yield MailJob(task.pk, address, f"Overdue Task: {task.task_id}", 'emails/overdue_notification.html', {
+            'manager': user,
+            'ticket': task,
+            'view_ticket_url': TICKET_URL.format(task_id=task.task_id),
+        })
+
+
+def _render(job):
+    message = EmailMultiAlternatives(subject=job.subject, body='', from_email=DEFAULT_FROM_EMAIL, to=[job.address])
+    message.attach_alternative(render_to_string(job.template_name, job.context), 'text/html')
+    return message
+
+
+def run_mail_job(tasks, build_jobs, ledger_kind, period_of, batch_size=JOB_BATCH_SIZE,
+                 render_workers=RENDER_WORKERS, connections=SMTP_CONNECTIONS):
+    """
+    Email every task of ``tasks`` in batches of ``batch_size``: ``build_jobs``
+    turns a task into MailJobs, which are rendered on ``render_workers``
+    threads and sent over at most ``connections`` reused SMTP connections.
+    Jobs are grouped per recipient so one recipient's emails share a connection;
+    recipients on a digest get a PendingNotification instead.
+
+    Tasks whose emails all went out get a ``ledger_kind`` NotificationLedger
+    row for ``period_of(task)``; the others are tried again on the next run.
+    """
+    started = time.monotonic()
+    task_count = emails = failed = 0
+    with ThreadPoolExecutor(max_workers=render_workers) as render_pool:
+        for batch in _batches(tasks.iterator(chunk_size=batch_size), batch_size):
+            task_count += len(batch)
+            jobs = [job for task in batch for job in build_jobs(task)]
+            digest = digest_recipients(job.address for job in jobs)
+            PendingNotification.objects.bulk_create(
+                PendingNotification(user_id=digest[job.address], subject=job.subject, url=event_url(job.context))
+                for job in jobs if job.address in digest
+            )
+            jobs = sorted((job for job in jobs if job.address not in digest), key=lambda job: job.address)
+            errors = send_in_parallel(list(render_pool.map(_render, jobs)), connections) if jobs else []
+            emails += len(jobs)
+            unsent = {job.task_pk for job, error in zip(jobs, errors) if error is not None}
+            failed += sum(1 for error in errors if error is not None)
+            NotificationLedger.objects.bulk_create(
+                [NotificationLedger(task=task, kind=ledger_kind, period=period_of(task))
+                 for task in batch if task.pk not in unsent],
+                ignore_conflicts=True,
             )
+    return JobReport(task_count, emails - failed, failed, time.monotonic() - started)
 
-def notify_overdue_tasks_logic():
-    # Fetch overdue tasks
-    overdue_tasks = Task.objects.filter(deadline__lt=now(), status__in=['Not Started', 'In Progress'])
-
-    for task in overdue_tasks:
-        if task.assigned_by.email:  # Check if the creator has an email
-            # Prepare email context
-            context = {
-                'task': task,
-            }
-            email_body = render_to_string('emails/overdue_notification.html', context)
-            send_mail(
-                f"Overdue Task: {task.task_id}",
-                '',  # Empty plain text body
-                'no-reply@yourdomain.com',
-                [task.assigned_by.email],
-                html_message=email_body,
+
+def send_deadline_reminders_logic(today=None, **options):
+    """Remind assignees and assignors of open tasks due today or tomorrow."""
+    today = today or date.today()
+    tasks = _unsent_tasks(
+        NotificationLedger.DEADLINE_REMINDER, OuterRef('deadline'),
+        deadline__range=(today, today + timedelta(days=1)), status__in=REMINDER_STATUSES,
+    )
+    # One reminder per deadline
+    return run_mail_job(
+        tasks, deadline_reminder_jobs, NotificationLedger.DEADLINE_REMINDER, lambda task: task.deadline, **options
+    )
+
+
+def notify_overdue_tasks_logic(today=None, **options):
+    """Tell assignors about Overdue tasks, once a day."""
+    today = today or date.today()
+    tasks = _unsent_tasks(NotificationLedger.OVERDUE, today, status=OVERDUE)
+    return run_mail_job(tasks, overdue_notification_jobs, NotificationLedger.OVERDUE, lambda task: today, **options)
+
+
+def _move_status(tasks, status, reason, batch_size):
+    """
+    Set ``status`` on every task of ``tasks``, ``batch_size`` rows per UPDATE,
+    with one ActivityLog.bulk_create per batch. The UPDATE bypasses Task.save,
+    so the passed-deadline counters and live events are handled here.
+    Returns the rows moved.
+    """
+    counter_step = 1 if status == OVERDUE else -1
+    moved = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                tasks.select_for_update()
+                .values_list('pk', 'status', 'department_id', 'assigned_by_id', 'assigned_to_id', 'task_id', 'deadline')
+                .order_by('pk')[:batch_size]
             )
+            if not rows:
+                return moved
+            Task.objects.filter(pk__in=[row[0] for row in rows]).update(status=status, version=F('version') + 1)
+            ActivityLog.objects.bulk_create([
+                ActivityLog(
+                    action='status_updated',
+                    user_id=assigned_by_id or assigned_to_id,
+                    task_id=pk,
+                    description=f"Status changed from '{old_status}' to '{status}' ({reason})",
+                )
+                for pk, old_status, _, assigned_by_id, assigned_to_id, _, _ in rows
+                if assigned_by_id or assigned_to_id
+            ])
+            per_department = Counter(department_id for _, _, department_id, _, _, _, _ in rows if department_id is not None)
+            for department_id, count in per_department.items():
+                DepartmentMetricsSnapshot.objects.filter(department_id=department_id).update(
+                    tickets_passed_revised_deadline=F('tickets_passed_revised_deadline') + counter_step * count,
+                )
+            publish_status_moves([(task_id, assigned_to_id, assigned_by_id, deadline)
+                                  for _, _, _, assigned_by_id, assigned_to_id, task_id, deadline in rows], status)
+        moved += len(rows)
+
+
+def sweep_overdue_statuses(today=None, batch_size=JOB_BATCH_SIZE):
+    """
+    Move open tasks whose revised completion date (or deadline, without one)
+    has passed to Overdue, and Overdue tasks given a later date back to
+    In Progress, so ``status`` can be queried directly.
+    """
+    today = today or date.today()
+    started = time.monotonic()
+    tasks = Task.objects.alias(effective_deadline=Coalesce('revised_completion_date', 'deadline'))
+    overdue = _move_status(
+        tasks.filter(effective_deadline__lt=today).exclude(status__in=[*CLOSED_STATUSES, OVERDUE]),
+        OVERDUE, 'deadline passed', batch_size,
+    )
+    reopened = _move_status(
+        tasks.filter(status=OVERDUE, effective_deadline__gte=today),
+        'In Progress', 'deadline moved', batch_size,
+    )
+    return SweepReport(overdue, reopened, time.monotonic() - started)
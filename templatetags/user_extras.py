@@ -1,20 +1,36 @@
+from asgiref.local import Local
 from django import template
-from django.contrib.auth.models import User
+from django.core.signals import request_started
+from django.dispatch import receiver
+
+from ..models import users_by_email
 
 register = template.Library()
 
+# Users looked up during the current request, by lowercased email
+_memo = Local()
+
+
+@receiver(request_started)
+def _forget_users(**kwargs):
+    _memo.users = {}
+
+
 @register.filter(name="get_user_by_email")
 def get_user_by_email(value, email_arg=None):
     """
     Usage (both work):
       {{ email|get_user_by_email }}              -> value is the email string
       {{ users|get_user_by_email:email }}        -> ignores 'users', uses email arg
-    Returns a User instance or None.
+    Returns a User instance or None. Each email is looked up once per request;
+    pages listing many emails should resolve them with models.users_by_email.
     """
     email = (email_arg or value or "").strip().lower()
     if not email:
         return None
-    try:
-        return User.objects.get(email__iexact=email)
-    except User.DoesNotExist:
-        return None
+    users = getattr(_memo, 'users', None)
+    if users is None:
+        users = _memo.users = {}
+    if email not in users:
+        users[email] = users_by_email([email]).get(email)
+    return users[email]
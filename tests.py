@@ -1,3 +1,746 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import re
+import shutil
+import tempfile
+import uuid
+from collections import defaultdict, deque
+from datetime import date, datetime, time, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.models import Q
+from django.http import JsonResponse, QueryDict
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import events, task_ids
+from .chat import mark_read, unread_counts
+from .counters import reconcile_department_metrics
+from .listing import filter_tasks, parse_task_filters, task_list_queryset
+from .metrics import OPEN_STATUSES, SNAPSHOT_FIELDS, aggregate_open_counters, compute_department_metrics
+from .models import (
+    ActivityLog, ChatReadCursor, Department, DepartmentMetricsSnapshot, EmailOutbox, JobLease, NotificationLedger,
+    RecurrenceRule, StaleTaskError, Task, TaskChat, TaskIdSequence, UserProfile,
+)
+from .outbox import claim_batch
+from .recurrence import materialize_recurrences
+from .scheduler import Job, acquire_lease, release_lease, run_due_jobs
+from .signals import task_changed
+from .tasks import send_deadline_reminders_logic, sweep_overdue_statuses
+
+
+class DepartmentCounterTests(TestCase):
+    """The materialized department counters match a fresh count of the Task table."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tech = Department.objects.create(name='Tech')
+        cls.ops = Department.objects.create(name='Ops')
+        cls.creator = User.objects.create_user('creator', 'creator@example.com', 'pw')
+        cls.assignee = User.objects.create_user('assignee', 'assignee@example.com', 'pw')
+        UserProfile.objects.create(user=cls.creator, category='Employee', department=cls.tech)
+        UserProfile.objects.create(user=cls.assignee, category='Employee', department=cls.ops)
+
+    def setUp(self):
+        reconcile_department_metrics()
+
+    def create_task(self, **fields):
+        return Task.objects.create(**{
+            'department': self.ops,
+            'assigned_by': self.creator,
+            'assigned_to': self.assignee,
+            'assigned_date': timezone.now(),
+            'deadline': date.today() + timedelta(days=3),
+            'ticket_type': 'Issues',
+            'priority': 'medium',
+            'subject': 'Task',
+            **fields,
+        })
+
+    def assertSnapshotsMatchTasks(self):
+        counted = aggregate_open_counters()
+        for snapshot in DepartmentMetricsSnapshot.objects.all():
+            for field in SNAPSHOT_FIELDS:
+                expected = counted.get(snapshot.department_id, {}).get(field, 0)
+                self.assertEqual(getattr(snapshot, field), expected, f'{snapshot.department.name} {field}')
+
+    def snapshot(self, department):
+        return DepartmentMetricsSnapshot.objects.get(department=department)
+
+    def test_task_writes_keep_snapshots_current(self):
+        first = self.create_task()
+        second = self.create_task()
+        self.assertSnapshotsMatchTasks()
+        self.assertEqual(self.snapshot(self.ops).open_tickets_received, 2)
+        self.assertEqual(self.snapshot(self.tech).open_tickets_raised, 2)
+
+        first.department = self.tech
+        first.save()
+        self.assertSnapshotsMatchTasks()
+        self.assertEqual(self.snapshot(self.tech).open_tickets_received, 1)
+
+        second.status = 'Completed'
+        second.save()
+        self.assertSnapshotsMatchTasks()
+
+        first.delete()
+        self.assertSnapshotsMatchTasks()
+        self.assertEqual(self.snapshot(self.tech).open_tickets_raised, 0)
+
+    def test_overdue_sweep_keeps_snapshots_current(self):
+        self.create_task(deadline=date.today() - timedelta(days=1))
+        self.assertEqual(sweep_overdue_statuses().overdue, 1)
+        self.assertSnapshotsMatchTasks()
+        self.assertEqual(self.snapshot(self.ops).tickets_passed_revised_deadline, 1)
+
+    def test_passed_72_hours_is_counted_live(self):
+        self.create_task(assigned_date=timezone.now() - timedelta(hours=73))
+        [row] = compute_department_metrics(self.ops, materialized=True)
+        self.assertEqual(row['tickets_passed_72_hours'], 1)
+
+    def test_missing_snapshot_is_counted_from_tasks(self):
+        self.create_task()
+        DepartmentMetricsSnapshot.objects.filter(department=self.ops).delete()
+        self.create_task()
+        self.assertEqual(self.snapshot(self.ops).open_tickets_received, 2)
+        self.assertSnapshotsMatchTasks()
+
+
+class TaskListQueryCountTests(TestCase):
+    """The task list pages must not issue queries per rendered row."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tech = Department.objects.create(name='Tech')
+        cls.ops = Department.objects.create(name='Ops')
+        cls.manager = User.objects.create_user('manager', 'manager@example.com', 'pw', first_name='Mia')
+        cls.member = User.objects.create_user('member', 'member@example.com', 'pw', first_name='Max')
+        UserProfile.objects.create(user=cls.manager, category='Departmental Manager', department=cls.tech)
+        UserProfile.objects.create(user=cls.member, category='Employee', department=cls.ops)
+
+    def create_tasks(self, count):
+        for i in range(count):
+            # Alternate directions so both lists of each user grow
+            assigned_by, assigned_to = (self.manager, self.member) if i % 2 else (self.member, self.manager)
+            Task.objects.create(
+                department=self.tech if i % 2 else self.ops,
+                assigned_by=assigned_by,
+                assigned_to=assigned_to,
+                # The lists only show tasks assigned up to today
+                assigned_date=timezone.now() - timedelta(days=1),
+                deadline=date.today() + timedelta(days=3),
+                ticket_type='Issues',
+                priority='medium',
+                subject=f'Task {i}',
+                request_details='x' * 1000,
+            )
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assertConstantQueries(self, url):
+        self.client.force_login(self.manager)
+        self.create_tasks(2)
+        # Warm the profile cache so both counts see the same steady state
+        self.count_queries(url)
+        few = self.count_queries(url)
+        self.create_tasks(20)
+        many = self.count_queries(url)
+        self.assertEqual(few, many)
+
+    def test_home(self):
+        self.assertConstantQueries(reverse('home'))
+
+    def test_assigned_to_me(self):
+        self.assertConstantQueries(reverse('assigned_to_me'))
+
+    def test_assigned_by_me(self):
+        self.assertConstantQueries(reverse('assigned_by_me'))
+
+
+class QueryPlanTests(TestCase):
+    """
+    EXPLAIN the queries behind the hot views and fail when one of them reads
+    a whole table instead of going through an index.
+    """
+
+    # Full table scans, per backend. SQLite's "SCAN t USING INDEX i" walks an
+    # index in order and is fine; a bare "SCAN t" is not.
+    TABLE_SCANS = {
+        'sqlite': re.compile(r'\bSCAN (\w+)\b(?! USING)'),
+        'postgresql': re.compile(r'Seq Scan on (\w+)'),
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.department = Department.objects.create(name='Tech')
+        cls.user = User.objects.create_user('planner', 'planner@example.com', 'pw')
+        UserProfile.objects.create(user=cls.user, category='Departmental Manager', department=cls.department)
+
+    def setUp(self):
+        if connection.vendor not in self.TABLE_SCANS:
+            self.skipTest(f'No query plan check for {connection.vendor}')
+        if connection.vendor == 'postgresql':
+            # Tiny test tables are cheapest to scan; make the planner show its index choice
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertNoTableScan(self, queryset):
+        plan = queryset.explain()
+        scans = self.TABLE_SCANS[connection.vendor].findall(plan)
+        self.assertFalse(scans, f'Table scan on {", ".join(scans)}:\n{plan}')
+
+    def list_page(self, tasks):
+        filters = parse_task_filters(QueryDict(''))
+        return filter_tasks(tasks, filters).order_by('-assigned_date', '-pk')[:51]
+
+    def test_assigned_to_me(self):
+        tasks = task_list_queryset().filter(assigned_to=self.user, assigned_date__lte=date.today())
+        self.assertNoTableScan(self.list_page(tasks))
+
+    def test_assigned_by_me(self):
+        tasks = task_list_queryset().filter(assigned_by=self.user, assigned_date__lte=date.today())
+        self.assertNoTableScan(self.list_page(tasks))
+
+    def test_home(self):
+        tasks = task_list_queryset().filter(
+            Q(assignor_department=self.department) |
+            Q(assigned_to__userprofile__department=self.department) |
+            Q(department__name=self.department),
+            assigned_date__lte=date.today(),
+        )
+        self.assertNoTableScan(self.list_page(tasks))
+
+    def test_department_open_tasks(self):
+        self.assertNoTableScan(Task.objects.filter(department=self.department, status__in=OPEN_STATUSES))
+
+    def test_deadline_reminders(self):
+        today = date.today()
+        self.assertNoTableScan(Task.objects.filter(
+            deadline__range=(today, today + timedelta(days=1)), status__in=['Not Started', 'In Progress']
+        ))
+
+    def test_overdue_tasks(self):
+        self.assertNoTableScan(Task.objects.filter(status='Overdue'))
+
+    def test_activity_log(self):
+        self.assertNoTableScan(ActivityLog.objects.order_by('-timestamp')[:100])
+
+    def test_task_chat(self):
+        self.assertNoTableScan(TaskChat.objects.filter(task_id=1).order_by('timestamp'))
+
+
+class OutboxClaimTests(TestCase):
+    """Workers draining the outbox at the same time never claim the same row."""
+
+    def setUp(self):
+        for i in range(5):
+            EmailOutbox.objects.create(
+                subject=f'Email {i}',
+                from_email='tasks@example.com',
+                to=[f'user{i}@example.com'],
+                html_body='<p>x</p>',
+            )
+
+    def test_claimed_rows_are_not_claimed_again(self):
+        first = claim_batch(3)
+        second = claim_batch(10)
+        self.assertEqual(len(first), 3)
+        self.assertEqual(len(second), 2)
+        self.assertFalse({row.pk for row in first} & {row.pk for row in second})
+        self.assertEqual(claim_batch(10), [])
+
+    def test_interleaved_claims_share_no_row(self):
+        # Worker B claims everything between worker A's SELECT and its UPDATE
+        new_token = uuid.uuid4
+        claims = {}
+
+        def token():
+            if 'other' not in claims:
+                claims['other'] = None  # B's own token call must not recurse
+                claims['other'] = claim_batch(10)
+            return new_token()
+
+        with mock.patch('task_app.outbox.uuid.uuid4', side_effect=token):
+            claimed = claim_batch(10)
+        self.assertEqual(len(claims['other']), 5)
+        self.assertEqual(claimed, [])
+
+    def test_stale_claims_are_handed_out_again(self):
+        claimed = claim_batch(10)
+        later = timezone.now() + timedelta(hours=1)
+        reclaimed = claim_batch(10, now=later)
+        self.assertEqual({row.pk for row in reclaimed}, {row.pk for row in claimed})
+        self.assertTrue(all(row.status == EmailOutbox.SENDING for row in reclaimed))
+
+
+class SchedulerTests(TestCase):
+    """Each periodic job runs on one node per interval, and each reminder goes out once."""
+
+    def test_one_node_holds_a_lease(self):
+        now = timezone.now()
+        self.assertTrue(acquire_lease('job', 'node-a', timedelta(hours=1), now))
+        self.assertFalse(acquire_lease('job', 'node-b', timedelta(hours=1), now))
+        self.assertFalse(acquire_lease('job', 'node-a', timedelta(hours=1), now + timedelta(minutes=59)))
+        self.assertTrue(acquire_lease('job', 'node-b', timedelta(hours=1), now + timedelta(hours=1)))
+        self.assertEqual(JobLease.objects.get(name='job').holder, 'node-b')
+
+    def test_released_lease_is_free_at_once(self):
+        now = timezone.now()
+        acquire_lease('job', 'node-a', timedelta(hours=1), now)
+        release_lease('job', 'node-b', now)  # Not the holder: no effect
+        self.assertFalse(acquire_lease('job', 'node-b', timedelta(hours=1), now))
+        release_lease('job', 'node-a', now)
+        self.assertTrue(acquire_lease('job', 'node-b', timedelta(hours=1), now))
+
+    def test_jobs_run_once_per_interval(self):
+        calls = []
+        jobs = [Job('counted', timedelta(hours=1), lambda: calls.append(1) or len(calls))]
+        self.assertEqual(run_due_jobs('node-a', jobs), {'counted': 1})
+        self.assertEqual(run_due_jobs('node-b', jobs), {})
+        self.assertEqual(len(calls), 1)
+
+    def test_running_job_keeps_its_lease_past_the_interval(self):
+        taken = []
+
+        def slow():
+            # Another node looks in a whole interval later, while this run is still going
+            later = timezone.now() + timedelta(minutes=20)
+            taken.append(acquire_lease('slow', 'node-b', timedelta(minutes=15), later))
+
+        jobs = [Job('slow', timedelta(minutes=15), slow, timeout=timedelta(hours=1))]
+        run_due_jobs('node-a', jobs)
+        self.assertEqual(taken, [False])
+        # Once finished, the job is due again one interval after it started
+        later = timezone.now() + timedelta(minutes=15)
+        self.assertTrue(acquire_lease('slow', 'node-b', timedelta(minutes=15), later))
+
+    def test_failed_job_can_run_again(self):
+        def fail():
+            raise RuntimeError('job failed')
+
+        jobs = [Job('failing', timedelta(hours=1), fail)]
+        with self.assertLogs('task_app.scheduler', 'ERROR'):
+            self.assertEqual(run_due_jobs('node-a', jobs), {})
+        self.assertTrue(acquire_lease('failing', 'node-b', timedelta(hours=1)))
+
+    def test_reminders_are_sent_once(self):
+        department = Department.objects.create(name='Tech')
+        creator = User.objects.create_user('creator', 'creator@example.com', 'pw')
+        assignee = User.objects.create_user('assignee', 'assignee@example.com', 'pw')
+        task = Task.objects.create(
+            department=department,
+            assigned_by=creator,
+            assigned_to=assignee,
+            assigned_date=timezone.now(),
+            deadline=date.today() + timedelta(days=1),
+            ticket_type='Issues',
+            priority='medium',
+            subject='Due soon',
+        )
+        report = send_deadline_reminders_logic()
+        self.assertEqual((report.tasks, report.emails), (1, 2))
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertTrue(NotificationLedger.objects.filter(
+            task=task, kind=NotificationLedger.DEADLINE_REMINDER, period=task.deadline,
+        ).exists())
+
+        report = send_deadline_reminders_logic()
+        self.assertEqual(report.tasks, 0)
+        self.assertEqual(len(mail.outbox), 2)
+
+
+def create_task(**fields):
+    department = Department.objects.create(name='Tech')
+    creator = User.objects.create_user('creator', 'creator@example.com', 'pw')
+    assignee = User.objects.create_user('assignee', 'assignee@example.com', 'pw')
+    UserProfile.objects.create(user=creator, category='Employee', department=department)
+    UserProfile.objects.create(user=assignee, category='Employee', department=department)
+    return Task.objects.create(**{
+        'department': department,
+        'assigned_by': creator,
+        'assigned_to': assignee,
+        'assigned_date': timezone.now(),
+        'deadline': date.today() + timedelta(days=3),
+        'ticket_type': 'Issues',
+        'priority': 'medium',
+        'subject': 'Task',
+        **fields,
+    })
+
+
+class RecurrenceTests(TestCase):
+    """Recurring tasks are materialized from their rule exactly once per occurrence."""
+
+    def setUp(self):
+        self.task = create_task(
+            is_recurring=True, recurrence_type='daily', recurrence_count=30, recurrence_duration=1,
+        )
+
+    def test_rerun_creates_nothing(self):
+        self.assertEqual(materialize_recurrences().created, 14)
+        self.assertEqual(materialize_recurrences().created, 0)
+        self.assertEqual(Task.objects.filter(recurrence_rule=self.task.recurrence).count(), 14)
+
+    def test_editing_the_template_creates_no_occurrences(self):
+        materialize_recurrences()
+        self.task.subject = 'Edited'
+        self.task.save()
+        self.assertEqual(Task.objects.count(), 15)
+        self.assertEqual(materialize_recurrences().created, 0)
+
+    def test_raising_the_count_extends_the_series(self):
+        self.task.recurrence_count = 40
+        self.task.save()
+        report = materialize_recurrences(today=date.today() + timedelta(days=100))
+        self.assertEqual(report.created, 40)
+        self.assertFalse(RecurrenceRule.objects.get(task=self.task).active)
+
+    def test_turning_recurrence_off_stops_the_rule(self):
+        self.task.is_recurring = False
+        self.task.save()
+        self.assertFalse(RecurrenceRule.objects.get(task=self.task).active)
+        self.assertEqual(materialize_recurrences().created, 0)
+
+    def test_schedule_change_fills_in_the_new_dates(self):
+        self.task.recurrence_type = 'weekly'
+        self.task.save()
+        self.assertEqual(materialize_recurrences().created, 2)
+        self.task.recurrence_type = 'daily'
+        self.task.save()
+        self.assertIsNone(RecurrenceRule.objects.get(task=self.task).materialized_through)
+        # Days 7 and 14 exist already from the weekly schedule
+        self.assertEqual(materialize_recurrences().created, 12)
+
+
+class TaskIdAllocatorTests(TestCase):
+    """Allocated task IDs never repeat, across blocks and across processes."""
+
+    def setUp(self):
+        # Each test starts like a fresh process, with blocks of three
+        patches = [mock.patch.object(task_ids, '_reserved', defaultdict(deque)),
+                   mock.patch.object(task_ids, 'BLOCK_SIZE', 3)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_ids_are_unique_across_blocks(self):
+        ids = []
+        for count in [1] * 7 + [5]:
+            # Leftovers of a block are pooled once the reserving transaction commits
+            with self.captureOnCommitCallbacks(execute=True):
+                ids += task_ids.allocate_task_ids('TST', count)
+        self.assertEqual(len(set(ids)), 12)
+        self.assertTrue(all(task_id.startswith('TST-') for task_id in ids))
+        # Four blocks of three, all used
+        self.assertEqual(TaskIdSequence.objects.get(prefix='TST').next_value, 12)
+
+    def test_processes_get_separate_blocks(self):
+        first = task_ids.allocate_task_ids('TST', 1)
+        # Another process has its own pool of reserved IDs
+        with mock.patch.object(task_ids, '_reserved', defaultdict(deque)):
+            other = task_ids.allocate_task_ids('TST', 2)
+        rest = task_ids.allocate_task_ids('TST', 2)
+        self.assertEqual(len(set(first + other + rest)), 5)
+
+    def test_ids_already_in_use_are_skipped(self):
+        department = Department.objects.create(name='Tst')
+        user = User.objects.create_user('creator', 'creator@example.com', 'pw')
+        taken = f'TST-{task_ids.encode(1)}'
+        Task.objects.create(
+            task_id=taken,
+            department=department,
+            assigned_by=user,
+            assigned_to=user,
+            assigned_date=timezone.now(),
+            deadline=date.today(),
+            ticket_type='Issues',
+            priority='medium',
+            subject='Older random ID',
+        )
+        ids = task_ids.allocate_task_ids('TST', 4)
+        self.assertEqual(len(set(ids)), 4)
+        self.assertNotIn(taken, ids)
+
+
+class TaskSaveTests(TestCase):
+    """Task.save writes only what changed, and says what changed."""
+
+    def setUp(self):
+        self.task = Task.objects.get(pk=create_task().pk)
+        self.changes = []
+
+        def record(sender, instance, created, changes, **kwargs):
+            self.changes.append(changes)
+
+        task_changed.connect(record, weak=False, dispatch_uid='task_save_tests')
+        self.addCleanup(task_changed.disconnect, dispatch_uid='task_save_tests')
+
+    def test_only_changed_columns_are_written(self):
+        self.task.priority = 'high'
+        with CaptureQueriesContext(connection) as queries:
+            self.task.save()
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "task_app_task"')]
+        self.assertEqual(len(updates), 1)
+        set_clause = updates[0].split(' WHERE ')[0]
+        self.assertIn('"priority"', set_clause)
+        self.assertIn('"version"', set_clause)
+        self.assertNotIn('"subject"', set_clause)
+        self.assertNotIn('"status"', set_clause)
+
+    def test_changes_are_sent_and_version_bumped(self):
+        version = self.task.version
+        self.task.priority = 'high'
+        self.task.save()
+        self.assertEqual(self.changes, [{'priority': ('medium', 'high'), 'version': (version, version + 1)}])
+        self.assertEqual(Task.objects.get(pk=self.task.pk).version, version + 1)
+
+    def test_unchanged_task_is_not_written(self):
+        with self.assertNumQueries(0):
+            self.task.save()
+        self.assertEqual(self.changes, [])
+
+
+class TaskVersionTests(TestCase):
+    """A write based on an outdated read of a task is refused, not applied."""
+
+    def setUp(self):
+        self.task = create_task()
+
+    def test_stale_save_raises(self):
+        mine = Task.objects.get(pk=self.task.pk)
+        theirs = Task.objects.get(pk=self.task.pk)
+        theirs.priority = 'high'
+        theirs.save()
+        mine.subject = 'Mine'
+        with self.assertRaises(StaleTaskError):
+            mine.save()
+        current = Task.objects.get(pk=self.task.pk)
+        self.assertEqual((current.priority, current.subject, current.version), ('high', 'Task', 2))
+        self.assertEqual(mine.version, 1)
+
+    def test_api_answers_409_for_a_stale_version(self):
+        theirs = Task.objects.get(pk=self.task.pk)
+        theirs.priority = 'high'
+        theirs.save()
+        url = reverse('api_update_task_status_only', args=[self.task.task_id, 'assignee@example.com', 'In-Progress'])
+        response = self.client.get(url, {'version': 1})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['current_version'], 2)
+        self.assertEqual(Task.objects.get(pk=self.task.pk).status, 'Not Started')
+
+        response = self.client.get(url, {'version': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['version'], 3)
+
+    def test_stale_note_keeps_the_note_and_stores_no_file(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        theirs = Task.objects.get(pk=self.task.pk)
+        theirs.priority = 'high'
+        theirs.save()
+        self.client.force_login(self.task.assigned_to)
+        with override_settings(MEDIA_ROOT=media_root):
+            response = self.client.post(reverse('task_note_page', args=[self.task.task_id]), {
+                'note': 'My note',
+                'version': 1,
+                'attachment_by_assignee': SimpleUploadedFile('report.txt', b'report'),
+            })
+        self.assertEqual(response.status_code, 409)
+        self.assertContains(response, 'My note', status_code=409)
+        self.assertEqual([files for _, _, files in os.walk(media_root) if files], [])
+        self.assertFalse(Task.objects.get(pk=self.task.pk).attachment_by_assignee)
+
+
+class ActivityExportTests(TestCase):
+    """The activity export's date filters cover whole days in the current time zone."""
+
+    def test_since_and_until_include_whole_days(self):
+        task = create_task()
+        start = timezone.make_aware(datetime.combine(date(2026, 3, 10), time.min))
+        for description, timestamp in [
+            ('Before range', start - timedelta(seconds=1)),
+            ('Start of range', start),
+            ('End of range', start + timedelta(days=2, seconds=-1)),
+            ('After range', start + timedelta(days=2)),
+        ]:
+            log = ActivityLog.objects.create(action='created', user=task.assigned_by, task=task, description=description)
+            ActivityLog.objects.filter(pk=log.pk).update(timestamp=timestamp)
+
+        self.client.force_login(task.assigned_by)
+        response = self.client.get(reverse('download_activity_log'), {'since': '2026-03-10', 'until': '2026-03-11'})
+        body = b''.join(response.streaming_content).decode()
+        self.assertIn('Start of range', body)
+        self.assertIn('End of range', body)
+        self.assertNotIn('Before range', body)
+        self.assertNotIn('After range', body)
+
+
+class EventStreamTests(TestCase):
+    """Live events reach a client by replay from its last id, over ASGI streams and WSGI polls alike."""
+
+    def setUp(self):
+        self.task = create_task()
+        self.channels = [events.task_channel(self.task.task_id)]
+
+    def publish(self, *messages):
+        with self.captureOnCommitCallbacks(execute=True):
+            events.publish([(self.channels[0], 'task', data) for data in messages])
+
+    def test_replay_starts_after_the_given_id(self):
+        self.publish({'n': 1}, {'n': 2}, {'n': 3})
+        backend = events.get_backend()
+        self.assertIsInstance(backend, events.DatabaseBackend)
+        first, *rest = backend.replay(self.channels, 0)
+        self.assertEqual([event.data for event in rest], [{'n': 2}, {'n': 3}])
+        self.assertEqual([event.data for event in backend.replay(self.channels, first.id)], [{'n': 2}, {'n': 3}])
+        self.assertEqual(backend.latest_id(), rest[-1].id)
+
+    def test_task_change_names_fields_without_their_values(self):
+        self.task.notes = 'Private note'
+        self.task.priority = 'high'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.task.save()
+        [event] = events.get_backend().replay(self.channels, 0)
+        self.assertEqual(event.data, {
+            'task_id': self.task.task_id,
+            'version': self.task.version,
+            'created': False,
+            'changes': ['notes', 'priority', 'version'],
+            'status': 'Not Started',
+            'deadline': self.task.deadline.isoformat(),
+        })
+
+    def test_wsgi_poll_returns_the_events_since_the_last_id(self):
+        self.client.force_login(self.task.assigned_to)
+        url = reverse('task_events', args=[self.task.task_id])
+        body = self.client.get(url).content.decode()
+        self.assertIn('retry: 5000', body)
+        last_id = re.search(r'^id: (\d+)$', body, re.M).group(1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            TaskChat.objects.create(task=self.task, sender=self.task.assigned_by, message='Hello')
+        body = self.client.get(url, HTTP_LAST_EVENT_ID=last_id).content.decode()
+        self.assertIn('event: chat', body)
+        self.assertIn('Hello', body)
+
+    @override_settings(TASK_EVENTS_BACKEND='task_app.events.LocalBackend')
+    def test_asgi_stream_replays_then_streams(self):
+        self.publish({'n': 1}, {'n': 2})
+        first_id = events.get_backend().replay(self.channels, 0)[0].id
+        request = AsyncRequestFactory().get('/', headers={'Last-Event-ID': str(first_id)})
+        response = events.event_stream(request, self.channels, seconds=0.5)
+        self.assertTrue(response.is_async)
+
+        async def read():
+            chunks = []
+            async for chunk in response.streaming_content:
+                chunks.append(chunk.decode())
+                if len(chunks) == 1:
+                    # Subscribed by now, so it arrives once even if the replay sees it too
+                    events.get_backend().publish([(self.channels[0], 'task', {'n': 3})])
+            return chunks
+
+        data = [json.loads(line[6:]) for chunk in asyncio.run(read()) for line in chunk.splitlines()
+                if line.startswith('data: ')]
+        self.assertEqual(data, [{'n': 2}, {'n': 3}])
+        self.assertFalse(events.hub.has_subscribers())
+
+
+class ChatReadTests(TestCase):
+    """Unread chat counts come from the read cursor and skip the user's own messages."""
+
+    def setUp(self):
+        self.task = create_task()
+        self.assignor = self.task.assigned_by
+        self.assignee = self.task.assigned_to
+        self.messages = [
+            TaskChat.objects.create(task=self.task, sender=self.assignor, message=f'Message {i}') for i in range(3)
+        ]
+        TaskChat.objects.create(task=self.task, sender=self.assignee, message='Reply')
+
+    def test_own_messages_are_not_unread(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(unread_counts(self.assignee), {self.task.pk: 3})
+        self.assertEqual(unread_counts(self.assignor), {self.task.pk: 1})
+
+    def test_mark_read_moves_the_count(self):
+        mark_read(self.assignee, self.task, self.messages[1].pk)
+        self.assertEqual(unread_counts(self.assignee), {self.task.pk: 1})
+        mark_read(self.assignee, self.task, self.messages[2].pk)
+        self.assertEqual(unread_counts(self.assignee), {})
+
+    def test_cursor_never_moves_back(self):
+        mark_read(self.assignee, self.task, self.messages[2].pk)
+        mark_read(self.assignee, self.task, self.messages[0].pk)
+        self.assertEqual(ChatReadCursor.objects.get(user=self.assignee, task=self.task).last_read_id, self.messages[2].pk)
+        self.assertEqual(unread_counts(self.assignee), {})
+
+    def test_read_view_stops_at_the_newest_message(self):
+        self.client.force_login(self.assignee)
+        url = reverse('mark_chat_read', args=[self.task.task_id])
+        response = self.client.post(url, {'last_read_id': 10 ** 9})
+        newest = TaskChat.objects.filter(task=self.task).latest('pk').pk
+        self.assertEqual(response.json()['last_read_id'], newest)
+        TaskChat.objects.create(task=self.task, sender=self.assignor, message='Later')
+        self.assertEqual(unread_counts(self.assignee), {self.task.pk: 1})
+
+
+class ApiTransactionTests(TestCase):
+    """The GET API views write the task and its side effects in one transaction."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.department = Department.objects.create(name='Tech')
+        cls.creator = User.objects.create_user('creator', 'creator@example.com', 'pw')
+        cls.assignee = User.objects.create_user('assignee', 'assignee@example.com', 'pw')
+        UserProfile.objects.create(user=cls.creator, category='Employee', department=cls.department)
+        UserProfile.objects.create(user=cls.assignee, category='Employee', department=cls.department)
+        cls.task = Task.objects.create(
+            department=cls.department,
+            assigned_by=cls.creator,
+            assigned_to=cls.assignee,
+            assigned_date=timezone.now(),
+            deadline=date.today() + timedelta(days=3),
+            ticket_type='Issues',
+            priority='medium',
+            subject='Task',
+        )
+
+    def update(self):
+        return self.client.get(reverse('api_update_task_status_only', args=[
+            self.task.task_id, self.assignee.email, 'In-Progress',
+        ]))
+
+    def test_failed_activity_log_keeps_the_update(self):
+        def broken_create(**kwargs):
+            # A real database error, which aborts the transaction on PostgreSQL
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT * FROM no_such_table')
+
+        with mock.patch.object(ActivityLog.objects, 'create', side_effect=broken_create):
+            response = self.update()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Task.objects.get(pk=self.task.pk).status, 'In Progress')
+
+    def test_unexpected_error_rolls_back(self):
+        def respond(data, **kwargs):
+            # Fail after the task was saved, while building the success response
+            if data.get('success'):
+                raise TypeError('not serializable')
+            return JsonResponse(data, **kwargs)
+
+        with mock.patch('task_app.views.JsonResponse', side_effect=respond):
+            response = self.update()
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(Task.objects.get(pk=self.task.pk).status, 'Not Started')
@@ -14,11 +14,16 @@ urlpatterns = [
     path('assigned_to_me/', views.assigned_to_me, name='assigned_to_me'),  # Tickets assigned to the user
     path('assigned_by_me/', views.assigned_by_me, name='assigned_by_me'),  # Tickets assigned by the user
     path('user_profile/', views.user_profile, name='user_profile'),        # User Profile page
+    path('profile/notification-settings/', views.notification_settings, name='notification_settings'),
     path('reassign/<str:task_id>/', views.reassign_task, name='reassign_task'),
     # Existing paths
     path('create/', views.create_task, name='create_task'),
     path('edit/<str:task_id>/', views.edit_task, name='edit_task'),
     path('detail/<str:task_id>/', views.task_detail, name='task_detail'),
+    path('detail/<str:task_id>/chat/', views.task_chat, name='task_chat'),
+    path('detail/<str:task_id>/chat/read/', views.mark_chat_read, name='mark_chat_read'),
+    path('detail/<str:task_id>/events/', views.task_events, name='task_events'),
+    path('events/', views.inbox_events, name='inbox_events'),
     path('update_status/<str:task_id>/', views.update_task_status, name='update_task_status'),
     path('accounts/logout/', auth_views.LogoutView.as_view(next_page='login'), name='logout'),
     path('accounts/login/', auth_views.LoginView.as_view(template_name='registration/login.html'), name='login'),
@@ -1,16 +1,25 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from .models import Task, UserProfile, Department, TaskChat
+from django.urls import reverse
+from .models import Task, UserProfile, Department, NotificationPreference, StaleTaskError, users_by_email
 from django.contrib.auth.decorators import login_required
-from .forms import TaskForm, TaskChatForm
+from .forms import TaskForm, TaskChatForm, NotificationPreferenceForm, STALE_TASK_MESSAGE
 from django.core.exceptions import PermissionDenied
 from django.contrib.auth.models import User
 from django.utils import timezone
+from django.db import transaction
 from django.db.models import Q,F
-from datetime import datetime, timedelta
+from datetime import datetime, time, timedelta
 from django.http import JsonResponse
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
 from .models import ActivityLog
+from .metrics import compute_department_metrics, summarize_metrics, parse_window, WINDOW_PRESETS
+from .listing import task_list_context, task_list_queryset
+from .notifications import NotificationEvent
+from .chat import chat_page, latest_message_id, mark_read, message_payload, parse_page_size
+from .events import event_stream, task_channel, user_channel
+from .profiles import get_profile
 import csv
+import zlib
 import pandas as pd
 from django.db.models import Count
 from .forms import TaskStatusUpdateForm
@@ -30,40 +39,35 @@ import json
 logger = logging.getLogger(__name__)
 
 def send_email_notification(subject, template_name, context, recipient_email, cc_emails=None):
-    """Utility function to send email notifications (with CC)."""
-    email_body = render_to_string(template_name, context)
-    msg = EmailMultiAlternatives(
-        subject=subject,
-        body='',
-        from_email='no-reply@yourdomain.com',
-        to=[recipient_email],
-        cc=list({e.strip().lower() for e in (cc_emails or [])}),
-    )
-    msg.attach_alternative(email_body, "text/html")
-    msg.send(fail_silently=False)
+    """Queue an email notification (with CC); drain_outbox delivers it."""
+    NotificationEvent(cc_emails).notify(recipient_email, subject, template_name, context).send()
 def _norm_emails(iterable):
     return sorted(list({(e or "").strip().lower() for e in (iterable or []) if (e or "").strip()}))
 
 @login_required
 def home(request):
-    user_profile = UserProfile.objects.get(user=request.user)
+    user_profile = get_profile(request)
     today = date.today()
     print(today)
     if user_profile.category == 'Departmental Manager':
         # Fetch all tasks related to the department of the manager
         department = user_profile.department
-        tasks = Task.objects.filter(
-            # Tasks created by members of the manager's department
-            Q(assigned_by__userprofile__department=department) |
+        tasks = task_list_queryset().filter(
+            # Tasks raised by members of the manager's department
+            Q(assignor_department=department) |
             # Tasks assigned to members of the manager's department
             Q(assigned_to__userprofile__department=department)|
             Q(department__name=department),
 
             assigned_date__lte=today
-        ).order_by('-assigned_date')
-        
+        )
+        try:
+            context = task_list_context(request, tasks, today)
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+
         return render(request, 'tasks/home.html', {
-            'tasks': tasks,
+            **context,
             'departments': Department.objects.all(),
             'users':User.objects.all(),
         })
@@ -74,14 +78,15 @@ def home(request):
 def assigned_to_me(request):
     today = date.today()
     # Filter tasks where the assigned_to field matches the current user
-    tasks = Task.objects.filter(assigned_to=request.user, assigned_date__lte=today).order_by('-assigned_date')
-
-    # Passing task category functional choices (department in this case) for filtering
-    functional_categories = Task.FUNCTIONAL_CATEGORIES  # Assuming Task.FUNCTIONAL_CATEGORIES holds department choices
+    tasks = task_list_queryset().filter(assigned_to=request.user, assigned_date__lte=today)
+    try:
+        context = task_list_context(request, tasks, today)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
 
-    # Render the template with the tasks and functional categories
+    # Render the template with one page of tasks and the filter choices
     return render(request, 'tasks/assigned_to_me.html', {
-        'tasks': tasks,
+        **context,
         'departments': Department.objects.all(),
         'users':User.objects.all(),
     })
@@ -89,16 +94,16 @@ def assigned_to_me(request):
 @login_required
 def assigned_by_me(request):
     today = date.today()
-    tasks = Task.objects.filter(assigned_by=request.user, assigned_date__lte=today).order_by('-assigned_date')
     # Fetch tasks where the logged-in user is the assigner
-    # tasks = Task.objects.filter(assigned_by=request.user)
-
-    # Passing task category functional choices (department in this case) for filtering
-    functional_categories = Task.FUNCTIONAL_CATEGORIES  # Assuming Task.FUNCTIONAL_CATEGORIES holds department choices
+    tasks = task_list_queryset().filter(assigned_by=request.user, assigned_date__lte=today)
+    try:
+        context = task_list_context(request, tasks, today)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
 
-    # Render the template with the tasks and functional categories
+    # Render the template with one page of tasks and the filter choices
     return render(request, 'tasks/assigned_by_me.html', {
-        'tasks': tasks,
+        **context,
         'departments': Department.objects.all(),
         'users':User.objects.all(),
     })
@@ -106,8 +111,25 @@ def assigned_by_me(request):
 @login_required
 def user_profile(request):
     # Display user profile details
-    user_profile = UserProfile.objects.get(user=request.user)
-    return render(request, 'tasks/user_profile.html', {'user_profile': user_profile})
+    user_profile = get_profile(request)
+    preference = NotificationPreference.objects.filter(user=request.user).first()
+    return render(request, 'tasks/user_profile.html', {
+        'user_profile': user_profile,
+        'notification_form': NotificationPreferenceForm(instance=preference),
+        'notification_saved': request.GET.get('saved') == '1',
+    })
+
+@login_required
+def notification_settings(request):
+    # Immediate emails or hourly/daily digests; the form lives on the profile page
+    if request.method == 'POST':
+        preference, _ = NotificationPreference.objects.get_or_create(user=request.user)
+        form = NotificationPreferenceForm(request.POST, instance=preference)
+        if form.is_valid():
+            form.save()
+            return redirect(reverse('user_profile') + '?saved=1#notification-settings')
+        return HttpResponseBadRequest("Invalid notification setting.")
+    return redirect(reverse('user_profile') + '#notification-settings')
 
 @login_required
 def view_system_logs(request):
@@ -124,10 +146,10 @@ def task_list(request):
     Display task list with filtering options for Task Management System Managers.
     For other users, display only tasks created by or assigned to them.
     """
-    user_profile = UserProfile.objects.get(user=request.user)
+    user_profile = get_profile(request)
 
     if user_profile.category == 'Task Management System Manager':
-        tasks = Task.objects.all()  # Start with all tasks
+        tasks = task_list_queryset()  # Start with all tasks
 
         # Apply filters if provided
         department_id = request.GET.get('department')
@@ -142,18 +164,14 @@ def task_list(request):
         if ageing_days:
             today = datetime.today().date()
             if ageing_days == 'overdue':
-                tasks = tasks.filter(deadline__lt=today, status__in=['Not Started', 'In Progress', 'Stalled', 'On-Hold'])
+                tasks = tasks.filter(status='Overdue')
             else:
                 ageing_days = int(ageing_days)
                 tasks = tasks.filter(assigned_date__lte=today - timedelta(days=ageing_days))
 
         status = request.GET.get('status')
         if status:
-            if status == 'Overdue':
-                today = date.today()
-                tasks = tasks.filter(deadline__lt=today, status__in=['Not Started', 'In Progress', 'Stalled', 'On-Hold'])
-            else:
-                tasks = tasks.filter(status=status)
+            tasks = tasks.filter(status=status)
 
         departments = Department.objects.all()
         users = UserProfile.objects.filter(user__is_active=True)
@@ -167,8 +185,8 @@ def task_list(request):
         })
 
     else:
-        created_tasks = Task.objects.filter(assigned_by=request.user)
-        assigned_tasks = Task.objects.filter(assigned_to=request.user)
+        created_tasks = task_list_queryset().filter(assigned_by=request.user)
+        assigned_tasks = task_list_queryset().filter(assigned_to=request.user)
         return render(request, 'tasks/task_list.html', {
             'created_tasks': created_tasks,
             'assigned_tasks': assigned_tasks,
@@ -176,6 +194,7 @@ def task_list(request):
 
 
 @login_required
+@transaction.atomic
 def create_task(request):
     if request.method == 'POST':
         form = TaskForm(request.POST, request.FILES, user=request.user)
@@ -186,54 +205,24 @@ def create_task(request):
             task.save()
             form.save_m2m()
 
-            # Notify the departmental manager (if exists)
-            if task.department and hasattr(task.department, 'manager') and task.department.manager:
-                manager_email = task.department.manager.email  # Ensure the manager's email exists
-                view_ticket_url = request.build_absolute_uri(f'/tasks/detail/{task.task_id}/')
-                context = {
-                    'user': task.department.manager,
-                    'ticket': task,
-                    'view_ticket_url': view_ticket_url,
-                }
-                send_email_notification(
-                    subject="New Task Created in Your Department",
-                    template_name='emails/ticket_created.html',
-                    context=context,
-                    recipient_email=manager_email,
-                    cc_emails=task.viewers,
-                )
-
-            # Notify the assignee (if assigned)
-            if task.assigned_to:
-                assignee_email = task.assigned_to.email
-                view_ticket_url = request.build_absolute_uri(f'/tasks/detail/{task.task_id}/')
-                context = {
-                    'user': task.assigned_to,
-                    'ticket': task,
-                    'view_ticket_url': view_ticket_url,
-                }
-                send_email_notification(
-                    subject="You Have Been Assigned a New Task",
-                    template_name='emails/ticket_assigned.html',
-                    context=context,
-                    recipient_email=assignee_email,
-                    cc_emails=task.viewers,
-                )
-
-             # Notify the task creator
-            creator_email = task.assigned_by.email
-            view_ticket_url = request.build_absolute_uri(f'/tasks/detail/{task.task_id}/')
+            # One email per person: manager, then assignee, then creator; viewers are CC'd once
             context = {
-                'user': task.assigned_by,
                 'ticket': task,
-                'view_ticket_url': view_ticket_url,
+                'view_ticket_url': request.build_absolute_uri(f'/tasks/detail/{task.task_id}/'),
             }
-            send_email_notification(
-                subject="Your Task Has Been Created",
-                template_name='emails/task_created_by_you.html',
-                context=context,
-                recipient_email=creator_email,
-            )
+            event = NotificationEvent(cc_emails=task.viewers)
+            # Notify the departmental manager (if exists)
+            if task.department and task.department.manager:
+                event.notify(task.department.manager, "New Task Created in Your Department",
+                             'emails/ticket_created.html', context, personal=True)
+            # Notify the assignee (if assigned)
+            if task.assigned_to:
+                event.notify(task.assigned_to, "You Have Been Assigned a New Task",
+                             'emails/ticket_assigned.html', context, personal=True)
+            # Notify the task creator
+            event.notify(task.assigned_by, "Your Task Has Been Created",
+                         'emails/task_created_by_you.html', context, personal=True)
+            event.send()
 
             # Log the creation action
             ActivityLog.objects.create(
@@ -251,12 +240,13 @@ def create_task(request):
         return render(request, 'tasks/create_task.html', {'form': form})
 
 @login_required
+@transaction.atomic
 def edit_task(request, task_id):
-    task = get_object_or_404(Task, task_id=task_id)
-    user_profile = UserProfile.objects.get(user=request.user)
+    task = get_object_or_404(Task.objects.select_related('assigned_by__userprofile'), task_id=task_id)
+    user_profile = get_profile(request)
     if task.assigned_by != request.user and not (
     user_profile.category == 'Departmental Manager' and
-    task.assigned_by.userprofile.department == user_profile.department
+    task.assigned_by.userprofile.department_id == user_profile.department_id
     ):
         raise PermissionDenied
 
@@ -266,7 +256,14 @@ def edit_task(request, task_id):
     if request.method == 'POST':
         form = TaskForm(request.POST, request.FILES, instance=task, user=request.user)
         if form.is_valid():
-            updated_task = form.save()
+            try:
+                updated_task = form.save()
+            except StaleTaskError:
+                task = get_object_or_404(Task, task_id=task_id)
+                form = TaskForm(instance=task, user=request.user)
+                return render(request, 'tasks/edit_task.html', {
+                    'task': task, 'form': form, 'stale_message': STALE_TASK_MESSAGE,
+                }, status=409)
 
             if old_status != updated_task.status:
                 ActivityLog.objects.create(
@@ -294,24 +291,19 @@ def edit_task(request, task_id):
     return render(request, 'tasks/edit_task.html', {'task': task, 'form': form})
 
 @login_required
+@transaction.atomic
 def task_detail(request, task_id):
     """
     Task detail view with chat functionality
     """
-    # Fetch the task
-    task = get_object_or_404(Task, task_id=task_id)
-    
-    # Check if user has permission to view this task
-    user_profile = UserProfile.objects.get(user=request.user)
-    is_viewer = request.user.email and request.user.email.lower() in (task.viewers or [])
-    has_permission = (
-        task.assigned_to == request.user or 
-        task.assigned_by == request.user or 
-        user_profile.category == 'Departmental Manager'
-        or is_viewer
+    # Fetch the task, with the profiles the template compares departments through
+    task = get_object_or_404(
+        Task.objects.select_related('assigned_to__userprofile__department', 'assigned_by__userprofile__department'),
+        task_id=task_id,
     )
     
-    if not has_permission:
+    # Check if user has permission to view this task
+    if not _can_view_task(request, task):
         messages.error(request, "You do not have permission to view this task.")
         return redirect('assigned_to_me')  # Redirect to a default view
 
@@ -329,15 +321,99 @@ def task_detail(request, task_id):
     else:
         chat_form = TaskChatForm()
 
-    # Fetch all chat messages for this task
-    chat_messages = TaskChat.objects.filter(task=task).order_by('timestamp')
+    # Only the newest messages; older ones are paged in from task_chat
+    chat = chat_page(task)
+    if chat.messages:
+        mark_read(request.user, task, chat.messages[-1].pk)
+
+    # Resolve every viewer's account in one query
+    viewer_users = users_by_email(task.viewers)
+    viewers = [(email, viewer_users.get((email or '').strip().lower())) for email in task.viewers or []]
 
     context = {
         'task': task,
         'chat_form': chat_form,
-        'chat_messages': chat_messages,
+        'chat_messages': chat.messages,
+        'chat_before': chat.before,
+        'viewers': viewers,
     }
     return render(request, 'tasks/task_detail.html', context)
+
+
+def _can_view_task(request, task):
+    """The assignee, the assignor, departmental managers and viewers can see a task."""
+    if task.assigned_to_id == request.user.pk or task.assigned_by_id == request.user.pk:
+        return True
+    if get_profile(request).category == 'Departmental Manager':
+        return True
+    return bool(request.user.email) and task.viewer_entries.filter(email=request.user.email.lower()).exists()
+
+
+@login_required
+@require_http_methods(["GET", "POST"])
+@transaction.atomic
+def task_chat(request, task_id):
+    """
+    GET: a page of older chat messages, ``?before=`` a cursor from task_detail
+    or an earlier page. POST: add a message and return just that message.
+    """
+    task = get_object_or_404(Task, task_id=task_id)
+    if not _can_view_task(request, task):
+        return JsonResponse({"error": "Forbidden"}, status=403)
+
+    if request.method == 'POST':
+        chat_form = TaskChatForm(request.POST)
+        if not chat_form.is_valid():
+            return JsonResponse({'error': 'Form data is invalid', 'errors': chat_form.errors}, status=400)
+        chat_message = chat_form.save(commit=False)
+        chat_message.task = task
+        chat_message.sender = request.user
+        chat_message.save()
+        send_new_message_notification(request, task, chat_message)
+        return JsonResponse({'message': message_payload(chat_message, request.user)}, status=201)
+
+    try:
+        page = chat_page(task, request.GET.get('before'), parse_page_size(request.GET))
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    return JsonResponse({
+        'messages': [message_payload(message, request.user) for message in page.messages],
+        'before': page.before,
+    })
+
+
+@login_required
+@require_http_methods(["POST"])
+def mark_chat_read(request, task_id):
+    """Record that the user has read the task's chat up to ``last_read_id``."""
+    task = get_object_or_404(Task, task_id=task_id)
+    if not _can_view_task(request, task):
+        return JsonResponse({"error": "Forbidden"}, status=403)
+    try:
+        last_read_id = int(request.POST.get('last_read_id', ''))
+    except ValueError:
+        return HttpResponseBadRequest("'last_read_id' must be an integer.")
+    # Never past the newest message, or later messages would arrive already read
+    last_read_id = max(min(last_read_id, latest_message_id(task)), 0)
+    mark_read(request.user, task, last_read_id)
+    return JsonResponse({'last_read_id': last_read_id})
+
+
+@login_required
+@require_http_methods(["GET"])
+def task_events(request, task_id):
+    """Server-Sent Events: new chat messages and field changes of one task."""
+    task = get_object_or_404(Task, task_id=task_id)
+    if not _can_view_task(request, task):
+        return JsonResponse({"error": "Forbidden"}, status=403)
+    return event_stream(request, [task_channel(task.task_id)])
+
+
+@login_required
+@require_http_methods(["GET"])
+def inbox_events(request):
+    """Server-Sent Events: activity on the tasks the user assigned or is assigned."""
+    return event_stream(request, [user_channel(request.user.pk)])
 def send_new_message_notification(request, task, chat_message):
     """
     Send email notification when a new message is added to a task
@@ -348,7 +424,7 @@ def send_new_message_notification(request, task, chat_message):
     
     # Build the view message URL
     view_message_url = request.build_absolute_uri(f'/tasks/detail/{task.task_id}/')
-    notification_settings_url = request.build_absolute_uri('/profile/notification-settings/')
+    notification_settings_url = request.build_absolute_uri(reverse('notification_settings'))
     
     # Determine recipients (excluding the sender)
     recipients = []
@@ -361,30 +437,26 @@ def send_new_message_notification(request, task, chat_message):
     if task.assigned_by and task.assigned_by != sender:
         recipients.append(task.assigned_by)
     
-    # Send emails to each recipient
+    # One email per recipient, viewers CC'd once
+    context = {
+        'message': {
+            'sender_name': f"{sender.first_name} {sender.last_name}",
+            'subject': f"RE: {task.subject}",
+            'timestamp': timestamp,
+            'preview': message_preview
+        },
+        'view_message_url': view_message_url,
+        'notification_settings_url': notification_settings_url,
+    }
+    event = NotificationEvent(cc_emails=task.viewers)
     for recipient in recipients:
-        context = {
-            'user': recipient,
-            'message': {
-                'sender_name': f"{sender.first_name} {sender.last_name}",
-                'subject': f"RE: {task.subject}",
-                'timestamp': timestamp,
-                'preview': message_preview
-            },
-            'view_message_url': view_message_url,
-            'notification_settings_url': notification_settings_url,
-        }
-        
-        send_email_notification(
-            subject=f"New message on task #{task.task_id}: {task.subject}",
-            template_name='emails/new_chat.html',
-            context=context,
-            recipient_email=recipient.email,
-            cc_emails=task.viewers,
-        )
+        event.notify(recipient, f"New message on task #{task.task_id}: {task.subject}",
+                     'emails/new_chat.html', context, personal=True)
+    event.send()
 
 
 @login_required
+@transaction.atomic
 def update_task_status(request, task_id):
     task = get_object_or_404(Task, task_id=task_id)
 
@@ -403,7 +475,13 @@ def update_task_status(request, task_id):
             if new_status:
                 updated_task.status = new_status
 
-            updated_task.save()  # Save the task with updated status
+            try:
+                updated_task.save()  # Save the task with updated status
+            except StaleTaskError:
+                task = get_object_or_404(Task, task_id=task_id)
+                return render(request, 'tasks/update_task_status.html', {
+                    'task': task, 'form': TaskStatusUpdateForm(instance=task), 'stale_message': STALE_TASK_MESSAGE,
+                }, status=409)
 
             # Notify about deadline revision if needed
             if old_deadline != updated_task.revised_completion_date:
@@ -411,21 +489,13 @@ def update_task_status(request, task_id):
                     'ticket': updated_task,
                     'view_ticket_url': request.build_absolute_uri(f'/tasks/detail/{updated_task.task_id}/'),
                 }
-                send_email_notification(
-                    subject=f"Deadline Revised: {updated_task.task_id}",
-                    template_name='emails/ticket_deadline_updated.html',
-                    context=context,
-                    recipient_email=updated_task.assigned_by.email,
-                    cc_emails=task.viewers,
-                )
-                if updated_task.assigned_to:
-                    send_email_notification(
-                        subject=f"Deadline Revised: {updated_task.task_id}",
-                        template_name='emails/ticket_deadline_updated.html',
-                        context=context,
-                        recipient_email=updated_task.assigned_to.email,
-                        cc_emails=task.viewers,
-                    )
+                # Creator and assignee share one email, viewers CC'd once
+                event = NotificationEvent(cc_emails=task.viewers)
+                for recipient in (updated_task.assigned_by, updated_task.assigned_to):
+                    if recipient:
+                        event.notify(recipient, f"Deadline Revised: {updated_task.task_id}",
+                                     'emails/ticket_deadline_updated.html', context)
+                event.send()
 
             # Notify about comment updates if needed
             if old_comments != updated_task.comments_by_assignee:
@@ -433,21 +503,13 @@ def update_task_status(request, task_id):
                     'ticket': updated_task,
                     'view_ticket_url': request.build_absolute_uri(f'/tasks/detail/{updated_task.task_id}/'),
                 }
-                send_email_notification(
-                    subject=f"Comment Updated: {updated_task.task_id}",
-                    template_name='emails/ticket_comment_updated.html',
-                    context=context,
-                    recipient_email=updated_task.assigned_by.email,
-                    cc_emails=task.viewers,
-                )
-                if updated_task.assigned_to:
-                    send_email_notification(
-                        subject=f"Comment Updated: {updated_task.task_id}",
-                        template_name='emails/ticket_comment_updated.html',
-                        context=context,
-                        recipient_email=updated_task.assigned_to.email,
-                        cc_emails=task.viewers,
-                    )
+                # Creator and assignee share one email, viewers CC'd once
+                event = NotificationEvent(cc_emails=task.viewers)
+                for recipient in (updated_task.assigned_by, updated_task.assigned_to):
+                    if recipient:
+                        event.notify(recipient, f"Comment Updated: {updated_task.task_id}",
+                                     'emails/ticket_comment_updated.html', context)
+                event.send()
 
             # Log the status update in ActivityLog
             if old_status != updated_task.status:
@@ -486,15 +548,23 @@ def update_task_status(request, task_id):
 
 
 
+# Manual triggers for the send_deadline_reminders and notify_overdue_tasks
+# commands; the scheduled runs go through the commands.
 @login_required
+@require_http_methods(["POST"])
 def send_deadline_reminders(request):
-    send_deadline_reminders_logic()
-    return HttpResponse("Deadline reminders sent!")
+    if not request.user.is_staff:
+        raise PermissionDenied
+    report = send_deadline_reminders_logic()
+    return HttpResponse(f"Deadline reminders sent: {report.emails} ({report.failed} failed) in {report.seconds:.1f}s.")
 
 @login_required
+@require_http_methods(["POST"])
 def notify_overdue_tasks(request):
-    notify_overdue_tasks_logic()
-    return HttpResponse("Overdue notifications sent!")
+    if not request.user.is_staff:
+        raise PermissionDenied
+    report = notify_overdue_tasks_logic()
+    return HttpResponse(f"Overdue notifications sent: {report.emails} ({report.failed} failed) in {report.seconds:.1f}s.")
 
 @login_required
 def mark_task_completed(request, task_id):
@@ -510,12 +580,12 @@ def mark_task_completed(request, task_id):
 
 @login_required
 def reassign_task(request, task_id):
-    task = get_object_or_404(Task, task_id=task_id)
+    task = get_object_or_404(Task.objects.select_related('assigned_to__userprofile'), task_id=task_id)
     old_assignee = task.assigned_to  # Capture the current assignee before reassigning
-    user_profile = UserProfile.objects.get(user=request.user)
+    user_profile = get_profile(request)
     if task.assigned_to != request.user and not (
     user_profile.category == 'Departmental Manager' and
-    task.assigned_to.userprofile.department == user_profile.department
+    task.assigned_to.userprofile.department_id == user_profile.department_id
     ):
         raise PermissionDenied
 
@@ -526,13 +596,16 @@ def reassign_task(request, task_id):
 
 
 @login_required
+@transaction.atomic
 def task_note_page(request, task_id):
-    task = get_object_or_404(Task, task_id=task_id)
+    task = get_object_or_404(
+        Task.objects.select_related('assigned_to__userprofile', 'assigned_by__userprofile__department'), task_id=task_id
+    )
     old_assignee = task.assigned_to
-    user_profile = UserProfile.objects.get(user=request.user)
+    user_profile = get_profile(request)
     if task.assigned_to != request.user and not (
     user_profile.category == 'Departmental Manager' and
-    task.assigned_to.userprofile.department == user_profile.department
+    task.assigned_to.userprofile.department_id == user_profile.department_id
     ):
         raise PermissionDenied
 
@@ -550,7 +623,17 @@ def task_note_page(request, task_id):
 
         task.assigned_to = task.assigned_by
         task.department = from_dept
-        task.save()
+        task.expect_version(request.POST.get('version'))
+        try:
+            task.save()
+        except StaleTaskError:
+            if attachment:
+                # FileField.pre_save stored the upload before the version check
+                task.attachment_by_assignee.delete(save=False)
+            task = get_object_or_404(Task, task_id=task_id)
+            return render(request, 'tasks/task_note_page.html', {
+                'task': task, 'note': note, 'stale_message': STALE_TASK_MESSAGE,
+            }, status=409)
         username = str(task.assigned_to)
         new_assignee = User.objects.get(username=username)
         view_ticket_url = request.build_absolute_uri(f'/tasks/detail/{task.task_id}/')
@@ -592,7 +675,7 @@ def task_note_page(request, task_id):
 
 @login_required
 def dashboard(request):
-    user_profile = UserProfile.objects.get(user=request.user)
+    user_profile = get_profile(request)
     if user_profile.category == 'Task Management System Manager':
         return redirect('activity')  # Redirect Managers to Activity Page
     elif user_profile.category == 'Departmental Manager':
@@ -611,293 +694,158 @@ def activity(request):
 
 
 
+ACTIVITY_EXPORT_CHUNK_SIZE = 2000
+
+
+class _Echo:
+    """File-like object that hands back whatever csv.writer writes to it."""
+    def write(self, value):
+        return value
+
+
+def _gzip_stream(chunks):
+    """Gzip a stream of text chunks without holding the whole file."""
+    compressor = zlib.compressobj(wbits=31)  # 31 = gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
 @login_required
 def download_activity_log(request):
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="activity_log.csv"'
-    
-    writer = csv.writer(response)
-    writer.writerow(['User', 'Action', 'Task ID', 'Description', 'Timestamp'])
-    
-    logs = ActivityLog.objects.all().order_by('-timestamp')
-    for log in logs:
-        writer.writerow([log.user.username, log.get_action_display(), log.task.task_id, log.description, log.timestamp])
-    
-    return response
+    """
+    Stream the activity log as CSV (or gzipped CSV with ?gzip=1).
+    Optional filters: ?since=YYYY-MM-DD&until=YYYY-MM-DD&action=<action>&department=<id or name>
+    """
+    logs = ActivityLog.objects.order_by('-timestamp')
+
+    # Day bounds as aware datetimes: a range on the column itself can use
+    # activitylog_time_idx, a filter on its date cannot
+    since = request.GET.get('since')
+    until = request.GET.get('until')
+    if since:
+        since_date = parse_date(since)
+        if not since_date:
+            return HttpResponseBadRequest("Invalid 'since' date. Use YYYY-MM-DD")
+        logs = logs.filter(timestamp__gte=timezone.make_aware(datetime.combine(since_date, time.min)))
+    if until:
+        until_date = parse_date(until)
+        if not until_date:
+            return HttpResponseBadRequest("Invalid 'until' date. Use YYYY-MM-DD")
+        logs = logs.filter(timestamp__lt=timezone.make_aware(datetime.combine(until_date + timedelta(days=1), time.min)))
+
+    action = request.GET.get('action')
+    if action:
+        logs = logs.filter(action=action)
+
+    department = request.GET.get('department')
+    if department:
+        if department.isdigit():
+            logs = logs.filter(task__department_id=department)
+        else:
+            logs = logs.filter(task__department__name=department)
+
+    # User and task come from the same query; rows are read in chunks
+    rows = logs.values_list('user__username', 'action', 'task__task_id', 'description', 'timestamp')
+    action_labels = dict(ActivityLog.ACTION_CHOICES)
+
+    def csv_lines():
+        writer = csv.writer(_Echo())
+        yield writer.writerow(['User', 'Action', 'Task ID', 'Description', 'Timestamp'])
+        for username, action, task_id, description, timestamp in rows.iterator(chunk_size=ACTIVITY_EXPORT_CHUNK_SIZE):
+            yield writer.writerow([username, action_labels.get(action, action), task_id, description, timestamp])
 
-from django.db.models import F, Q, Count
+    if request.GET.get('gzip') in ('1', 'true'):
+        response = StreamingHttpResponse(_gzip_stream(csv_lines()), content_type='application/gzip')
+        response['Content-Disposition'] = 'attachment; filename="activity_log.csv.gz"'
+    else:
+        response = StreamingHttpResponse(csv_lines(), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="activity_log.csv"'
+    return response
 
 @login_required
 def metrics(request):
-    # Get the current time and the last 24 hours time
-    now = timezone.now()
-    last_24_hours = now - timezone.timedelta(hours=24)
-    seventy_two_hours_ago = now - timezone.timedelta(hours=72)
-    today_date = now.date()
-
-    # Get all departments for consistent metrics
-    all_departments = Department.objects.all()
-    
-    # Initialize metrics_data list
-    metrics_data = []
-    
-    for department in all_departments:
-        department_name = department.name
-        
-        # RECEIVED TICKETS METRICS
-        # Open tickets received by this department (status is not Completed or Cancelled)
-        open_tickets_received = Task.objects.filter(
-            department__name=department_name,
-            status__in=['In Progress', 'Not Started', 'Waiting for confirmation', 'Pending', 'Delay processing', 'Processing', 'Stalled', 'On-Hold','Overdue']
-        ).count()
-        
-        # Tickets received in last 24 hours by this department
-        tickets_received_last_24hr = Task.objects.filter(
-            department__name=department_name,
-            assigned_date__gte=last_24_hours
-        ).count()
-        
-        # RAISED TICKETS METRICS
-        # Open tickets raised by this department (status is not Completed or Cancelled)
-        open_tickets_raised = Task.objects.filter(
-            assigned_by__userprofile__department__name=department_name,
-            status__in=['In Progress', 'Not Started', 'Waiting for confirmation', 'Pending', 'Delay processing', 'Processing', 'Stalled', 'On-Hold','Overdue']
-        ).count()
-        
-        # Tickets raised in last 24 hours by this department
-        tickets_raised_last_24hr = Task.objects.filter(
-            assigned_by__userprofile__department__name=department_name,
-            assigned_date__gte=last_24_hours
-        ).count()
-        
-        # OLDER TICKETS METRICS
-        # Older open tickets (received more than 24 hours ago but still open)
-        older_open_tickets = Task.objects.filter(
-            department__name=department_name,
-            assigned_date__lt=last_24_hours,
-            status__in=['In Progress', 'Not Started', 'Waiting for confirmation', 'Pending', 'Delay processing', 'Processing', 'Stalled', 'On-Hold','Overdue']
-        ).count()
-        
-        # PENDING TICKETS BIFURCATION
-        # Get all tickets received by this department that are still open
-        pending_tickets = Task.objects.filter(
-            department__name=department_name,
-            status__in=['In Progress', 'Not Started', 'Waiting for confirmation', 'Pending', 'Delay processing', 'Processing', 'Stalled', 'On-Hold','Overdue']
-        )
-        
-        # Group these tickets by the department of the user who assigned them
-        pending_by_dept = {}
-        for task in pending_tickets:
-            if task.assigned_by and hasattr(task.assigned_by, 'userprofile') and task.assigned_by.userprofile.department:
-                assignor_dept_name = task.assigned_by.userprofile.department.name
-                if assignor_dept_name not in pending_by_dept:
-                    pending_by_dept[assignor_dept_name] = 0
-                pending_by_dept[assignor_dept_name] += 1
-        
-        # TICKETS PASSED 72 HOURS
-        # Tickets that were received more than 72 hours ago and are still open
-        tickets_passed_72_hours = Task.objects.filter(
-            department__name=department_name,
-            assigned_date__lte=seventy_two_hours_ago,
-            status__in=['In Progress', 'Not Started', 'Waiting for confirmation', 'Pending', 'Delay processing', 'Processing', 'Stalled', 'On-Hold','Overdue']
-        ).count()
-        
-        # TICKETS PASSED DEADLINE
-        # For each task, check if it has passed either the revised_completion_date or the original deadline
-        tickets_passed_revised_deadline = Task.objects.filter(
-            department__name=department_name,
-            status__in=['In Progress', 'Not Started', 'Waiting for confirmation', 'Pending', 'Delay processing', 'Processing', 'Stalled', 'On-Hold','Overdue']
-        ).filter(
-            Q(revised_completion_date__isnull=False, revised_completion_date__lt=today_date) | 
-            Q(revised_completion_date__isnull=True, deadline__lt=today_date)
-        ).count()
-        
-        # Add all metrics for this department to the metrics_data list
-        metrics_data.append({
-            'department__name': department_name,
-            'open_tickets_received': open_tickets_received,
-            'tickets_received_last_24hr': tickets_received_last_24hr,
-            'open_tickets_raised': open_tickets_raised,
-            'tickets_raised_last_24hr': tickets_raised_last_24hr,
-            'older_open_tickets': older_open_tickets,
-            'pending_tickets_bifurcation': pending_by_dept,
-            'tickets_passed_72_hours': tickets_passed_72_hours,
-            'tickets_passed_revised_deadline': tickets_passed_revised_deadline
-        })
-    
-    # Calculate summary totals
-    total_open_raised = sum(d.get('open_tickets_raised', 0) for d in metrics_data)
-    total_open_received = sum(d.get('open_tickets_received', 0) for d in metrics_data)
-    total_raised_last_24hr = sum(d.get('tickets_raised_last_24hr', 0) for d in metrics_data)
-    total_received_last_24hr = sum(d.get('tickets_received_last_24hr', 0) for d in metrics_data)
-    total_older_open_tickets = sum(d.get('older_open_tickets', 0) for d in metrics_data)
-    total_tickets_passed_72_hours = sum(d.get('tickets_passed_72_hours', 0) for d in metrics_data)
-    total_tickets_passed_revised_deadline = sum(d.get('tickets_passed_revised_deadline', 0) for d in metrics_data)
-    
-    # Calculate total pending tickets
-    total_pending_tickets = 0
-    for department in metrics_data:
-        pending_bifurcation = department.get('pending_tickets_bifurcation', {})
-        total_pending_tickets += sum(pending_bifurcation.values())
-    
-    metrics_summary = {
-        'total_raised_last_24hr': total_raised_last_24hr,
-        'total_received_last_24hr': total_received_last_24hr,
-        'total_open_raised': total_open_raised,
-        'total_open_received': total_open_received,
-        'total_older_open_tickets': total_older_open_tickets,
-        'total_pending_tickets': total_pending_tickets,
-        'total_tickets_passed_72_hours': total_tickets_passed_72_hours,
-        'total_tickets_passed_revised_deadline': total_tickets_passed_revised_deadline,
-    }
-    
+    try:
+        window = parse_window(request.GET)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    metrics_data = compute_department_metrics(materialized=True, window=window)
+    metrics_summary = summarize_metrics(metrics_data)
+
     return render(request, 'tasks/metrics.html', {
         'metrics_data': metrics_data,
         'metrics_summary': metrics_summary,
+        'window': window,
+        'window_presets': WINDOW_PRESETS,
     })
 
-# Download metrics as a CSV file
+# Download metrics as a CSV file (or JSON with ?format=json)
 
 @login_required
 def download_metrics(request):
-    # Get the current time and the last 24 hours time
-    now = timezone.now()
-    last_24_hours = now - timezone.timedelta(hours=24)
-    today_date = date.today()
-    seventy_two_hours = now - timedelta(hours=72)
-
-    # Metrics for Last 24 Hours (raised and received)
-    metrics_data = Task.objects.values('department__name').annotate(
-        tickets_received_last_24hr=Count('id', filter=Q(assigned_to__userprofile__department__name=F('department__name'), assigned_date__gte=last_24_hours, assigned_date__lte=today_date)),
-        open_tickets_received=Count('id', filter=Q(assigned_to__userprofile__department__name=F('department__name'), status__in=['In Progress', 'Not Started', 'Waiting for confirmation', 'Pending', 'Delay processing', 'Processing'], assigned_date__lte=today_date)),
-    ).order_by('department__name')
-
-    # Add all-time data for raised and received tickets
-    for data in metrics_data:
-        department_name = data['department__name']
-
-        tickets_raised_all_time = Task.objects.filter(
-            assigned_by__userprofile__department__name=department_name,
-            status__in=['In Progress', 'Not Started', 'Waiting for confirmation', 'Pending', 'Delay processing', 'Processing','Overdue'],
-            assigned_date__lte=today_date
-        ).count()
-
-        tickets_raised_last_24hr = Task.objects.filter(
-            assigned_by__userprofile__department__name=department_name,
-            assigned_date__gte=last_24_hours,
-            assigned_date__lte=today_date
-        ).count()
-
-        data['tickets_raised_last_24hr'] = tickets_raised_last_24hr
-
-        tickets_received_all_time = Task.objects.filter(
-            assigned_to__userprofile__department__name=department_name,
-            status__in=['In Progress', 'Not Started', 'Waiting for confirmation', 'Pending', 'Delay processing', 'Processing','Overdue'],
-            assigned_date__lte=today_date
-        ).count()
-
-        data['open_tickets_raised'] = tickets_raised_all_time
-        data['open_tickets_received'] = tickets_received_all_time
-
-        # Tickets passed 72 hours after raising
-        passed_72_hours = Task.objects.filter(
-            department__name=department_name,
-            assigned_date__lte=seventy_two_hours,
-            status__in=['In Progress', 'Not Started', 'Waiting for confirmation', 'Pending', 'Delay processing', 'Processing','Overdue'],
-        ).count()
-        data['tickets_passed_72_hours'] = passed_72_hours
-        
-        # Tickets passed the revised deadline or original deadline
-        passed_revised_deadline = Task.objects.filter(
-            department__name=department_name,
-            deadline__lte=now,
-            status__in=['In Progress', 'Not Started', 'Waiting for confirmation', 'Pending', 'Delay processing', 'Processing','Overdue'],
-        ).count()
-        data['tickets_passed_revised_deadline'] = passed_revised_deadline
-
-        # Get older open tickets with task data
-        older_open_tickets_data = Task.objects.filter(
-            assigned_to__userprofile__department__name=department_name,
-            status__in=['In Progress', 'Not Started', 'Waiting for confirmation', 'Pending', 'Delay processing', 'Processing','Overdue'],
-            assigned_date__lt=last_24_hours
-        )
-        data['older_open_tickets'] = older_open_tickets_data  # Storing actual task data
-
-    # Add Pending Tickets by Department (Bifurcation)
-    for data in metrics_data:
-        department_name = data['department__name']
-
-        # Filter tasks where assigned_to department matches the current department
-        all_task_of_this_dept = Task.objects.filter(
-            assigned_to__userprofile__department__name=department_name,
-            status__in=['In Progress', 'Not Started', 'Pending', 'Processing', 'Delay Processing', 'Waiting for confirmation','Overdue'],
-            assigned_date__lt=last_24_hours
-        )
-
-        # Create a map to store pending tickets count by assigned_by department
-        pending_by_dept = {}
-
-        # Loop through tasks and populate pending_by_dept map
-        for task in all_task_of_this_dept:
-            assignor_dept_name = task.assigned_by.userprofile.department.name  # Updated variable name
-
-            # Increment the pending ticket count for the assignor department
-            if assignor_dept_name not in pending_by_dept:
-                pending_by_dept[assignor_dept_name] = 0
-            pending_by_dept[assignor_dept_name] += 1
+    try:
+        window = parse_window(request.GET)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
 
-        # Set the pending_by_dept map as the bifurcation value
-        data['pending_tickets_bifurcation'] = pending_by_dept
+    # Same definitions and the same grouped pass as the on-screen dashboard
+    metrics_data = compute_department_metrics(materialized=True, window=window)
 
-    # Prepare CSV Response
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="metrics_data.csv"'
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'generated_at': timezone.now().isoformat(),
+            'window': {
+                'key': window.key,
+                'label': window.label,
+                'since': window.since.isoformat(),
+                'until': window.until.isoformat() if window.until else None,
+            },
+            'departments': metrics_data,
+            'summary': summarize_metrics(metrics_data),
+        })
 
-    writer = csv.writer(response)
-
-    # Writing the header row
-    writer.writerow([
-        'Department Name',
-        'Tickets Received Last 24hr',
-        'Open Tickets Received',
-        'Tickets Raised Last 24hr',
-        'Open Tickets Raised',
-        'Older Open Tickets',
-        'Pending Tickets Bifurcation',
-        'Tickets Passed 72 Hours After Raising',  # New Column Header
-        'Tickets Passed the Revised Deadline'   # New Column Header
-    ])
-
-    # Writing data rows
-    for data in metrics_data:
-        department_name = data['department__name']
-        tickets_received_last_24hr = data['tickets_received_last_24hr']
-        open_tickets_received = data['open_tickets_received']
-        tickets_raised_last_24hr = data['tickets_raised_last_24hr']
-        open_tickets_raised = data['open_tickets_raised']
-        older_open_tickets = len(data['older_open_tickets'])  # Assuming this is a list of task objects
-        pending_tickets_bifurcation = str(data['pending_tickets_bifurcation'])  # Convert to string for CSV format
-        tickets_passed_72_hours = data['tickets_passed_72_hours']
-        tickets_passed_revised_deadline = data['tickets_passed_revised_deadline']
-
-        writer.writerow([
-            department_name,
-            tickets_received_last_24hr,
-            open_tickets_received,
-            tickets_raised_last_24hr,
-            open_tickets_raised,
-            older_open_tickets,
-            pending_tickets_bifurcation,
-            tickets_passed_72_hours,  # New Column Data
-            tickets_passed_revised_deadline  # New Column Data
+    def csv_lines():
+        writer = csv.writer(_Echo())
+        yield writer.writerow([
+            'Department Name',
+            f'Tickets Received ({window.label})',
+            'Open Tickets Received',
+            f'Tickets Raised ({window.label})',
+            'Open Tickets Raised',
+            'Older Open Tickets',
+            'Pending Tickets Bifurcation',
+            'Tickets Passed 72 Hours After Raising',
+            'Tickets Passed the Revised Deadline',
+            f'Tickets Completed ({window.label})',
+            f'Tickets Reassigned ({window.label})',
         ])
-
+        for data in metrics_data:
+            yield writer.writerow([
+                data['department__name'],
+                data['tickets_received_last_24hr'],
+                data['open_tickets_received'],
+                data['tickets_raised_last_24hr'],
+                data['open_tickets_raised'],
+                data['older_open_tickets'],
+                json.dumps(data['pending_tickets_bifurcation']),
+                data['tickets_passed_72_hours'],
+                data['tickets_passed_revised_deadline'],
+                data['tickets_completed_in_window'],
+                data['tickets_reassigned_in_window'],
+            ])
+
+    response = StreamingHttpResponse(csv_lines(), content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="metrics_data.csv"'
     return response
 
 @login_required
+@transaction.atomic
 def reassign_within_department(request, task_id):
     task = get_object_or_404(Task, task_id=task_id)
-    user_profile = UserProfile.objects.get(user=request.user)
+    user_profile = get_profile(request)
 
     # Ensure only Departmental Managers can access this functionality
     if user_profile.category != 'Departmental Manager':
@@ -914,7 +862,16 @@ def reassign_within_department(request, task_id):
         if new_assignee_id:
             new_assignee = get_object_or_404(User, id=new_assignee_id)
             task.assigned_to = new_assignee
-            task.save()
+            task.expect_version(request.POST.get('version'))
+            try:
+                task.save()
+            except StaleTaskError:
+                task = get_object_or_404(Task, task_id=task_id)
+                return render(request, 'tasks/reassign_within_department.html', {
+                    'task': task,
+                    'non_management_users': non_management_users,
+                    'stale_message': STALE_TASK_MESSAGE,
+                }, status=409)
 
             # Notify the assignee (if assigned)
             if task.assigned_to:
@@ -955,108 +912,28 @@ def department_metrics(request, department):
     # Fetch the department object
     department_obj = get_object_or_404(Department, name=department)
 
-    # Get the current time and the last 24 hours time
-    now = timezone.now()
-    last_24_hours = now - timezone.timedelta(hours=24)
-    today_date = now.date()
-    seventy_two_hours = now - timezone.timedelta(hours=72)
-
-    # Define the status options to filter open tickets
-    open_statuses = ['In Progress', 'Not Started', 'Waiting for confirmation', 'Pending', 'Delay processing', 'Processing', 'Stalled', 'On-Hold','Overdue']
-
-    # Metrics calculations for the department
-    open_tickets_received = Task.objects.filter(
-        department=department_obj,
-        status__in=open_statuses
-    ).count()
-
-    tickets_received_last_24hr = Task.objects.filter(
-        department=department_obj,
-        assigned_date__gte=last_24_hours
-    ).count()
-
-    open_tickets_raised = Task.objects.filter(
-        assigned_by__userprofile__department=department_obj,
-        status__in=open_statuses
-    ).count()
-
-    tickets_raised_last_24hr = Task.objects.filter(
-        assigned_by__userprofile__department=department_obj,
-        assigned_date__gte=last_24_hours
-    ).count()
-
-    older_open_tickets = Task.objects.filter(
-        department=department_obj,
-        assigned_date__lt=last_24_hours,
-        status__in=open_statuses
-    ).count()
-
-    # Group pending tickets by the department of the user who assigned them
-    # This shows tickets that OTHER departments have assigned TO current department
-    pending_tickets = Task.objects.filter(
-        department=department_obj,
-        status__in=open_statuses
-    )
-
-    pending_by_dept = {}
-    for task in pending_tickets:
-        assignor_dept_name = task.assigned_by.userprofile.department.name
-        if assignor_dept_name not in pending_by_dept:
-            pending_by_dept[assignor_dept_name] = 0
-        pending_by_dept[assignor_dept_name] += 1
-
-    # NEW FIELD: Group tickets assigned BY current department to other departments
-    # This shows tickets that current department has assigned to OTHER departments
-    tickets_assigned_by_current_dept = Task.objects.filter(
-        assigned_by__userprofile__department=department_obj,  # assigned_by's department = current department
-        status__in=open_statuses
-    )
-
-    tickets_assigned_to_other_depts = {}
-    for task in tickets_assigned_by_current_dept:
-        receiver_dept_name = task.department # which department received the task
-        if receiver_dept_name not in tickets_assigned_to_other_depts:
-            tickets_assigned_to_other_depts[receiver_dept_name] = 0
-        tickets_assigned_to_other_depts[receiver_dept_name] += 1
-
-    tickets_passed_72_hours = Task.objects.filter(
-        department=department_obj,
-        assigned_date__lte=seventy_two_hours,
-        status__in=open_statuses
-    ).count()
-
-    tickets_passed_revised_deadline = Task.objects.filter(
-        department=department_obj,
-        status__in=open_statuses
-    ).filter(
-        Q(revised_completion_date__isnull=False, revised_completion_date__lt=today_date) |
-        Q(revised_completion_date__isnull=True, deadline__lt=today_date)
-    ).count()
-
-    # Aggregate metrics into a dictionary
-    department_metrics_data = {
-        'open_tickets_received': open_tickets_received,
-        'tickets_received_last_24hr': tickets_received_last_24hr,
-        'open_tickets_raised': open_tickets_raised,
-        'tickets_raised_last_24hr': tickets_raised_last_24hr,
-        'older_open_tickets': older_open_tickets,
-        'pending_tickets_bifurcation': pending_by_dept,
-        'tickets_assigned_to_other_depts': tickets_assigned_to_other_depts,  # NEW FIELD
-        'tickets_passed_72_hours': tickets_passed_72_hours,
-        'tickets_passed_revised_deadline': tickets_passed_revised_deadline
-    }
+    try:
+        window = parse_window(request.GET)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
 
+    # Metrics for this department, including the bifurcation in both directions
+    department_metrics_data = compute_department_metrics(
+        department=department_obj, materialized=True, window=window
+    )[0]
 
     # Render the department-wise metrics page
     return render(request, 'tasks/department_metrics.html', {
         'department_metrics_data': department_metrics_data,
-        'department_name': department_obj.name
+        'department_name': department_obj.name,
+        'window': window,
+        'window_presets': WINDOW_PRESETS,
     })
 from django.http import Http404
 # View to list, edit, and delete users
 @login_required
 def manage_users(request):
-    user_profile = UserProfile.objects.get(user=request.user)
+    user_profile = get_profile(request)
 
     # Ensure that only a departmental manager can access this page
     if user_profile.category != 'Departmental Manager':
@@ -1243,6 +1120,7 @@ def get_user_by_email(email):
         return None
 
 @require_http_methods(["GET"])
+@transaction.atomic
 def api_create_task(request, assigned_by_email, assigned_to_email, deadline, ticket_type, priority, department, subject, request_details):
     """
     Create task via GET request with URL parameters
@@ -1346,47 +1224,34 @@ def api_create_task(request, assigned_by_email, assigned_to_email, deadline, tic
 
         # Send email notifications (reusing your existing logic)
         try:
-            if task.assigned_to:
-                view_ticket_url = f'/tasks/detail/{task.task_id}/'
+            # A savepoint, so a failure here leaves the task write intact
+            with transaction.atomic():
                 context = {
-                    'user': task.assigned_to,
                     'ticket': task,
-                    'view_ticket_url': view_ticket_url,
+                    'view_ticket_url': f'/tasks/detail/{task.task_id}/',
                 }
-                send_email_notification(
-                    subject="You Have Been Assigned a New Task",
-                    template_name='emails/ticket_assigned.html',
-                    context=context,
-                    recipient_email=task.assigned_to.email,
-                    cc_emails=task.viewers,
-                )
+                event = NotificationEvent(cc_emails=task.viewers)
+                if task.assigned_to:
+                    event.notify(task.assigned_to, "You Have Been Assigned a New Task",
+                                 'emails/ticket_assigned.html', context, personal=True)
 
-            # Notify task creator
-            view_ticket_url = f'/tasks/detail/{task.task_id}/'
-            context = {
-                'user': task.assigned_by,
-                'ticket': task,
-                'view_ticket_url': view_ticket_url,
-            }
-            send_email_notification(
-                subject="Your Task Has Been Created",
-                template_name='emails/task_created_by_you.html',
-                context=context,
-                recipient_email=task.assigned_by.email,
-                cc_emails=task.viewers,
-            )
+                # Notify task creator
+                event.notify(task.assigned_by, "Your Task Has Been Created",
+                             'emails/task_created_by_you.html', context, personal=True)
+                event.send()
 
         except Exception as e:
             logger.warning(f"Failed to send email notifications for task {task.task_id}: {str(e)}")
 
         # Log the creation action
         try:
-            ActivityLog.objects.create(
-                action='created',
-                user=assigned_by_user,
-                task=task,
-                description=f"Task {task.task_id} created by {assigned_by_user.username} via GET API"
-            )
+            with transaction.atomic():
+                ActivityLog.objects.create(
+                    action='created',
+                    user=assigned_by_user,
+                    task=task,
+                    description=f"Task {task.task_id} created by {assigned_by_user.username} via GET API"
+                )
         except Exception as e:
             logger.warning(f"Failed to log activity for task {task.task_id}: {str(e)}")
 
@@ -1398,6 +1263,8 @@ def api_create_task(request, assigned_by_email, assigned_to_email, deadline, tic
         }, status=201)
 
     except Exception as e:
+        # Roll back whatever the view wrote before answering with a 500
+        transaction.set_rollback(True)
         logger.error(f"Unexpected error in api_create_task: {str(e)}")
         return JsonResponse({
             'error': 'Internal server error',
@@ -1420,7 +1287,7 @@ def api_update_viewers(request, task_id, viewer_emails):
     task = get_object_or_404(Task, task_id=task_id)
 
     # Authorization: creator, current assignee, or departmental manager only
-    user_profile = UserProfile.objects.get(user=request.user)
+    user_profile = get_profile(request)
     is_manager = user_profile.category == 'Departmental Manager'
     if not (task.assigned_by == request.user or task.assigned_to == request.user or is_manager):
         return JsonResponse({"error": "Forbidden"}, status=403)
@@ -1428,11 +1295,10 @@ def api_update_viewers(request, task_id, viewer_emails):
     if viewer_emails.lower() == "none":
         new_viewers = []
     else:
-        emails = [e.strip().lower() for e in viewer_emails.split(",") if e.strip()]
-        new_viewers = sorted(list(set(emails)))
+        new_viewers = viewer_emails.split(",")
 
-    task.viewers = new_viewers
-    task.save(update_fields=["viewers"])
+    # Only the added / removed emails touch the TaskViewer table
+    task.set_viewers(new_viewers)
 
     return JsonResponse({"task_id": task.task_id, "viewers": task.viewers})
 
@@ -1444,7 +1310,17 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+def _stale_task_response(task_id):
+    """409 for an API write that lost a race with another update of the task."""
+    current_version = Task.objects.filter(task_id=task_id).values_list('version', flat=True).first()
+    return JsonResponse({
+        'error': f'Task {task_id} was changed by someone else; fetch it again and retry',
+        'current_version': current_version,
+        'success': False
+    }, status=409)
+
 @require_http_methods(["GET"])
+@transaction.atomic
 def api_update_task(request, task_id, updated_by_email, status=None, revised_deadline=None, subject=None, request_details=None):
     """
     Update task via GET request with optional subject and request details
@@ -1550,57 +1426,63 @@ def api_update_task(request, task_id, updated_by_email, status=None, revised_dea
                 'success': True
             })
 
-        # Save task
-        task.save()
+        # Save task; integrations can pass ?version= from an earlier read
+        task.expect_version(request.GET.get('version'))
+        try:
+            task.save()
+        except StaleTaskError:
+            return _stale_task_response(task_id)
 
         # Send notifications based on who updated the task
         try:
-            view_ticket_url = f'/tasks/detail/{task.task_id}/'
-            context = {'ticket': task, 'view_ticket_url': view_ticket_url}
+            with transaction.atomic():
+                view_ticket_url = f'/tasks/detail/{task.task_id}/'
+                context = {'ticket': task, 'view_ticket_url': view_ticket_url}
             
-            # Determine email recipient based on who made the update
-            recipient_email = None
-            email_subject = f"Task Updated: {task.task_id}"
+                # Determine email recipient based on who made the update
+                recipient_email = None
+                email_subject = f"Task Updated: {task.task_id}"
             
-            if is_creator:
-                # If creator updated, send email to assignee
-                if task.assigned_to and task.assigned_to.email:
-                    recipient_email = task.assigned_to.email
-                    email_subject = f"Task Updated by Creator: {task.task_id}"
-            elif is_assignee:
-                # If assignee updated, send email to creator
-                if task.assigned_by and task.assigned_by.email:
-                    recipient_email = task.assigned_by.email
-                    email_subject = f"Task Updated by Assignee: {task.task_id}"
+                if is_creator:
+                    # If creator updated, send email to assignee
+                    if task.assigned_to and task.assigned_to.email:
+                        recipient_email = task.assigned_to.email
+                        email_subject = f"Task Updated by Creator: {task.task_id}"
+                elif is_assignee:
+                    # If assignee updated, send email to creator
+                    if task.assigned_by and task.assigned_by.email:
+                        recipient_email = task.assigned_by.email
+                        email_subject = f"Task Updated by Assignee: {task.task_id}"
             
-            if recipient_email:
-                send_email_notification(
-                    subject=email_subject,
-                    template_name='emails/ticket_status_updated.html',
-                    context=context,
-                    recipient_email=recipient_email,
-                    cc_emails=task.viewers,
-                )
+                if recipient_email:
+                    send_email_notification(
+                        subject=email_subject,
+                        template_name='emails/ticket_status_updated.html',
+                        context=context,
+                        recipient_email=recipient_email,
+                        cc_emails=task.viewers,
+                    )
 
         except Exception as e:
             logger.warning(f"Failed to send email notifications: {str(e)}")
 
         # Log activity
         try:
-            activity_description = f"Task updated via GET API by {updated_by_user.email}"
-            if old_status != task.status:
-                activity_description += f" - Status changed from '{old_status}' to '{task.status}'"
-            if subject:
-                activity_description += f" - Subject updated to '{subject}'"
-            if request_details:
-                activity_description += f" - Request details updated"
+            with transaction.atomic():
+                activity_description = f"Task updated via GET API by {updated_by_user.email}"
+                if old_status != task.status:
+                    activity_description += f" - Status changed from '{old_status}' to '{task.status}'"
+                if subject:
+                    activity_description += f" - Subject updated to '{subject}'"
+                if request_details:
+                    activity_description += f" - Request details updated"
                 
-            ActivityLog.objects.create(
-                action='task_updated_api',
-                user=updated_by_user,
-                task=task,
-                description=activity_description
-            )
+                ActivityLog.objects.create(
+                    action='task_updated_api',
+                    user=updated_by_user,
+                    task=task,
+                    description=activity_description
+                )
         except Exception as e:
             logger.warning(f"Failed to log activity: {str(e)}")
 
@@ -1609,10 +1491,12 @@ def api_update_task(request, task_id, updated_by_email, status=None, revised_dea
             'task_id': task.task_id,
             'changes_made': changes_made,
             'updated_by': updated_by_user.email,
+            'version': task.version,
             'success': True
         })
 
     except Exception as e:
+        transaction.set_rollback(True)
         logger.error(f"Unexpected error in api_update_task: {str(e)}")
         return JsonResponse({
             'error': 'Internal server error',
@@ -1620,6 +1504,7 @@ def api_update_task(request, task_id, updated_by_email, status=None, revised_dea
         }, status=500)
 
 @require_http_methods(["GET"])
+@transaction.atomic
 def api_reassign_task(request, task_id, reassigned_by_email):
     """
     Reassign task via GET request
@@ -1664,48 +1549,54 @@ def api_reassign_task(request, task_id, reassigned_by_email):
         from_dept = task.assigned_by.userprofile.department
         task.assigned_to = task.assigned_by
         task.department = from_dept
-        task.save()
+        task.expect_version(request.GET.get('version'))
+        try:
+            task.save()
+        except StaleTaskError:
+            return _stale_task_response(task_id)
 
         new_assignee = task.assigned_by
 
         # Send notifications (reusing your existing logic)
         try:
-            view_ticket_url = f'/tasks/detail/{task.task_id}/'
-            context = {
-                'user': new_assignee,
-                'ticket': task,
-                'view_ticket_url': view_ticket_url,
-            }
+            with transaction.atomic():
+                view_ticket_url = f'/tasks/detail/{task.task_id}/'
+                context = {
+                    'user': new_assignee,
+                    'ticket': task,
+                    'view_ticket_url': view_ticket_url,
+                }
 
-            if new_assignee.email:
-                send_email_notification(
-                    subject="You Have Been Re-Assigned a Task",
-                    template_name='emails/ticket_reassigned.html',
-                    context=context,
-                    recipient_email=new_assignee.email,
-                    cc_emails=task.viewers,
-                )
+                if new_assignee.email:
+                    send_email_notification(
+                        subject="You Have Been Re-Assigned a Task",
+                        template_name='emails/ticket_reassigned.html',
+                        context=context,
+                        recipient_email=new_assignee.email,
+                        cc_emails=task.viewers,
+                    )
 
         except Exception as e:
             logger.warning(f"Failed to send email notifications: {str(e)}")
 
         # Log activity
         try:
-            ActivityLog.objects.create(
-                action='reassigned',
-                user=reassigned_by_user,
-                task=task,
-                description=f"Task reassigned via GET API from {old_assignee_name} to {new_assignee.username}"
-            )
-
-            if note:
+            with transaction.atomic():
                 ActivityLog.objects.create(
-                    action='comment_added',
+                    action='reassigned',
                     user=reassigned_by_user,
                     task=task,
-                    description=f"Note added via GET API: {note}"
+                    description=f"Task reassigned via GET API from {old_assignee_name} to {new_assignee.username}"
                 )
 
+                if note:
+                    ActivityLog.objects.create(
+                        action='comment_added',
+                        user=reassigned_by_user,
+                        task=task,
+                        description=f"Note added via GET API: {note}"
+                    )
+
         except Exception as e:
             logger.warning(f"Failed to log activity: {str(e)}")
 
@@ -1714,10 +1605,12 @@ def api_reassign_task(request, task_id, reassigned_by_email):
             'task_id': task.task_id,
             'previous_assignee': old_assignee_name,
             'new_assignee': new_assignee.username,
+            'version': task.version,
             'success': True
         })
 
     except Exception as e:
+        transaction.set_rollback(True)
         logger.error(f"Unexpected error in api_reassign_task: {str(e)}")
         return JsonResponse({
             'error': 'Internal server error',
@@ -1728,5 +1621,5 @@ def api_reassign_task(request, task_id, reassigned_by_email):
 @login_required
 def i_am_viewer(request):
     me = (request.user.email or "").lower()
-    tasks = Task.objects.filter(viewers__contains=[me]).order_by("-assigned_date")
+    tasks = task_list_queryset().filter(viewer_entries__email=me).order_by("-assigned_date")
     return render(request, "tasks/i_am_viewer.html", {"tasks": tasks})